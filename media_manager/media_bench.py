@@ -0,0 +1,230 @@
+"""
+Benchmarks of media_manager on a synthetic tree of generated JPEG/MP4 files, ex.:
+    python media_bench.py dates -i 2000 -v 500 -w 1 4 8
+    python media_bench.py formats -n 500
+    python media_bench.py index -i 20000 -v 5000
+    python media_bench.py dedup -i 2000 -v 500 --dups 0.2 --clashes 0.05
+"""
+import os
+import io
+import time
+import struct
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from PIL import Image
+import media_manager as mm
+
+
+def jpeg_bytes(created, size=(320, 240), seed=0):
+    """Small JPEG with camera-like EXIF: DateTime in IFD0 and DateTimeOriginal in the Exif IFD
+    """
+    rnd = random.Random(seed)
+    img = Image.new('RGB', size, (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    exif = Image.Exif()
+    exif[mm.EXIF_DATE_TAGS['DateTime']] = created.strftime('%Y:%m:%d %H:%M:%S')
+    exif.get_ifd(0x8769)[mm.EXIF_DATE_TAGS['DateTimeOriginal']] = created.strftime('%Y:%m:%d %H:%M:%S')
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', exif=exif, quality=70)
+    return buf.getvalue()
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def mp4_bytes(created, mdat_size=64 * 1024, brand=b'isom'):
+    """Minimal MP4 (ftyp, moov/mvhd with creation time, mdat of zeros), or MOV with brand 'qt  '
+    """
+    secs = int((created - datetime(1904, 1, 1)).total_seconds())
+    mvhd = (struct.pack('>B3xIIII', 0, secs, secs, 1000, 5000) + struct.pack('>IH', 0x10000, 0x100) + bytes(10)
+            + struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000) + bytes(24) + struct.pack('>I', 2))
+    return box(b'ftyp', brand + struct.pack('>I', 512) + brand + b'mp41') + box(b'moov', box(b'mvhd', mvhd)) \
+        + box(b'mdat', bytes(mdat_size))
+
+
+def heic_bytes(created, mdat_size=64 * 1024):
+    """Minimal HEIF layout (ftyp, meta with Exif item in iinf/iloc, mdat holding Exif then fake image data)
+    """
+    exif = Image.Exif()
+    exif[mm.EXIF_DATE_TAGS['DateTime']] = created.strftime('%Y:%m:%d %H:%M:%S')
+    exif.get_ifd(0x8769)[mm.EXIF_DATE_TAGS['DateTimeOriginal']] = created.strftime('%Y:%m:%d %H:%M:%S')
+    item = struct.pack('>I', 6) + exif.tobytes()
+    ftyp = box(b'ftyp', b'heic' + struct.pack('>I', 0) + b'mif1heic')
+    hdlr = box(b'hdlr', bytes(8) + b'pict' + bytes(13))
+    iinf = box(b'iinf', bytes(4) + struct.pack('>H', 1) + box(b'infe', b'\x02' + bytes(3) + struct.pack('>HH', 1, 0) + b'Exif\0'))
+
+    def meta(offset):
+        iloc = box(b'iloc', bytes(4) + bytes([0x44, 0]) + struct.pack('>HHHHII', 1, 1, 0, 1, offset, len(item)))
+        return box(b'meta', bytes(4) + hdlr + iinf + iloc)
+    offset = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(offset) + box(b'mdat', item + bytes(mdat_size))
+
+
+def make_tree(root, images, videos, per_dir=50, seed=1):
+    """Generate images JPEG and videos MP4 files in nested directories of per_dir files
+    """
+    rnd = random.Random(seed)
+    start = datetime(2010, 1, 1)
+    for i in range(images + videos):
+        created = start + timedelta(seconds=rnd.randrange(10 * 365 * 86400))
+        d = os.path.join(root, f"d{i // (per_dir * 10):03d}", f"s{i // per_dir:04d}")
+        os.makedirs(d, exist_ok=True)
+        if i < images:
+            data, name = jpeg_bytes(created, seed=i), f"IMG_{i:06d}.{'JPG' if i % 3 else 'jpg'}"
+        else:
+            data, name = mp4_bytes(created), f"VID_{i:06d}.{'MP4' if i % 2 else 'mov'}"
+        with open(os.path.join(d, name), 'wb') as f:
+            f.write(data)
+    return root
+
+
+media_date_source = mm.media_date_source
+LATENCY = 0.0
+
+
+def remote_media_date_source(media_file, media_type):
+    """media_date_source on a simulated remote share: each file access waits LATENCY sec
+    """
+    time.sleep(LATENCY)
+    return media_date_source(media_file, media_type)
+
+
+def bench_dates(args):
+    global LATENCY
+    root = args.dir or make_tree(tempfile.mkdtemp(), args.images, args.videos)
+    if args.latency:
+        LATENCY = args.latency / 1000.0
+        mm.media_date_source = remote_media_date_source
+    runs = [(1, 'serial')] + [(w, p) for w in args.workers if w > 1 for p in ('thread', 'process')]
+    for workers, pool in runs:
+        start = time.perf_counter()
+        n = sum(1 for _ in mm.yield_media_files(root, ('image', 'video'), workers=workers, pool=pool))
+        elapsed = time.perf_counter() - start
+        print(f"{pool:>8} x{workers:<3} {n} files in {elapsed:.2f}s: {n / elapsed:.0f} files/s")
+
+
+def bench_index(args):
+    """files/sec of a first run (dates extracted and indexed) vs reruns reusing the index
+    """
+    global LATENCY
+    root = args.dir or make_tree(tempfile.mkdtemp(), args.images, args.videos)
+    db_path = os.path.join(tempfile.mkdtemp(), 'media_index.sqlite')
+    if args.latency:
+        LATENCY = args.latency / 1000.0
+        mm.media_date_source = remote_media_date_source
+    for run in ('first', 'rerun', 'rerun'):
+        index = mm.MediaIndex(db_path)
+        start = time.perf_counter()
+        n = sum(1 for _ in mm.yield_media_files(root, ('image', 'video'), workers=args.workers, index=index))
+        elapsed = time.perf_counter() - start
+        print(f"{run:>6}: {n} files in {elapsed:.2f}s: {n / elapsed:.0f} files/s, "
+              f"{index.hits} unchanged, {index.misses} extracted")
+        index.close()
+    # stale entries pruned after removing files
+    removed = [f for i, (f, _) in enumerate(mm.scan_media_files(root)) if i % 10 == 0]
+    for f in removed:
+        os.remove(f)
+    index = mm.MediaIndex(db_path)
+    sum(1 for _ in mm.yield_media_files(root, ('image', 'video'), workers=args.workers, index=index))
+    left = index.conn.execute("SELECT count(*) FROM media").fetchone()[0]
+    print(f"removed {len(removed)} files: {left} entries left in index ({index.hits} unchanged)")
+    index.close()
+
+
+def bench_dedup(args):
+    """Move (copy) a tree holding duplicates under other names and different files under clashing 
+    names, twice: bytes hashed vs copied/saved, and files/sec
+    """
+    root = make_tree(tempfile.mkdtemp(), args.images, args.videos)
+    files = [f for f, _ in mm.scan_media_files(root)]
+    rnd = random.Random(2)
+    extra = os.path.join(root, 'extra')
+    os.makedirs(extra)
+    for i, f in enumerate(rnd.sample(files, int(len(files) * args.dups))):
+        shutil.copy2(f, os.path.join(extra, f"COPY_{i:06d}{os.path.splitext(f)[1]}"))
+    for f in rnd.sample([f for f in files if f.lower().endswith('.jpg')], int(len(files) * args.clashes)):
+        created = mm.derive_media_date(f, 'image')
+        clash_dir = os.path.join(extra, 'clash', os.path.basename(os.path.dirname(f)))
+        os.makedirs(clash_dir, exist_ok=True)
+        with open(os.path.join(clash_dir, os.path.basename(f)), 'wb') as fw:
+            fw.write(jpeg_bytes(created, seed=-1))
+    tgt = tempfile.mkdtemp()
+    for run in ('first', 'rerun'):
+        start = time.perf_counter()
+        content_index = mm.move_media_files(root, tgt, ('image', 'video'), '%Y', True, False, dedup=args.dedup)
+        elapsed = time.perf_counter() - start
+        print(f"{run:>6}: {elapsed:.2f}s, {content_index.report()}")
+
+
+FORMATS = dict(
+    jpeg=('image', '.jpg', jpeg_bytes, mm.image_creation_date),
+    heic=('image', '.heic', heic_bytes, mm.image_creation_date),
+    mp4=('video', '.mp4', mp4_bytes, mm.video_creation_date),
+    mov=('video', '.mov', lambda created: mp4_bytes(created, brand=b'qt  '), mm.video_creation_date),
+)
+
+
+def bench_formats(args):
+    """files/sec of header reader vs current PIL/hachoir extractor, per format
+    """
+    root = tempfile.mkdtemp()
+    rnd = random.Random(1)
+    # current extractor logs an error for every HEIC (not supported by PIL)
+    mm.logger.setLevel(logging.CRITICAL)
+    for fmt in args.formats:
+        media_type, ext, make, extractor = FORMATS[fmt]
+        files, expected = [], []
+        for i in range(args.number):
+            created = datetime(2010, 1, 1) + timedelta(seconds=rnd.randrange(10 * 365 * 86400))
+            files.append(os.path.join(root, f"{fmt}_{i:05d}{ext}"))
+            expected.append(created)
+            with open(files[-1], 'wb') as f:
+                f.write(make(created))
+        for name, reader in (('header', mm.header_creation_date), ('current', extractor)):
+            start = time.perf_counter()
+            found = [reader(f) for f in files]
+            elapsed = time.perf_counter() - start
+            # hachoir returns the date only
+            matched = sum(1 for d, e in zip(found, expected) if d and d.date() == e.date())
+            print(f"{fmt:>5} {name:>8}: {len(files) / elapsed:8.0f} files/s, {matched}/{len(files)} dates matched")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="media_manager benchmarks")
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('dates', help="files/sec of scan + date extraction, serial vs pools of workers")
+    p.add_argument('-i', '--images', type=int, default=2000, help="Number of generated JPEG")
+    p.add_argument('-v', '--videos', type=int, default=500, help="Number of generated MP4")
+    p.add_argument('-w', '--workers', type=int, nargs='+', default=[4, 8], help="Pool sizes")
+    p.add_argument('--dir', help="Use this existing media tree instead of generating one")
+    p.add_argument('--latency', type=float, default=0, help="Simulated storage latency per file (ms, ex. SMB share)")
+    p.set_defaults(func=bench_dates)
+    p = sub.add_parser('index', help="files/sec of first run vs reruns with the persistent media index")
+    p.add_argument('-i', '--images', type=int, default=20000, help="Number of generated JPEG")
+    p.add_argument('-v', '--videos', type=int, default=5000, help="Number of generated MP4")
+    p.add_argument('-w', '--workers', type=int, default=1, help="Pool size (1: no pool)")
+    p.add_argument('--dir', help="Use this existing media tree instead of generating one")
+    p.add_argument('--latency', type=float, default=0, help="Simulated storage latency per file (ms, ex. SMB share)")
+    p.set_defaults(func=bench_index)
+    p = sub.add_parser('dedup', help="bytes hashed/saved and time of moving a tree with duplicates and name clashes")
+    p.add_argument('-i', '--images', type=int, default=2000, help="Number of generated JPEG")
+    p.add_argument('-v', '--videos', type=int, default=500, help="Number of generated MP4")
+    p.add_argument('--dups', type=float, default=0.2, help="Fraction of files duplicated under another name")
+    p.add_argument('--clashes', type=float, default=0.05, help="Fraction of files with a different file of same name")
+    p.add_argument('--dedup', choices=('skip', 'link'), default='skip')
+    p.set_defaults(func=bench_dedup)
+    p = sub.add_parser('formats', help="files/sec of header-only date reader vs PIL/hachoir, per format")
+    p.add_argument('-n', '--number', type=int, default=500, help="Number of generated files per format")
+    p.add_argument('-f', '--formats', nargs='+', choices=list(FORMATS), default=list(FORMATS))
+    p.set_defaults(func=bench_formats)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    mm.init_logger(logging.WARNING)
+    args.func(args)
@@ -1,10 +1,15 @@
 import os
-import glob
 import shutil
-from datetime import date, datetime
+import time
+import struct
+import sqlite3
+import hashlib
+from datetime import date, datetime, timedelta
 import platform
 import logging
 import argparse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 # pip install Pillow
 from PIL import Image, UnidentifiedImageError
 from PIL.ExifTags import TAGS
@@ -14,14 +19,27 @@ from hachoir.metadata import extractMetadata
 
 MEDIA_FILES_EXT =  dict(image=('jpeg', 'jpg', 'heic', 'bmp', 'png', 'gif', ), 
                         video=('avi', 'mp4', 'mov', 'hevc', '3gp', 'mkv', 'm4v'))
+# lowercase extension -> media type
+MEDIA_TYPE_OF_EXT = {e: t for t, exts in MEDIA_FILES_EXT.items() for e in exts}
 
 # possible exif tag-ids for Image creation-date 
 EXIF_DATE_TAGS = dict(DateTimeOriginal=36867, 
                       DateTime=306)
 VID_DATE_META = 'creation date'
+EXIF_IFD_POINTER = 0x8769
+# ftyp brands of HEIF images, and first box types of MP4/MOV files
+HEIF_BRANDS = (b'heic', b'heix', b'heim', b'heis', b'mif1', b'msf1')
+MP4_BOXES = (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')
+MP4_EPOCH = datetime(1904, 1, 1)
 
 logger = None
 
+def init_logger(loglevel):
+    global logger
+    logging.basicConfig()
+    logger = logging.getLogger(__name__)
+    logger.setLevel(loglevel)
+
 def file_creation_date(filepath):
     """
     Return  file creation date, falling back to when it was last modified.
@@ -55,8 +73,9 @@ def image_creation_date(img_filepath):
         logger.error(e)
     else:
         if img_exif:
-            all_tags = [f"{TAGS.get(k,'Unknonw tag')}({k}): {v}({v.__class__.__name__})" for k,v in img_exif.items()] 
-            logger.debug(f"Exif metadata for {img_filepath!r}:\n{' | '.join(all_tags)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                all_tags = [f"{TAGS.get(k,'Unknonw tag')}({k}): {v}({v.__class__.__name__})" for k,v in img_exif.items()] 
+                logger.debug(f"Exif metadata for {img_filepath!r}:\n{' | '.join(all_tags)}")
             for n,k in EXIF_DATE_TAGS.items():
                 try:
                     extracted_date = datetime.strptime(img_exif[k],date_pattern) if img_exif.get(k) else datetime.max
@@ -91,46 +110,561 @@ def video_creation_date(mov_filepath):
             return datetime.strptime(date_comp_str, "%Y-%m-%d")
     return None
 
-def derive_media_date(media_file, media_type):
+def exif_date(tiff):
+    """Return earliest date of EXIF_DATE_TAGS found in EXIF data (TIFF structure), DateTime 
+    being in IFD0 and DateTimeOriginal in the Exif sub-IFD
+    """
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if not endian:
+        return None
+    date_tags = set(EXIF_DATE_TAGS.values())
+    values = []
+    ifds = [struct.unpack_from(endian + 'I', tiff, 4)[0]]
+    # offsets of IFDs already read (a corrupt pointer may loop back to an IFD)
+    visited = set()
+    while ifds:
+        offset = ifds.pop()
+        if offset in visited:
+            continue
+        visited.add(offset)
+        for i in range(struct.unpack_from(endian + 'H', tiff, offset)[0]):
+            tag, _, count, value = struct.unpack_from(endian + 'HHI4s', tiff, offset + 2 + 12 * i)
+            if tag == EXIF_IFD_POINTER:
+                ifds.append(struct.unpack(endian + 'I', value)[0])
+            elif tag in date_tags:
+                if count > 4:
+                    value_offset = struct.unpack(endian + 'I', value)[0]
+                    value = tiff[value_offset:value_offset + count]
+                values.append(value[:count].split(b'\0')[0].decode('ascii', 'replace'))
     found_date = None
-    # 1- attempt to get date from metadata/header
+    for v in values:
+        try:
+            extracted_date = datetime.strptime(v, '%Y:%m:%d %H:%M:%S')
+        except ValueError:
+            logger.debug(f"Unrecognized Exif date {v!r}")
+        else:
+            found_date = min(found_date or extracted_date, extracted_date)
+    return found_date
+
+
+def jpeg_exif(f):
+    """Return EXIF data of the APP1 segment, read before the image data
+    """
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        head = f.read(4)
+        if len(head) < 4 or head[0] != 0xff or head[1] in (0xd9, 0xda):
+            return None
+        length = struct.unpack('>H', head[2:])[0]
+        if head[1] == 0xe1:
+            segment = f.read(length - 2)
+            if segment[:6] == b'Exif\0\0':
+                return segment[6:]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def iter_boxes(f, end):
+    """Generate (type, payload start, box end) of ISO-BMFF boxes (atoms) from current position up to end, 
+    seeking over box payloads (ex. mdat)
+    """
+    while True:
+        pos = f.tell()
+        if pos + 8 > end:
+            return
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        start = pos + 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            start += 8
+        elif size == 0:
+            size = end - pos
+        if pos + size < start or pos + size > end:
+            return
+        yield box_type, start, pos + size
+        f.seek(pos + size)
+
+
+def heic_exif(f, end):
+    """Return EXIF data of a HEIF image: the 'Exif' item (iinf) located by iloc in meta box
+    """
+    for box_type, _, box_end in iter_boxes(f, end):
+        if box_type != b'meta':
+            continue
+        f.read(4)
+        exif_id, locations = None, dict()
+        for child_type, start, child_end in iter_boxes(f, box_end):
+            if child_type == b'iinf':
+                exif_id = heif_item_id(f.read(child_end - start), b'Exif')
+            elif child_type == b'iloc':
+                locations = heif_item_locations(f.read(child_end - start))
+        if exif_id not in locations:
+            return None
+        offset, length = locations[exif_id]
+        f.seek(offset)
+        item = f.read(length)
+        # item starts with the offset of TIFF header (after 'Exif\0\0')
+        return item[4 + struct.unpack('>I', item[:4])[0]:]
+    return None
+
+
+def heif_item_id(iinf, item_type):
+    version = iinf[0]
+    pos = 6 if version == 0 else 8
+    while pos + 8 <= len(iinf):
+        size, box_type = struct.unpack_from('>I4s', iinf, pos)
+        if size < 8:
+            break
+        if box_type == b'infe' and iinf[pos + 8] in (2, 3):
+            if iinf[pos + 8] == 2:
+                item_id, found_type = struct.unpack_from('>H', iinf, pos + 12)[0], iinf[pos + 16:pos + 20]
+            else:
+                item_id, found_type = struct.unpack_from('>I', iinf, pos + 12)[0], iinf[pos + 18:pos + 22]
+            if found_type == item_type:
+                return item_id
+        pos += size
+    return None
+
+
+def heif_item_locations(iloc):
+    """Return dict item_id -> (file offset, length) of first extent of items stored in file
+    """
+    version = iloc[0]
+    offset_size, length_size = iloc[4] >> 4, iloc[4] & 15
+    base_offset_size, index_size = iloc[5] >> 4, iloc[5] & 15 if version in (1, 2) else 0
+    pos = 6
+
+    def read(n):
+        nonlocal pos
+        pos += n
+        return int.from_bytes(iloc[pos - n:pos], 'big')
+
+    locations = dict()
+    for _ in range(read(2 if version < 2 else 4)):
+        item_id = read(2 if version < 2 else 4)
+        construction_method = read(2) & 15 if version in (1, 2) else 0
+        read(2)
+        base_offset = read(base_offset_size)
+        extents = list()
+        for _ in range(read(2)):
+            read(index_size)
+            extents.append((base_offset + read(offset_size), read(length_size)))
+        if construction_method == 0 and extents:
+            locations[item_id] = extents[0]
+    return locations
+
+
+def mp4_creation_date(f, end):
+    """Return creation time of movie header (moov/mvhd) of MP4/MOV, seconds since 1904 in UTC
+    """
+    for box_type, _, box_end in iter_boxes(f, end):
+        if box_type == b'moov':
+            for child_type, _, _ in iter_boxes(f, box_end):
+                if child_type == b'mvhd':
+                    header = f.read(12)
+                    seconds = struct.unpack_from('>Q' if header[0] == 1 else '>I', header, 4)[0]
+                    return MP4_EPOCH + timedelta(seconds=seconds) if seconds else None
+            return None
+    return None
+
+
+def header_creation_date(media_file):
+    """Return creation date read from the few header bytes holding metadata (EXIF of JPEG/HEIC, 
+    mvhd of MP4/MOV), identifying format from content, or None when not found
+    """
+    try:
+        with open(media_file, 'rb') as f:
+            head = f.read(12)
+            end = os.fstat(f.fileno()).st_size
+            f.seek(0)
+            if head[:2] == b'\xff\xd8':
+                tiff = jpeg_exif(f)
+            elif head[4:8] == b'ftyp' and head[8:12] in HEIF_BRANDS:
+                tiff = heic_exif(f, end)
+            elif head[4:8] in MP4_BOXES:
+                return mp4_creation_date(f, end)
+            else:
+                return None
+            return exif_date(tiff) if tiff else None
+    except (OSError, struct.error, IndexError, ValueError) as e:
+        logger.debug(f"Cannot read header of {media_file!r}: {e}")
+        return None
+
+
+def media_date_source(media_file, media_type):
+    """Return tuple(creation_date, source) with source of the date: 'header', 'exif' (PIL), 
+    'video meta' (hachoir) or 'file' (OS creation date)
+    """
+    # 1- attempt to get date from header bytes, or else from metadata parsed by PIL/hachoir
+    found_date = header_creation_date(media_file)
+    if found_date:
+        return found_date, 'header'
     if media_type == 'image':
-        found_date = image_creation_date(media_file)
+        found_date, source = image_creation_date(media_file), 'exif'
     else:
-        found_date = video_creation_date(media_file)
+        found_date, source = video_creation_date(media_file), 'video meta'
     
     # 2- fall back using file creation date (OS)
     if not found_date:
-        found_date = file_creation_date(media_file)
-    return found_date
+        found_date, source = file_creation_date(media_file), 'file'
+    return found_date, source
+
+
+def derive_media_date(media_file, media_type):
+    return media_date_source(media_file, media_type)[0]
+
+
+class MediaIndex:
+    """Persistent index (SQLite) of derived media dates keyed by path, valid while file size, mtime 
+    and inode are unchanged, so reruns skip date extraction of unchanged files. Entries of files 
+    not seen by a complete scan are pruned.
+    """
+    def __init__(self, db_path, commit_every=1000):
+        self.db_path = db_path
+        self.commit_every = commit_every
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS media (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                          "inode INTEGER, media_type TEXT, media_date TEXT, source TEXT, run INTEGER)")
+        self.run = self.conn.execute("SELECT coalesce(max(run), 0) + 1 FROM media").fetchone()[0]
+        self.writes = 0
+        self.seen = []
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, path, media_type):
+        """Return tuple(file key, (creation_date, source)) when path is indexed with same key, 
+        or else tuple(file key, None)
+        """
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        row = self.conn.execute("SELECT size, mtime_ns, inode, media_date, source FROM media "
+                                "WHERE path = ? AND media_type = ?", (path, media_type)).fetchone()
+        if row and row[:3] == key:
+            self.hits += 1
+            self.seen.append((self.run, path))
+            if len(self.seen) >= self.commit_every:
+                self.commit()
+            return key, (datetime.fromisoformat(row[3]), row[4])
+        self.misses += 1
+        return key, None
+
+    def store(self, path, media_type, key, media_date, source):
+        self._write("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, *key, media_type, media_date.isoformat(), source, self.run))
+
+    def _write(self, sql, params):
+        self.conn.execute(sql, params)
+        self.writes += 1
+        if self.writes % self.commit_every == 0:
+            self.commit()
+
+    def commit(self):
+        # unchanged files are marked seen by batch
+        self.conn.executemany("UPDATE media SET run = ? WHERE path = ?", self.seen)
+        self.seen = []
+        self.conn.commit()
+
+    def prune(self, src_dir, media_types, failed_dirs=()):
+        """Delete entries of media_types under src_dir not seen in this run (files removed, renamed 
+        or moved), except under failed_dirs (not scanned), return number of entries deleted
+        """
+        self.commit()
+        prefix = os.path.join(src_dir, '')
+        excluded = [os.path.join(d, '') for d in failed_dirs]
+        cursor = self.conn.execute(f"DELETE FROM media WHERE run != ? AND substr(path, 1, ?) = ? "
+                                   f"AND media_type IN ({', '.join('?' * len(media_types))})"
+                                   + " AND substr(path, 1, ?) != ?" * len(excluded),
+                                   (self.run, len(prefix), prefix, *media_types,
+                                    *(v for e in excluded for v in (len(e), e))))
+        self.conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+        logger.info(f"Media index {self.db_path!r}: {self.hits} unchanged files, {self.misses} extracted")
+
+class ScanStats:
+    """Progress of a directory scan, logged every `report_every` sec
+    """
+    def __init__(self, report_every=10):
+        self.report_every = report_every
+        self.dirs = 0
+        self.files = 0
+        self.media = 0
+        # directories which could not be scanned
+        self.failed_dirs = []
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    def report(self, final=False):
+        now = time.monotonic()
+        if not final and now - self.last_report < self.report_every:
+            return
+        self.last_report = now
+        elapsed = max(now - self.start, 1e-9)
+        logger.info(f"{'Scanned' if final else 'Scanning'} {self.dirs} dirs ({self.dirs / elapsed:.0f}/s), "
+                    f"{self.files} files ({self.files / elapsed:.0f}/s), {self.media} media files in {elapsed:.1f}s"
+                    + (f", {len(self.failed_dirs)} dirs failed" if self.failed_dirs else ""))
+
 
-def yield_media_files(src_dir, media_type):
-    """Generate tuple(media-filepath, creation_date)
-    from files found recursively in source_dir with file_exts
+class ContentIndex:
+    """Persistent index (SQLite) of the target library content, finding files of identical content: 
+    candidates of same size, then same partial hash (head and tail blocks), then same full hash. 
+    Hashes are computed only when needed and kept while file size and mtime are unchanged.
     """
-    files_ext = MEDIA_FILES_EXT[media_type]
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS content (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                          "partial TEXT, full TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS content_size ON content (size, partial)")
+        self.copied = 0
+        self.duplicates = 0
+        self.renamed = 0
+        self.bytes_copied = 0
+        self.bytes_saved = 0
+        self.bytes_hashed = 0
+
+    def sync(self, tgt_dir):
+        """Update index with media files of tgt_dir added, changed or removed outside of this tool
+        """
+        prefix = os.path.join(tgt_dir, '')
+        indexed = {path: (size, mtime_ns) for path, size, mtime_ns in self.conn.execute(
+            "SELECT path, size, mtime_ns FROM content WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))}
+        for path, _ in scan_media_files(tgt_dir, tuple(MEDIA_FILES_EXT)):
+            st = os.stat(path)
+            if indexed.pop(path, None) != (st.st_size, st.st_mtime_ns):
+                self.conn.execute("INSERT OR REPLACE INTO content VALUES (?, ?, ?, NULL, NULL)",
+                                  (path, st.st_size, st.st_mtime_ns))
+        self.conn.executemany("DELETE FROM content WHERE path = ?", ((path,) for path in indexed))
+        self.conn.commit()
+
+    def partial_hash(self, path, size):
+        with open(path, 'rb') as f:
+            h = hashlib.blake2b(f.read(self.BLOCK_SIZE), digest_size=16)
+            if size > 2 * self.BLOCK_SIZE:
+                f.seek(-self.BLOCK_SIZE, os.SEEK_END)
+            h.update(f.read())
+        self.bytes_hashed += min(size, 2 * self.BLOCK_SIZE)
+        return h.hexdigest()
 
-    # for non-Windows, include case-sensitive extension 
-    if platform.system () != 'Windows':
-        files_ext = [e.upper() if i<len(files_ext) else e.lower() for i,e in enumerate(files_ext*2) ]
+    def full_hash(self, path, size, partial=None):
+        if size <= 2 * self.BLOCK_SIZE:
+            # partial hash reads the whole file
+            return partial or self.partial_hash(path, size)
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(16 * self.BLOCK_SIZE), b''):
+                h.update(block)
+        self.bytes_hashed += size
+        return h.hexdigest()
 
-    file_patterns = [os.path.join(src_dir, "**", f"*.{e}") for e in files_ext]
+    def duplicate_of(self, path, size, hashes):
+        """Return path of an indexed file with same content as path, or None. Hashes computed for 
+        path are set in dict hashes (keys 'partial', 'full'), and those of candidates are indexed
+        """
+        if not self.conn.execute("SELECT 1 FROM content WHERE size = ? LIMIT 1", (size,)).fetchone():
+            return None
+        if 'partial' not in hashes:
+            hashes['partial'] = self.partial_hash(path, size)
+        candidates = self.conn.execute("SELECT path, partial, full FROM content WHERE size = ? AND "
+                                       "(partial IS NULL OR partial = ?)", (size, hashes['partial'])).fetchall()
+        for candidate, partial, full in candidates:
+            try:
+                if not partial:
+                    partial = self.partial_hash(candidate, size)
+                    self.conn.execute("UPDATE content SET partial = ? WHERE path = ?", (partial, candidate))
+                if partial != hashes['partial']:
+                    continue
+                if 'full' not in hashes:
+                    hashes['full'] = self.full_hash(path, size, hashes['partial'])
+                if not full:
+                    full = self.full_hash(candidate, size, partial)
+                    self.conn.execute("UPDATE content SET full = ? WHERE path = ?", (full, candidate))
+                if full == hashes['full']:
+                    return candidate
+            except OSError as e:
+                logger.warning(f"Cannot hash indexed file {candidate!r}: {e}")
+        return None
+
+    def add(self, path, hashes):
+        st = os.stat(path)
+        self.conn.execute("INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?, ?)",
+                          (path, st.st_size, st.st_mtime_ns, hashes.get('partial'), hashes.get('full')))
+
+    def place(self, m_file, tgt_filepath, link=False):
+        """Return tuple(target filepath where m_file content must be copied, hashes to add once copied), 
+        or tuple(None, hashes) when this content is already in the library (a hard link to it is made 
+        at tgt_filepath when link). A different content with same name gets the deterministic suffix 
+        of its hash, ex. IMG_0001_1f2e3d4c.JPG
+        """
+        size = os.path.getsize(m_file)
+        hashes = dict()
+        existing = self.duplicate_of(m_file, size, hashes)
+        if existing:
+            self.duplicates += 1
+            self.bytes_saved += size
+            logger.info(f"Same content as {existing!r}: {m_file!r}")
+            if link and not os.path.exists(tgt_filepath):
+                try:
+                    os.link(existing, tgt_filepath)
+                except OSError as e:
+                    logger.warning(f"Cannot link {tgt_filepath!r} to {existing!r}: {e}")
+                else:
+                    self.add(tgt_filepath, hashes)
+            return None, hashes
+        if os.path.exists(tgt_filepath):
+            if 'full' not in hashes:
+                hashes['full'] = self.full_hash(m_file, size, hashes.get('partial'))
+            root, ext = os.path.splitext(tgt_filepath)
+            tgt_filepath = f"{root}_{hashes['full'][:8]}{ext}"
+            self.renamed += 1
+            logger.info(f"Different content under same name, copied as {tgt_filepath!r}: {m_file!r}")
+        self.copied += 1
+        self.bytes_copied += size
+        return tgt_filepath, hashes
 
-    for p in file_patterns:
-        ctn = 0 
-        for m_file in glob.iglob(f"{p}", recursive=True):
-            ctn += 1
-            yield((m_file, derive_media_date(m_file, media_type=media_type)))
-        logger.info(f"Found {ctn} media files matching {p!r}")
+    def report(self):
+        return (f"{self.copied} files copied ({self.bytes_copied / 2**20:.1f} MB, {self.renamed} renamed), "
+                f"{self.duplicates} duplicates not copied ({self.bytes_saved / 2**20:.1f} MB saved), "
+                f"{self.bytes_hashed / 2**20:.1f} MB hashed")
 
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
 
-def move_media_files(src_dir, tgt_dir, media_type, dir_pattern, keep_original, overwrite, media_subdir=False):
+
+def scan_media_files(src_dir, media_types=('image', 'video'), stats=None):
+    """Generate tuple(media-filepath, media-type) walking src_dir once with os.scandir, 
+    classifying files by their case-insensitive extension. As with glob, hidden files and 
+    directories are skipped, and symlinked directories are not followed (avoiding loops)
+    """
+    stats = stats or ScanStats()
+    pending = [src_dir]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as it:
+                stats.dirs += 1
+                subdirs = []
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    stats.files += 1
+                    m_type = MEDIA_TYPE_OF_EXT.get(os.path.splitext(entry.name)[1][1:].lower())
+                    if m_type in media_types and entry.is_file():
+                        stats.media += 1
+                        yield entry.path, m_type
+        except OSError as e:
+            logger.warning(f"Cannot scan directory {current!r}: {e}")
+            stats.failed_dirs.append(current)
+            continue
+        # visit subdirs in name order
+        pending.extend(sorted(subdirs, reverse=True))
+        stats.report()
+    stats.report(final=True)
+
+
+def extract_media_dates(media_files, workers=4, pool='thread', index=None):
+    """Generate tuple(media-filepath, media-type, creation_date) for tuple(media-filepath, media-type) 
+    of media_files, extracting dates concurrently in a pool of workers (threads, or processes 
+    for CPU-bound parsing). At most 4 files per worker are in-flight, so the scan is paused 
+    (backpressure) when copying lags behind. Files are generated in the order received.
+    Files unchanged in index are not submitted to workers.
+    """
+    if pool == 'process':
+        executor = ProcessPoolExecutor(workers, initializer=init_logger, initargs=(logger.level,))
+    else:
+        executor = ThreadPoolExecutor(workers, thread_name_prefix='media-date')
+
+    def completed(m_file, m_type, key, found):
+        if isinstance(found, Future):
+            found = found.result()
+            if index:
+                index.store(m_file, m_type, key, *found)
+        return m_file, m_type, found[0]
+
+    inflight = deque()
+    with executor:
+        for m_file, m_type in media_files:
+            key, found = index.lookup(m_file, m_type) if index else (None, None)
+            inflight.append((m_file, m_type, key, found or executor.submit(media_date_source, m_file, m_type)))
+            if len(inflight) >= 4 * workers:
+                yield completed(*inflight.popleft())
+        while inflight:
+            yield completed(*inflight.popleft())
+
+
+def yield_media_files(src_dir, media_types, workers=1, pool='thread', index=None):
+    """Generate tuple(media-filepath, media-type, creation_date)
+    from files found recursively in source_dir with media_types (single scan for all types), 
+    reusing dates of files unchanged in index (MediaIndex) and pruning it once the scan is complete 
+    (except under directories which could not be scanned)
+    """
+    if isinstance(media_types, str):
+        media_types = (media_types,)
+    stats = ScanStats()
+    media_files = scan_media_files(src_dir, media_types, stats)
+    if workers > 1:
+        yield from extract_media_dates(media_files, workers, pool, index)
+    else:
+        for m_file, m_type in media_files:
+            key, found = index.lookup(m_file, m_type) if index else (None, None)
+            if not found:
+                found = media_date_source(m_file, media_type=m_type)
+                if index:
+                    index.store(m_file, m_type, key, *found)
+            yield m_file, m_type, found[0]
+    if index:
+        if stats.failed_dirs:
+            logger.warning(f"Media index not pruned under {len(stats.failed_dirs)} directories which could not be scanned")
+        logger.info(f"Pruned {index.prune(src_dir, media_types, stats.failed_dirs)} stale entries of media index")
+
+
+def move_media_files(src_dir, tgt_dir, media_types, dir_pattern, keep_original, overwrite, media_subdir=False,
+                     workers=1, pool='thread', index_path=None, dedup=None):
+    """With dedup ('skip' or 'link'), files whose content is already in tgt_dir are not copied (skipped, 
+    or hard linked for 'link'), and a different content with an existing name is copied under a 
+    suffixed name (overwrite is ignored). The ContentIndex (returned) of tgt_dir is kept in 
+    tgt_dir/.media_content.sqlite
+    """
     tgt_dir = os.path.abspath(tgt_dir)
     src_dir = os.path.abspath(src_dir)
     if not os.path.exists(src_dir):
         raise Exception(f"Source dir {src_dir!r} does not exist")
 
-    for m_file, m_date in yield_media_files(src_dir, media_type=media_type):
+    index = MediaIndex(index_path) if index_path else None
+    content_index = None
+    if dedup:
+        os.makedirs(tgt_dir, exist_ok=True)
+        content_index = ContentIndex(os.path.join(tgt_dir, '.media_content.sqlite'))
+        content_index.sync(tgt_dir)
+    try:
+        _move_media_files(src_dir, tgt_dir, media_types, dir_pattern, keep_original, overwrite, media_subdir,
+                          workers, pool, index, content_index, dedup == 'link')
+    finally:
+        if index:
+            index.close()
+        if content_index:
+            content_index.close()
+    return content_index
+
+
+def _move_media_files(src_dir, tgt_dir, media_types, dir_pattern, keep_original, overwrite, media_subdir,
+                      workers, pool, index, content_index, link):
+    for m_file, media_type, m_date in yield_media_files(src_dir, media_types=media_types, workers=workers, pool=pool,
+                                                        index=index):
         subdir = f"{m_date.strftime(dir_pattern)}"
         if media_subdir:
             tgt_filepath = os.path.join(tgt_dir, subdir, media_type.capitalize(), os.path.basename(m_file))
@@ -139,12 +673,17 @@ def move_media_files(src_dir, tgt_dir, media_type, dir_pattern, keep_original, o
         
         if not os.path.exists(os.path.dirname(tgt_filepath)):
             os.makedirs(os.path.dirname(tgt_filepath))
-        else:
-            if os.path.exists(tgt_filepath) and not overwrite:
-                logger.info(f"Target File exists: {tgt_filepath!r}")
+        if content_index:
+            tgt_filepath, hashes = content_index.place(m_file, tgt_filepath, link)
+            if not tgt_filepath:
                 continue
+        elif os.path.exists(tgt_filepath) and not overwrite:
+            logger.info(f"Target File exists: {tgt_filepath!r}")
+            continue
         
         shutil.copy2(m_file, tgt_filepath)
+        if content_index:
+            content_index.add(tgt_filepath, hashes)
 
         if not keep_original:
             logger.debug(f"Deleting original file: {m_file!r}")
@@ -160,19 +699,23 @@ if __name__ == '__main__':
     parser.add_argument('-d','--dir_pattern', default="%Y", choices=("%Y", "%Y-%m", "%Y-%m-%d"), help="Directory template date name")
     parser.add_argument('-k', '--keep_ori', action='store_true', help="Keep original media file")
     parser.add_argument('-o', '--overwrite', action='store_true', help="Overwrite when target file is present")
+    parser.add_argument('-w', '--workers', type=int, default=4, help="Number of workers extracting media dates concurrently (1: no pool)")
+    parser.add_argument('-p', '--pool', choices=('thread', 'process'), default='thread', help="Workers pool type (process for CPU-bound parsing)")
+    parser.add_argument('-i', '--index', help="SQLite file indexing media dates, so reruns skip unchanged files")
+    parser.add_argument('-D', '--dedup', choices=('skip', 'link'), help="Do not copy content already in target dir (skip, or hard link it), and suffix different content with same name")
     parser.add_argument('-log', '--loglevel', default=logging._nameToLevel['WARNING'], choices=logging._nameToLevel.keys(), help="Provide loggin level")
     args = parser.parse_args()
     print(args)
 
     # logging minimum setup
-    logging.basicConfig()
-    logger = logging.getLogger(__name__)
-    logger.setLevel(args.loglevel)
+    init_logger(args.loglevel)
 
-    if args.media_type in ('all','image'):
-        move_media_files(args.src_dir, args.tgt_dir, 'image', args.dir_pattern, args.keep_ori, args.overwrite)
-    if args.media_type in ('all','video'):
-        move_media_files(args.src_dir, args.tgt_dir, 'video', args.dir_pattern, args.keep_ori, args.overwrite)
+    media_types = ('image', 'video') if args.media_type == 'all' else (args.media_type,)
+    content_index = move_media_files(args.src_dir, args.tgt_dir, media_types, args.dir_pattern, args.keep_ori,
+                                     args.overwrite, workers=args.workers, pool=args.pool, index_path=args.index,
+                                     dedup=args.dedup)
+    if content_index:
+        print(content_index.report())
         
 
 
@@ -0,0 +1,212 @@
+import pytest
+import struct
+from datetime import datetime
+from media_manager import *
+import media_bench
+
+
+init_logger(logging.DEBUG)
+
+
+def tiff_bytes(entries):
+    """Little-endian TIFF with a single IFD (at offset 8) of (tag, type, count, 4 bytes value) entries
+    """
+    ifd = struct.pack('<H', len(entries)) + b''.join(struct.pack('<HHI4s', *e) for e in entries) + struct.pack('<I', 0)
+    return b'II*\0' + struct.pack('<I', 8) + ifd
+
+
+def test_exif_date_ifd_loop():
+    date = b'2019:07:14 10:20:30\0'
+    date_offset = 8 + 2 + 12 * 2 + 4
+    # Exif IFD pointer referencing IFD0 itself
+    tiff = tiff_bytes([(EXIF_DATE_TAGS['DateTime'], 2, len(date), struct.pack('<I', date_offset)),
+                       (EXIF_IFD_POINTER, 4, 1, struct.pack('<I', 8))]) + date
+    assert exif_date(tiff) == datetime(2019, 7, 14, 10, 20, 30)
+
+
+def test_index_not_pruned_under_failed_dirs(tmp_path, monkeypatch):
+    for d in ('a', 'b'):
+        (tmp_path / 'src' / d).mkdir(parents=True)
+        (tmp_path / 'src' / d / 'img.jpg').write_bytes(media_bench.jpeg_bytes(datetime(2019, 7, 14)))
+    src_dir, db_path = str(tmp_path / 'src'), str(tmp_path / 'index.sqlite')
+    index = MediaIndex(db_path)
+    assert len(list(yield_media_files(src_dir, 'image', index=index))) == 2
+    index.close()
+
+    # directory b unreadable on next run: its entries are kept
+    scandir = os.scandir
+    def failing_scandir(path):
+        if path.endswith('b'):
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    (tmp_path / 'src' / 'a' / 'img.jpg').unlink()
+    index = MediaIndex(db_path)
+    assert list(yield_media_files(src_dir, 'image', index=index)) == []
+    assert [p for p, in index.conn.execute("SELECT path FROM media")] == [os.path.join(src_dir, 'b', 'img.jpg')]
+    index.close()
+
+
+@pytest.mark.parametrize('ext, make', [('jpg', lambda d: media_bench.jpeg_bytes(d)),
+                                       ('heic', lambda d: media_bench.heic_bytes(d, mdat_size=1024)),
+                                       ('mp4', lambda d: media_bench.mp4_bytes(d, mdat_size=1024)),
+                                       ('mov', lambda d: media_bench.mp4_bytes(d, mdat_size=1024, brand=b'qt  '))])
+def test_header_creation_date(tmp_path, ext, make):
+    created = datetime(2019, 7, 14, 10, 20, 30)
+    path = tmp_path / ('media.' + ext)
+    path.write_bytes(make(created))
+    assert header_creation_date(str(path)) == created
+    # truncated or unknown content
+    path.write_bytes(make(created)[:30])
+    assert header_creation_date(str(path)) is None
+    path.write_bytes(b'not a media file')
+    assert header_creation_date(str(path)) is None
+
+
+def test_media_index(tmp_path):
+    src_dir = tmp_path / 'src'
+    src_dir.mkdir()
+    for name in ('a.jpg', 'b.jpg'):
+        (src_dir / name).write_bytes(media_bench.jpeg_bytes(datetime(2019, 7, 14)))
+    a, b = str(src_dir / 'a.jpg'), str(src_dir / 'b.jpg')
+    db_path = str(tmp_path / 'index.sqlite')
+    index = MediaIndex(db_path)
+    for path in (a, b):
+        key, found = index.lookup(path, 'image')
+        assert found is None
+        index.store(path, 'image', key, datetime(2019, 7, 14), 'header')
+    index.close()
+
+    # unchanged file hit, changed file missed, removed file pruned
+    (src_dir / 'b.jpg').write_bytes(media_bench.jpeg_bytes(datetime(2020, 1, 1), seed=1))
+    (src_dir / 'c.jpg').write_bytes(media_bench.jpeg_bytes(datetime(2019, 7, 14)))
+    os.remove(a)
+    index = MediaIndex(db_path)
+    assert index.run == 2
+    assert sorted((f, d) for f, _, d in yield_media_files(str(src_dir), 'image', index=index)) == [
+        (b, datetime(2020, 1, 1)), (str(src_dir / 'c.jpg'), datetime(2019, 7, 14))]
+    assert index.hits == 0 and index.misses == 2
+    assert sorted(p for p, in index.conn.execute("SELECT path FROM media")) == [b, str(src_dir / 'c.jpg')]
+    index.close()
+    index = MediaIndex(db_path)
+    assert index.lookup(b, 'image')[1] == (datetime(2020, 1, 1), 'header')
+    assert index.lookup(b, 'video')[1] is None
+    assert index.hits == 1 and index.misses == 1
+    index.close()
+
+
+def test_content_index_place(tmp_path):
+    src_dir, tgt_dir = tmp_path / 'src', tmp_path / 'tgt'
+    src_dir.mkdir()
+    tgt_dir.mkdir()
+    big = bytes(range(256)) * 1024
+    (tgt_dir / 'IMG_1.jpg').write_bytes(big)
+    # same size and same head/tail blocks, different middle
+    (src_dir / 'IMG_1.jpg').write_bytes(big[:len(big) // 2] + b'x' + big[len(big) // 2 + 1:])
+    (src_dir / 'IMG_2.jpg').write_bytes(big)
+    index = ContentIndex(str(tmp_path / 'content.sqlite'))
+    index.sync(str(tgt_dir))
+
+    def place(name, tgt_name, link=False):
+        tgt, hashes = index.place(str(src_dir / name), str(tgt_dir / tgt_name), link)
+        if tgt:
+            shutil.copy2(str(src_dir / name), tgt)
+            index.add(tgt, hashes)
+        return tgt
+
+    # duplicate content (same partial hash, same full hash) not copied, or hard linked
+    assert place('IMG_2.jpg', 'IMG_2.jpg') is None and not (tgt_dir / 'IMG_2.jpg').exists()
+    assert place('IMG_2.jpg', 'IMG_2.jpg', link=True) is None
+    assert os.path.samefile(str(tgt_dir / 'IMG_2.jpg'), str(tgt_dir / 'IMG_1.jpg'))
+    # different content (same size and partial hash) under same name gets the suffix of its hash
+    clash = place('IMG_1.jpg', 'IMG_1.jpg')
+    assert clash == str(tgt_dir / 'IMG_1_{}.jpg'.format(index.full_hash(clash, len(big))[:8]))
+    assert index.copied == 1 and index.renamed == 1 and index.duplicates == 2
+
+    # rerun: all contents already in the library
+    index.close()
+    index = ContentIndex(str(tmp_path / 'content.sqlite'))
+    index.sync(str(tgt_dir))
+    assert place('IMG_1.jpg', 'IMG_1.jpg') is None and place('IMG_2.jpg', 'IMG_2.jpg') is None
+    assert index.duplicates == 2 and index.copied == 0
+    assert sorted(os.listdir(str(tgt_dir))) == sorted(['IMG_1.jpg', 'IMG_2.jpg', os.path.basename(clash)])
+    index.close()
+
+
+def test_scan_media_files(tmp_path, monkeypatch):
+    for name in ('a.JPG', 'b.Mov', 'notes.txt', '.hidden.jpg', '.thumbs/c.jpg', 'sub/d.jpeg', 'locked/e.jpg'):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b'')
+    scanned = list()
+    scandir = os.scandir
+    def recording_scandir(path):
+        scanned.append(os.path.relpath(path, str(tmp_path)))
+        if path.endswith('locked'):
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+    monkeypatch.setattr(os, 'scandir', recording_scandir)
+    stats = ScanStats()
+    found = list(scan_media_files(str(tmp_path), ('image', 'video'), stats))
+    # images and videos (case-insensitive extensions) from a single walk, hidden entries skipped
+    assert sorted((os.path.relpath(f, str(tmp_path)), t) for f, t in found) == [
+        ('a.JPG', 'image'), ('b.Mov', 'video'), (os.path.join('sub', 'd.jpeg'), 'image')]
+    assert sorted(scanned) == ['.', 'locked', 'sub']
+    assert stats.failed_dirs == [str(tmp_path / 'locked')]
+    assert stats.dirs == 2 and stats.files == 4 and stats.media == 3
+
+
+def make_dated_images(src_dir, n):
+    src_dir.mkdir()
+    paths = list()
+    for i in range(n):
+        path = src_dir / 'img_{:02d}.jpg'.format(i)
+        path.write_bytes(media_bench.jpeg_bytes(datetime(2019, 1, 1 + i), size=(16, 16)))
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+def test_extract_media_dates_order(tmp_path, pool):
+    paths = make_dated_images(tmp_path / 'src', 12)
+    results = list(extract_media_dates([(p, 'image') for p in paths], workers=3, pool=pool))
+    assert results == [(p, 'image', datetime(2019, 1, 1 + i)) for i, p in enumerate(paths)]
+
+
+def test_extract_media_dates_backpressure(monkeypatch):
+    import random
+    import media_manager
+    rnd = random.Random(0)
+    def slow_date_source(m_file, media_type):
+        time.sleep(rnd.random() * 0.005)
+        return datetime(2019, 1, 1), 'file'
+    monkeypatch.setattr(media_manager, 'media_date_source', slow_date_source)
+    pulled = list()
+    def media_files():
+        for i in range(50):
+            pulled.append(i)
+            yield 'img_{}.jpg'.format(i), 'image'
+    workers = 2
+    for i, (m_file, _, _) in enumerate(extract_media_dates(media_files(), workers=workers)):
+        # in scan order, with at most 4 files per worker pulled from the scan and not yet generated
+        assert m_file == 'img_{}.jpg'.format(i)
+        assert len(pulled) - i <= 4 * workers
+    assert len(pulled) == 50
+
+
+def test_extract_media_dates_index(tmp_path, monkeypatch):
+    import media_manager
+    paths = make_dated_images(tmp_path / 'src', 6)
+    index = MediaIndex(str(tmp_path / 'index.sqlite'))
+    assert len(list(extract_media_dates([(p, 'image') for p in paths], workers=2, index=index))) == 6
+    index.close()
+    assert index.misses == 6
+
+    # dates stored on completion: second run only gets index hits, nothing submitted
+    def no_extraction(m_file, media_type):
+        raise AssertionError("date of {} extracted again".format(m_file))
+    monkeypatch.setattr(media_manager, 'media_date_source', no_extraction)
+    index = MediaIndex(str(tmp_path / 'index.sqlite'))
+    results = list(extract_media_dates([(p, 'image') for p in paths], workers=2, index=index))
+    assert results == [(p, 'image', datetime(2019, 1, 1 + i)) for i, p in enumerate(paths)]
+    assert index.hits == 6 and index.misses == 0
+    index.close()
@@ -7,16 +7,55 @@ Created on Wed Mar  7 10:28:47 2018
 
 from datetime import datetime, timedelta
 from collections import deque
+from array import array
+import math
+import bisect
+import heapq
+import itertools
+import csv
+import sys
+from collections import Counter
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import ruamel.yaml
 import argparse
 import importlib
-import schedule
 import time
 import os
 import getpass
 import smtplib, ssl
+import asyncio
+import threading
+import multiprocessing
+import queue
+import json
+import select
+import struct
+import pickle
+import gc
+import mmap
+import zlib
+import ctypes, ctypes.util
+# pip install websocket-client (also required by pushbullet.py)
+import websocket
+from concurrent.futures import ThreadPoolExecutor, Future
 from pushbullet import Pushbullet
+try:
+    # optional, used by bulk (vectorized) indicators
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    # optional, faster decoding of datafeed responses
+    import orjson as fast_json
+except ImportError:
+    try:
+        import ujson as fast_json
+    except ImportError:
+        fast_json = None
 
 #from notify_run import Notify
 #from pydrive.drive import GoogleDrive
@@ -28,55 +67,365 @@ class Bot(object):
         self.datafeed_services = datafeed_services
         self.event_trackers = event_trackers
 
-    def setup(self):
+    def setup(self, previous=None):
+        """Setup services and trackers, except those reused (unchanged in yaml) from a `previous` 
+        running Bot which keep their state (ticker history, connections..)
+        """
+        reused = self.reuse(previous) if previous else set()
         # optionally Bot can check if it's still active (ex. checkstate_every: "day_at_10:30")
         self.checkstate_every = getattr(self, 'checkstate_every', None)
+        # engine running trackers: 'schedule' (sequential) or 'asyncio' (concurrent, ex. engine: asyncio)
+        self.engine = getattr(self, 'engine', 'schedule')
+        assert self.engine in ('schedule', 'asyncio')
+        # optionally collect metrics, exported in Prometheus format on http://127.0.0.1:<metrics_port>/metrics 
+        # (also /profile/start and /profile/stop) and/or printed every metrics_every sec
+        self.metrics_port = getattr(self, 'metrics_port', None)
+        self.metrics_every = getattr(self, 'metrics_every', None)
+        metrics.enabled = bool(self.metrics_port or self.metrics_every)
+        self.metrics_server = MetricsServer(int(self.metrics_port)) if self.metrics_port else None
+        # optionally adapt polling interval of trackers to their price (see `TickerEventTracker.poll_factor`)
+        # ex. adaptive: {edge: 1.0, volatile: 1.0, quiet: 0.1, min_factor: 0.25, max_factor: 4}
+        self.adaptive = getattr(self, 'adaptive', None)
+
+        self.setup_notifications(reused)
+        for s in self.datafeed_services:
+            if s not in reused:
+                s.setup()
+        # limiters of rate limited services rebuilt from current config, shared by services of a same host
+        self.host_limiters = host_limiters(self.datafeed_services)
+        for s in self.datafeed_services:
+            if getattr(s, 'limiter', None):
+                s.limiter = self.host_limiters[urlsplit(s.url).hostname]
+        for e in self.event_trackers:
+            if e not in reused:
+                e.setup()
+        streams = [s for s in self.datafeed_services if isinstance(s, StreamingTickerDataFeed)]
+        subscribed = {s: set(s.symbols) for s in streams}
+        for s in streams:
+            s.unsubscribe_all()
+        for e in self.event_trackers:
+            if isinstance(e.datafeed_service, StreamingTickerDataFeed):
+                e.datafeed_service.subscribe(e, self.stream_events)
+        for s in streams:
+            if s not in reused:
+                s.start()
+            elif set(s.symbols) != subscribed[s]:
+                s.reconnect()
+        # optionally persist trackers state every snapshot_every sec (ex. snapshot_file: tracker_state.snap)
+        self.snapshot_file = getattr(self, 'snapshot_file', None)
+        self.snapshot_every = int(getattr(self, 'snapshot_every', 60))
+        if self.snapshot_file:
+            self.snapshots = StateSnapshot(self.snapshot_file)
+            # trackers state version (see `TickerEventTracker.state_version`) when last snapshotted
+            self.snapshot_versions = dict()
+            self.snapshot_trackers = self.tracker_states()
+            if not previous:
+                self.restore()
+        # optionally record all fetched tickers in per-datafeed host/symbol/day tick files (ex. record_dir: ticks, 
+        # record_every: 5), with a suffix per shard worker (see `run_shard`)
+        self.record_dir = getattr(self, 'record_dir', None)
+        self.recorder = None
+        if self.record_dir:
+            self.recorder = TickRecorder(self.record_dir, flush_every=float(getattr(self, 'record_every', 5)),
+                                         suffix=getattr(self, 'record_suffix', ''))
+            self.recorder.start()
+        if self.engine == 'asyncio':
+            self.executor = AsyncioTrackerEngine(self, max_workers=getattr(self, 'max_workers', 32))
+            self.executor.start()
+        self.schedule_trackers()
 
+    def setup_notifications(self, reused=()):
+        """Setup notification services (except `reused`) and their dispatchers
+        """
         for n in self.notification_services:
-            n.setup()
+            if n not in reused:
+                n.setup()
+        # optionally notify from background workers, ex. dispatch: {queue_size: 100, retries: 3, backoff: 1.0, 
+        # dead_letter: dead_letter.jsonl, when_full: merge}
+        self.dispatch = getattr(self, 'dispatch', None)
+        self.dispatchers = list()
+        if self.dispatch:
+            self.dispatchers = [NotificationDispatcher(n, **self.dispatch) for n in self.notification_services if n.active]
+            for d in self.dispatchers:
+                d.start()
+
+    def shutdown_notifications(self, keep=()):
+        """Stop dispatchers (after sending their queued events) and close notification services, except `keep`
+        """
+        for d in getattr(self, 'dispatchers', []):
+            d.stop()
+        for n in self.notification_services:
+            if n not in keep:
+                n.close()
+
+    def shutdown(self, keep=()):
+        """Stop the Bot and close its services, except those in `keep` (reused by a new Bot)
+        """
+        if getattr(self, 'executor', None):
+            self.executor.stop()
+            self.executor = None
+        if getattr(self, 'snapshot_file', None):
+            self.snapshot()
+            self.snapshots.close()
+        if getattr(self, 'recorder', None):
+            self.recorder.close()
+        if getattr(self, 'metrics_server', None):
+            self.metrics_server.close()
         for s in self.datafeed_services:
-            s.setup()
+            if s not in keep:
+                s.close()
+        self.shutdown_notifications(keep)
+
+    def reuse(self, previous):
+        """Replace services and trackers having the same yaml definition as in previous Bot by 
+        the previous (running) ones, shutdown previous Bot (keeping those reused) and return them
+        """
+        def reuse_list(new_objs, old_objs):
+            olds = dict()
+            for o in old_objs:
+                olds.setdefault(getattr(o, '_yaml_def', None), list()).append(o)
+            result = list()
+            for o in new_objs:
+                same = olds.get(getattr(o, '_yaml_def', None))
+                if same and o._yaml_def is not None:
+                    replaced[o] = same.pop(0)
+                    reused.add(replaced[o])
+                result.append(replaced.get(o, o))
+            return result
+
+        replaced = dict()
+        reused = set()
+        self.notification_services = reuse_list(self.notification_services, previous.notification_services)
+        self.datafeed_services = reuse_list(self.datafeed_services, previous.datafeed_services)
+        self.event_trackers = reuse_list(self.event_trackers, previous.event_trackers)
         for e in self.event_trackers:
-            e.setup()
-        self.schedule_trackers()
+            e.datafeed_service = replaced.get(e.datafeed_service, e.datafeed_service)
+        for r_s in getattr(self, 'run_schedules', []):
+            r_s['tracker'] = replaced.get(r_s['tracker'], r_s['tracker'])
+        previous.shutdown(keep=reused)
+        print("Bot reloaded, reusing {} of {} services and {} of {} trackers".format(
+              len([o for o in reused if not isinstance(o, EventTracker)]),
+              len(self.notification_services) + len(self.datafeed_services),
+              len([o for o in reused if isinstance(o, EventTracker)]), len(self.event_trackers)))
+        return reused
 
     def schedule_trackers(self):
-        schedule.clear()
-        # set all tracker defined in yaml to run
+        scheduler.clear()
+        # set all tracker defined in yaml to run, trackers sharing a batched datafeed and interval 
+        # are grouped to run from a single request
+        groups = dict()
         for r_s in getattr(self, 'run_schedules', []):
             interval_full = r_s['interval']
             interval_time = interval_full.lstrip('0123456789 ')
-            assert interval_time in ('seconds','minutes','hours')
+            assert interval_time in INTERVAL_UNITS
             val_int = int(interval_full[:-len(interval_time)])
-            schedule_scheme = getattr(schedule.every(val_int),interval_time)
             the_tracker = r_s['tracker']
-            schedule_scheme.do(self.run_tracker, the_tracker)
+            key = self.batch_key(the_tracker, val_int, interval_time) or id(r_s)
+            groups.setdefault(key, (val_int, interval_time, list()))[2].append(the_tracker)
+
+        # requests/sec of adapted jobs, per job and per host limiter
+        self.poll_rates = dict()
+        self.poll_load = dict()
+        for val_int, interval_time, trackers in groups.values():
+            batch_size = getattr(trackers[0].datafeed_service, 'batch_size', 20)
+            for i in range(0, len(trackers), batch_size):
+                batch = tuple(trackers[i:i+batch_size])
+                interval = val_int * INTERVAL_UNITS[interval_time]
+                name = "+".join(str(t.params.get('symbol', t)) for t in batch)
+                run = self.executor.submit if self.engine == 'asyncio' else self.run_trackers
+                timer = scheduler.every(interval, run, batch, name=name)
+                if self.adaptive:
+                    timer.func, timer.args = self.run_adaptive, (batch, run, timer, interval)
+                    self.adapt_interval(timer, batch, interval)
         
         if self.checkstate_every:
             scheme_n = self.checkstate_every[:self.checkstate_every.index('_at_')]
             at_s = self.checkstate_every[self.checkstate_every.index('_at_')+4:]
-            checkstate_scheme = getattr(schedule.every(), scheme_n)
-            checkstate_scheme.at(at_s).do(self.check_active)
+            scheduler.daily(scheme_n, at_s, self.check_active)
+        if self.snapshot_file:
+            scheduler.every(self.snapshot_every, self.snapshot)
+        if self.metrics_every:
+            scheduler.every(float(self.metrics_every), self.print_metrics)
+
+    def run_adaptive(self, trackers, run, job, base_interval):
+        run(trackers)
+        self.adapt_interval(job, trackers, base_interval)
+
+    def adapt_interval(self, job, trackers, base_interval):
+        """Set next interval of the job to its base_interval times the lowest poll factor of its 
+        trackers, slowed down when the host jobs together would exceed the host rate limit
+        """
+        factors = [t.poll_factor(**self.adaptive) for t in trackers if hasattr(t, 'poll_factor')]
+        interval = base_interval * min(factors, default=1.0)
+        limiter = getattr(trackers[0].datafeed_service, 'limiter', None)
+        if limiter:
+            load = self.poll_load.get(limiter, 0) - self.poll_rates.get(job, 0) + 1.0 / interval
+            self.poll_load[limiter] = load
+            self.poll_rates[job] = 1.0 / interval
+            if load > limiter.rate:
+                interval *= load / limiter.rate
+        job.interval = interval
+
+    def tracker_states(self):
+        """Trackers keyed by a name stable across restarts (symbol, datafeed url and request params)
+        """
+        keyed = dict()
+        for t in self.event_trackers:
+            key = "{}|{}|{}".format(getattr(t, 'symbol', None), getattr(t.datafeed_service, 'url', None),
+                                    sorted((t.request_params or dict()).items()))
+            n = 1
+            while key + "#{}".format(n) in keyed:
+                n += 1
+            keyed[key + "#{}".format(n)] = t
+        return keyed
+
+    def snapshot(self):
+        """Queue state of trackers changed since previous snapshot, only with their changed bytes 
+        (state of all trackers when a full snapshot is due), written by the `StateSnapshot` thread
+        """
+        full = self.snapshots.full_due()
+        if full:
+            self.snapshot_versions = dict()
+        keys, metas, changes = list(), list(), list()
+        for k, t in self.snapshot_trackers.items():
+            if not hasattr(t, 'get_state'):
+                continue
+            since, version = self.snapshot_versions.get(k), t.state_version()
+            if version != since:
+                meta, changed = t.get_state(since)
+                keys.append(k)
+                metas.append(meta)
+                changes.append(changed)
+                self.snapshot_versions[k] = version
+        self.snapshots.write((time.time(), keys, metas, changes), full)
+
+    def restore(self):
+        """Restore trackers from their saved state, from the file where each was saved last when 
+        restoring from several files (`restore_files` of shards, as trackers move between shards 
+        when rebalanced)
+        """
+        # many objects allocated and none garbage: no garbage collection (traversing all trackers) meanwhile
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            saved = dict()
+            for path in getattr(self, 'restore_files', None) or [self.snapshot_file]:
+                for state in StateSnapshot(path).read():
+                    if state[0] not in saved or state[1] > saved[state[0]][1]:
+                        saved[state[0]] = state
+            if not saved:
+                return
+            restored = 0
+            for k, t in self.tracker_states().items():
+                if k in saved and hasattr(t, 'set_state'):
+                    t.set_state(*saved[k][2:])
+                    restored += 1
+        finally:
+            if enabled:
+                gc.enable()
+        print("Restored state of {} tracker(s) from {}".format(restored, self.snapshot_file))
+
+    def batch_key(self, tracker, val_int, interval_time):
+        """Key grouping trackers fetched together, None when its datafeed has no `batch_param` 
+        (ex. batch_param: pair, for services accepting a comma-separated list of pairs)
+        """
+        batch_p = getattr(tracker.datafeed_service, 'batch_param', None)
+        request_p = getattr(tracker, 'request_params', None)
+        if not batch_p or not request_p or batch_p not in request_p:
+            return None
+        others = tuple(sorted((k, str(v)) for k, v in request_p.items() if k != batch_p))
+        return (id(tracker.datafeed_service), val_int, interval_time, others)
 
     def run_tracker(self, tracker):
-        request_p = getattr(tracker, 'request_params', None)
-        err_msg = None
+        self.run_trackers((tracker,))
+
+    def run_trackers(self, trackers):
         try:
-            service_response = tracker.datafeed_service.request(request_params=request_p)
+            service_response = self.fetch(trackers)
         except Exception as e:
-            events_msg = list()
-            events_msg.append(Event("Bot datafeed service raised error: {error}", error= str(e)))
+            events_msg = self.fetch_error_events(e)
         else:
-            events_msg = tracker.signal_events(service_response)
+            events_msg = self.signal_events(trackers, service_response)
+        self.notify_all(events_msg)
+
+    def fetch(self, trackers):
+        """Send a single request for all trackers (sharing the same datafeed)
+        """
+        return trackers[0].datafeed_service.request(request_params=self.request_params(trackers))
+
+    def request_params(self, trackers):
+        request_p = getattr(trackers[0], 'request_params', None)
+        if len(trackers) > 1:
+            batch_p = trackers[0].datafeed_service.batch_param
+            request_p = dict(request_p)
+            request_p[batch_p] = ",".join(dict.fromkeys(t.request_params[batch_p] for t in trackers))
+        return request_p
+
+    def signal_events(self, trackers, service_response):
+        if len(trackers) == 1:
+            events_msg = trackers[0].signal_events(service_response)
+            self.record_tickers(trackers)
+            return events_msg
+
+        batch_p = trackers[0].datafeed_service.batch_param
+        symbols = {t.request_params[batch_p]: t.symbol for t in trackers}
+        try:
+            tickers = ticker_response_multi_adapter(service_response, symbols, trackers[0].datafeed_service.url)
+        except Exception as e:
+            e_s = Event("Cannot signal events, error raised during response adapter: {}".format(e))
+            print(e_s.text)
+            return [e_s]
+
+        events_msg = list()
+        for t in trackers:
+            events_msg.extend(t.signal_ticker(tickers[t.request_params[batch_p]]))
+        self.record_tickers(trackers)
+        return events_msg
 
+    def stream_events(self, tracker, ticker):
+        """Called by streaming datafeed (outside of schedules) on every ticker update
+        """
+        self.notify_all(tracker.signal_ticker(ticker))
+        self.record_tickers([tracker])
+
+    def record_tickers(self, trackers):
+        """Record last ticker of trackers once per datafeed host and symbol (trackers of a same pair 
+        share the fetched ticker)
+        """
+        if self.recorder:
+            for t in trackers:
+                if getattr(t, 'current_ticker', None) is not None:
+                    self.recorder.record(t.datafeed_service.metric_name, t.current_ticker)
+
+    def fetch_error_events(self, error):
+        events_msg = list()
+        events_msg.append(Event("Bot datafeed service raised error: {error}", error= str(error)))
+        return events_msg
+
+    def notify_all(self, events_msg):
+        if getattr(self, 'dispatchers', None):
+            for d in self.dispatchers:
+                d.put(events_msg)
+            return
         for n in self.notification_services:
             n.notify(events_msg)
 
+    def print_metrics(self):
+        print("Metrics at {}:\n\t- {}".format(datetime.now(), "\n\t- ".join(metrics.summary())))
+
     def check_active(self):
         e_l = list()
-        e_l.append(Event("Bot still active", format_longtext=str(self)))
-        for n in self.notification_services:
-            n.notify(e_l)
+        longtext = str(self)
+        if getattr(self, 'executor', None):
+            longtext += self.executor.lag_report()
+        longtext += scheduler.report()
+        if self.dispatchers:
+            longtext += "\nNotifications:\n\t- " + "\n\t- ".join(d.report() for d in self.dispatchers)
+        cache_l = [s.cache_report() for s in self.datafeed_services if hasattr(s, 'cache_stats')]
+        if cache_l:
+            longtext += "\nDatafeed requests:\n\t- " + "\n\t- ".join(cache_l)
+        e_l.append(Event("Bot still active", format_longtext=longtext))
+        self.notify_all(e_l)
 
     def __str__(self):
         if hasattr(self, 'run_schedules') and len(self.run_schedules) > 0:
@@ -87,6 +436,565 @@ class Bot(object):
             return "Bot has no run schedules"
         
 
+class ShardedBot(object):
+    """Run the trackers of a YAML config in `shards` worker processes, partitioned by symbol 
+    or datafeed (trackers of a same group stay in the same shard). Workers send their events 
+    to this (notifier) process, which drops duplicates within the Bot `dedup_window` (sec) and 
+    sends them through the notification services. Shards are rebalanced on reload.
+    """
+    def __init__(self, yaml_content, shards, shard_by='datafeed'):
+        assert shard_by in ('symbol', 'datafeed')
+        self.yaml_content = yaml_content
+        self.shards = shards
+        self.shard_by = shard_by
+        self.workers = list()
+        self.events_queue = multiprocessing.Queue()
+        self.sent = dict()
+
+    def start(self):
+        self.bot = load_bot(self.yaml_content)
+        self.bot.checkstate_every = getattr(self.bot, 'checkstate_every', None)
+        self.dedup_window = float(getattr(self.bot, 'dedup_window', 10))
+        self.bot.setup_notifications()
+        self.partitions = partition_trackers(self.bot.event_trackers, self.shards, self.shard_by)
+        # set to ask workers to exit
+        self.stop_event = multiprocessing.Event()
+        for i, tracker_indexes in enumerate(self.partitions):
+            if tracker_indexes:
+                w = multiprocessing.Process(target=run_shard, name='tracker-shard-{}'.format(i),
+                                            args=(self.yaml_content, tracker_indexes, self.events_queue, i, self.shards,
+                                                  self.stop_event),
+                                            daemon=True)
+                w.start()
+                self.workers.append(w)
+        scheduler.clear()
+        if self.bot.checkstate_every:
+            scheme_n = self.bot.checkstate_every[:self.bot.checkstate_every.index('_at_')]
+            at_s = self.bot.checkstate_every[self.bot.checkstate_every.index('_at_')+4:]
+            scheduler.daily(scheme_n, at_s, self.check_active)
+
+    def stop(self, timeout=30):
+        """Ask workers to exit (saving their state snapshot and recorded ticks) and notify their last events, 
+        terminating workers still alive after timeout sec, then close the notification services
+        """
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        while any(w.is_alive() for w in self.workers) and time.monotonic() < deadline:
+            # a worker exits only once its queued events are read
+            self.dispatch(timeout=0.1)
+        for w in self.workers:
+            if w.is_alive():
+                print("Shard worker {} still running after {} sec, terminated".format(w.name, timeout))
+                w.terminate()
+            w.join()
+        self.dispatch(timeout=0)
+        self.workers = list()
+        self.bot.shutdown_notifications()
+
+    def reload(self, yaml_content):
+        try:
+            load_bot(yaml_content)
+        except Exception as e:
+            print("Invalid yaml config, keeping the running shards: {!r}".format(e))
+            return
+        self.stop()
+        self.yaml_content = yaml_content
+        self.start()
+
+    def dispatch(self, timeout=1):
+        """Wait up to timeout sec for events, and notify all events received (without duplicates) at once
+        """
+        events = list()
+        try:
+            events.extend(self.events_queue.get(timeout=timeout))
+            while True:
+                events.extend(self.events_queue.get_nowait())
+        except queue.Empty:
+            pass
+        events = self.dedup(events)
+        self.notify(events)
+        return events
+
+    def notify(self, events):
+        """Notify through dispatchers, or else directly each service (a failing one not stopping the notifier)
+        """
+        if self.bot.dispatchers:
+            self.bot.notify_all(events)
+            return
+        for n in self.bot.notification_services:
+            try:
+                n.notify(events)
+            except Exception as e:
+                print("{} failed to notify events: {!r}".format(n.__class__.__name__, e))
+
+    def dedup(self, events):
+        now = time.time()
+        for text in [t for t, sent in self.sent.items() if now - sent > self.dedup_window]:
+            del self.sent[text]
+        unique = list()
+        for e in events:
+            if e.text not in self.sent:
+                self.sent[e.text] = now
+                unique.append(e)
+        return unique
+
+    def check_active(self):
+        alive = sum(w.is_alive() for w in self.workers)
+        shards_s = "\nShards by {} ({}/{} workers alive):\n\t- ".format(self.shard_by, alive, len(self.workers))
+        shards_s += "\n\t- ".join(", ".join(str(self.bot.event_trackers[i]) for i in p) for p in self.partitions if p)
+        self.notify([Event("Bot still active", format_longtext=str(self.bot) + shards_s)])
+
+
+def partition_trackers(trackers, shards, shard_by='datafeed'):
+    """Return one list of tracker indexes per shard, grouping trackers by symbol or datafeed 
+    and assigning largest groups first to the least loaded shard
+    """
+    groups = dict()
+    for i, t in enumerate(trackers):
+        key = t.params.get('symbol') if shard_by == 'symbol' else id(t.datafeed_service)
+        groups.setdefault(key, list()).append(i)
+    partitions = [list() for _ in range(shards)]
+    for g in sorted(groups.values(), key=len, reverse=True):
+        min(partitions, key=len).extend(g)
+    return [sorted(p) for p in partitions]
+
+def run_shard(yaml_content, tracker_indexes, events_queue, shard=0, shards=1, stop_event=None):
+    """Worker process running only the trackers at tracker_indexes (and their datafeeds), 
+    forwarding events to the notifier process, until stop_event is set
+    """
+    stop_event = stop_event or threading.Event()
+    bot = load_bot(yaml_content)
+    if getattr(bot, 'snapshot_file', None):
+        # one snapshot file per shard (ex. tracker_state.snap.shard1), restoring from all of them
+        bot.restore_files = ["{}.shard{}".format(bot.snapshot_file, i) for i in range(shards)] + [bot.snapshot_file]
+        bot.snapshot_file = bot.restore_files[shard]
+    # tick files per shard (ex. ticks/api.kraken.com/XTZUSD/20200512.shard1.ticks), never appended by 2 workers
+    bot.record_suffix = '.shard{}'.format(shard)
+    if getattr(bot, 'metrics_port', None):
+        # each shard exports its metrics on its own port (metrics_port + shard)
+        bot.metrics_port = int(bot.metrics_port) + shard
+    trackers = [bot.event_trackers[i] for i in tracker_indexes]
+    bot.event_trackers = trackers
+    bot.run_schedules = [r for r in getattr(bot, 'run_schedules', []) if any(r['tracker'] is t for t in trackers)]
+    bot.datafeed_services = [s for s in bot.datafeed_services if any(t.datafeed_service is s for t in trackers)]
+    bot.notification_services = [QueueNotificationService(events_queue)]
+    bot.checkstate_every = None
+    bot.setup()
+    try:
+        while not stop_event.is_set():
+            scheduler.run_pending()
+            stop_event.wait(scheduler.idle_seconds())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bot.shutdown()
+
+
+class Metrics(object):
+    """Registry of counters and histograms (by name and labels) exported in Prometheus text format. 
+    Disabled (no-op) unless enabled by the Bot (metrics_port or metrics_every)
+    """
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = dict()
+        # (name, labels) -> counts per bucket (last one for +Inf), followed by sum of values
+        self.histograms = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            h[bisect.bisect_left(self.buckets, value)] += 1
+            h[-1] += value
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    @staticmethod
+    def labels_text(labels, extra=()):
+        items = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels + extra]
+        return "{" + ",".join(items) + "}" if items else ""
+
+    def prometheus(self):
+        lines = list()
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, list(h)) for k, h in self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} counter".format(name))
+            lines.append("{}{} {}".format(name, self.labels_text(labels), value))
+        for (name, labels), h in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} histogram".format(name))
+            cumulated = 0
+            for bound, count in zip(self.buckets + ('+Inf',), h):
+                cumulated += count
+                lines.append("{}_bucket{} {}".format(name, self.labels_text(labels, (('le', bound),)), cumulated))
+            lines.append("{}_sum{} {}".format(name, self.labels_text(labels), h[-1]))
+            lines.append("{}_count{} {}".format(name, self.labels_text(labels), cumulated))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """One line per metric, with count, average and approximate (bucket bound) p50/p99 of histograms
+        """
+        def quantile(h, q):
+            total, cumulated = sum(h[:-1]), 0
+            for bound, count in zip(self.buckets + (math.inf,), h):
+                cumulated += count
+                if cumulated >= q * total:
+                    return bound
+        lines = list()
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append("{}{}: {}".format(name, self.labels_text(labels), value))
+            for (name, labels), h in sorted(self.histograms.items()):
+                count = sum(h[:-1])
+                lines.append("{}{}: count={} avg={:.2f} ms p50<={} ms p99<={} ms".format(
+                             name, self.labels_text(labels), count, h[-1] / count * 1000 if count else 0,
+                             quantile(h, 0.5) * 1000, quantile(h, 0.99) * 1000))
+        return lines
+
+# metrics of the Bot (datafeed requests, trackers, notifications, scheduler)
+metrics = Metrics()
+
+
+class SamplingProfiler(object):
+    """Profiler switchable at runtime: samples the stacks of all threads every `interval` sec 
+    and counts functions found on top of stacks (self) and anywhere in stacks (total)
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.thread = None
+        self.stopped = threading.Event()
+        self.samples = 0
+        self.own = Counter()
+        self.total = Counter()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.samples = 0
+        self.own.clear()
+        self.total.clear()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.samples += 1
+                self.own[self.location(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    loc = self.location(frame)
+                    if loc not in seen:
+                        seen.add(loc)
+                        self.total[loc] += 1
+                    frame = frame.f_back
+
+    @staticmethod
+    def location(frame):
+        code = frame.f_code
+        return "{}:{}({})".format(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+
+    def stop(self, top=30):
+        """Stop sampling and return report of the `top` functions
+        """
+        if self.running:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+        lines = ["{} samples (every {} ms)".format(self.samples, self.interval * 1000),
+                 "{:>7} {:>7}  function".format('self%', 'total%')]
+        for loc, count in self.total.most_common(top):
+            lines.append("{:>7.1f} {:>7.1f}  {}".format(self.own[loc] * 100.0 / max(1, self.samples),
+                                                     count * 100.0 / max(1, self.samples), loc))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics (Prometheus text format), /profile/start and /profile/stop (profile report)
+    """
+    profiler = SamplingProfiler()
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            self.reply(metrics.prometheus(), 'text/plain; version=0.0.4')
+        elif path == '/profile/start':
+            self.profiler.start()
+            self.reply("Profiling started\n")
+        elif path == '/profile/stop':
+            self.reply(self.profiler.stop())
+        else:
+            self.send_error(404)
+
+    def reply(self, text, content_type='text/plain'):
+        body = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(object):
+    """Local HTTP server of metrics (MetricsHandler), run in a daemon thread
+    """
+    def __init__(self, port, host='127.0.0.1'):
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True).start()
+
+    def close(self):
+        MetricsHandler.profiler.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# interval units of run_schedules (ex. interval: 500 ms)
+INTERVAL_UNITS = dict(ms=0.001, seconds=1, minutes=60, hours=3600)
+
+
+class Timer(object):
+    """Function run every `interval` sec by a `TimerScheduler`, with its scheduling metrics: 
+    lateness (sec between due time and actual run) and jitter (sec between actual and 
+    expected time since previous run)
+    """
+    def __init__(self, interval, func, args, name=None):
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.name = name or getattr(func, '__name__', str(func))
+        self.due = None
+        self.last_run = None
+        self.runs = 0
+        self.lateness = RollingWindow(100)
+        self.jitter = RollingWindow(100)
+        self.max_lateness = 0.0
+
+    def run(self, now):
+        late = now - self.due
+        metrics.observe('tracker_scheduler_lateness_seconds', late)
+        self.lateness.push(late)
+        self.max_lateness = max(self.max_lateness, late)
+        if self.last_run is not None:
+            self.jitter.push(abs(now - self.last_run - self.interval))
+        self.last_run = now
+        self.runs += 1
+        try:
+            self.func(*self.args)
+        except Exception as ex:
+            print("Timer {} failed: {}".format(self.name, ex))
+
+    def next_due(self, now):
+        """Next due time after previous one (not after actual run, so that no drift accumulates), 
+        skipping periods missed when running late
+        """
+        due = self.due + self.interval
+        if due <= now:
+            due += math.ceil((now - due) / self.interval) * self.interval
+        return due
+
+    def report(self):
+        return "{}: {} runs, lateness avg {:.1f} ms (max {:.1f} ms), jitter avg {:.1f} ms".format(
+               self.name, self.runs, self.lateness.mean() * 1000 if self.lateness.count else 0,
+               self.max_lateness * 1000, self.jitter.mean() * 1000 if self.jitter.count else 0)
+
+
+class DailyTimer(Timer):
+    """Timer run every day, or every given weekday (ex. monday), at time HH:MM(:SS)
+    """
+    weekdays = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+    def __init__(self, day, at, func, args, name=None):
+        assert day == 'day' or day in self.weekdays
+        super().__init__(86400 if day == 'day' else 7 * 86400, func, args, name)
+        self.day = day
+        self.at = datetime.strptime(at, '%H:%M:%S' if at.count(':') == 2 else '%H:%M').time()
+        # wall-clock time of the next run
+        self.scheduled = None
+
+    def next_due(self, now):
+        """Next wall-clock run after the current time, or after the previous scheduled run when 
+        run slightly before it (monotonic and wall clocks drifting apart, ex. NTP slew)
+        """
+        current = datetime.now()
+        after = max(current, self.scheduled) if self.scheduled else current
+        next_run = datetime.combine(after.date(), self.at)
+        if self.day != 'day':
+            next_run += timedelta(days=(self.weekdays.index(self.day) - next_run.weekday()) % 7)
+        if next_run <= after:
+            next_run += timedelta(seconds=self.interval)
+        self.scheduled = next_run
+        return now + (next_run - current).total_seconds()
+
+
+class TimerScheduler(object):
+    """Heap of timers ordered by due time (time.monotonic), run by `run_pending()` while the 
+    caller sleeps `idle_seconds()` in between: exactly until the next due timer
+    """
+    def __init__(self):
+        self.heap = list()
+        self.jobs = list()
+        self.counter = itertools.count()
+
+    def every(self, interval, func, *args, name=None):
+        """Run func(*args) every interval sec (float), first after one interval
+        """
+        return self.add(Timer(interval, func, args, name), time.monotonic() + interval)
+
+    def daily(self, day, at, func, *args, name=None):
+        timer = DailyTimer(day, at, func, args, name)
+        return self.add(timer, timer.next_due(time.monotonic()))
+
+    def add(self, timer, due):
+        timer.due = due
+        self.jobs.append(timer)
+        heapq.heappush(self.heap, (due, next(self.counter), timer))
+        return timer
+
+    def clear(self):
+        for timer in self.jobs:
+            timer.due = None
+        self.heap = list()
+        self.jobs = list()
+
+    def run_pending(self):
+        """Run timers due, and return number run
+        """
+        nb = 0
+        while self.heap and self.heap[0][0] <= time.monotonic():
+            due, _, timer = heapq.heappop(self.heap)
+            if timer.due != due:
+                continue
+            now = time.monotonic()
+            timer.run(now)
+            nb += 1
+            # unless cleared while running
+            if timer.due is not None:
+                timer.due = timer.next_due(now)
+                heapq.heappush(self.heap, (timer.due, next(self.counter), timer))
+        return nb
+
+    def idle_seconds(self, limit=60):
+        """Sec until next due timer, at most limit
+        """
+        if not self.heap:
+            return limit
+        return min(limit, max(0, self.heap[0][0] - time.monotonic()))
+
+    def report(self):
+        if not self.jobs:
+            return ""
+        return "\nScheduling:\n\t- " + "\n\t- ".join(t.report() for t in self.jobs)
+
+# timers of the Bot (trackers, check_active..)
+scheduler = TimerScheduler()
+
+
+class AsyncioTrackerEngine(object):
+    """Run trackers concurrently on an asyncio loop (in its own thread), while the `scheduler` 
+    only submits the due trackers. Blocking datafeed requests and notifications are run 
+    in a thread pool, runs of a same tracker are kept in submission order and 
+    the number of in-flight requests per datafeed is capped by its `max_inflight` (default 4).
+    Trackers are submitted as tuple (more than one for batched datafeed).
+    """
+    def __init__(self, bot, max_workers=32):
+        self.bot = bot
+        self.max_workers = max_workers
+        # scheduling lag (sec) per tracker, between being due and starting its request
+        self.lags = dict()
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        # only accessed within the loop thread
+        self.tracker_locks = dict()
+        self.feed_semaphores = dict()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='tracker-engine', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.pool.shutdown(wait=False)
+
+    def submit(self, trackers):
+        future = asyncio.run_coroutine_threadsafe(self.run_trackers(trackers, time.time()), self.loop)
+        future.add_done_callback(self._report_error)
+        return future
+
+    def _report_error(self, future):
+        if not future.cancelled() and future.exception():
+            print("Engine failed to run tracker due to error:\n{}".format(future.exception()))
+
+    async def run_trackers(self, trackers, due_time):
+        service = trackers[0].datafeed_service
+        if trackers not in self.tracker_locks:
+            self.tracker_locks[trackers] = asyncio.Lock()
+        if service not in self.feed_semaphores:
+            self.feed_semaphores[service] = asyncio.Semaphore(getattr(service, 'max_inflight', 4))
+
+        async with self.tracker_locks[trackers]:
+            self.record_lag(trackers, time.time() - due_time)
+            try:
+                async with self.feed_semaphores[service]:
+                    service_response = await self.loop.run_in_executor(self.pool, self.bot.fetch, trackers)
+            except Exception as e:
+                events_msg = self.bot.fetch_error_events(e)
+            else:
+                events_msg = self.bot.signal_events(trackers, service_response)
+            await self.loop.run_in_executor(self.pool, self.bot.notify_all, events_msg)
+
+    def record_lag(self, trackers, lag):
+        metrics.observe('tracker_engine_lag_seconds', lag)
+        l = self.lags.setdefault(trackers, dict(last=0, max=0, total=0, count=0))
+        l['last'] = lag
+        l['max'] = max(l['max'], lag)
+        l['total'] += lag
+        l['count'] += 1
+
+    def lag_report(self):
+        lines = ["\nScheduling lag (sec) per tracker:"]
+        for trackers, l in list(self.lags.items()):
+            lines.append("\t- {}: last={:.3f}, avg={:.3f}, max={:.3f} ({} runs)".format(
+                         " + ".join(str(t) for t in trackers), l['last'], l['total'] / l['count'], l['max'], l['count']))
+        return "\n".join(lines)
+
+
 class NotificationService(object):
     def __init__(self, **params):
         self.params = params
@@ -101,12 +1009,18 @@ class NotificationService(object):
 
     def notify(self, events):
         if self.active and len(events) > 0:
+            start = time.perf_counter()
             try:
                 self._notify(events)
             except Exception as e:
+                metrics.inc('tracker_notification_failures_total', service=self.__class__.__name__)
                 print("{} failed to notify due to error:\n{}".format(self.__class__.__name__, e))
                 raise e
+            metrics.observe('tracker_notification_seconds', time.perf_counter() - start, service=self.__class__.__name__)
         
+    def close(self):
+        pass
+
     def _setup(self):
         pass
     def _notify(events):
@@ -122,6 +1036,108 @@ class NotificationService(object):
         long_s = "_"*75 + "\n{nb} Event(s) signaled:{concat}{msgs}" + "\n" + "_"*75 + "\n\n"
         return long_s.format(nb=len(long_msgs), concat=concat, msgs=m)
 
+class NotificationDispatcher(object):
+    """Send the events of a notification service from a background worker, so that slow or failing 
+    services don't block trackers. Events wait in a bounded queue (queue_size) and when full, 
+    new events are either merged into the last queued ones (when_full: merge) or the oldest 
+    ones are dropped (when_full: drop). Failed sends are retried with exponential backoff 
+    (retries, backoff sec) and then appended to the dead_letter file (json lines) if any.
+    """
+    def __init__(self, service, queue_size=100, retries=3, backoff=1.0, dead_letter=None, when_full='merge'):
+        assert when_full in ('merge', 'drop')
+        self.service = service
+        self.queue_size = int(queue_size)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.dead_letter = dead_letter
+        self.when_full = when_full
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.stopped = threading.Event()
+        self.stats = dict(sent=0, failures=0, dead=0, dropped=0, merged=0, latency_total=0.0, latency_max=0.0)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='notify-' + self.service.__class__.__name__, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Stop after sending queued events (without waiting for retries)
+        """
+        with self.cond:
+            self.stopped.set()
+            self.cond.notify()
+        self.thread.join(timeout)
+
+    def put(self, events):
+        if not events:
+            return
+        with self.cond:
+            if len(self.pending) < self.queue_size:
+                self.pending.append((time.time(), list(events)))
+            elif self.when_full == 'merge':
+                self.pending[-1][1].extend(events)
+                self.stats['merged'] += len(events)
+            else:
+                self.stats['dropped'] += len(self.pending.popleft()[1])
+                self.pending.append((time.time(), list(events)))
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped.is_set():
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                queued_time, events = self.pending.popleft()
+            self.send(queued_time, events)
+
+    def send(self, queued_time, events):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                self.service.notify(events)
+            except Exception as e:
+                self.stats['failures'] += 1
+                error = e
+                if attempt < self.retries and not self.stopped.wait(delay):
+                    delay *= 2
+                    continue
+                break
+            else:
+                latency = time.time() - queued_time
+                metrics.observe('tracker_notification_queue_seconds', latency, service=self.service.__class__.__name__)
+                self.stats['sent'] += 1
+                self.stats['latency_total'] += latency
+                self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+                return
+        self.stats['dead'] += 1
+        if self.dead_letter:
+            with open(self.dead_letter, 'a') as f:
+                f.write(json.dumps(dict(time=time.time(), service=self.service.__class__.__name__, error=str(error),
+                                        events=[e.longtext for e in events])) + "\n")
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def report(self):
+        st = self.stats
+        return "{}: queue depth={}, sent={}, failures={}, dead={}, dropped={}, merged={}, latency avg={:.3f} max={:.3f} sec".format(
+                self.service.__class__.__name__, self.depth, st['sent'], st['failures'], st['dead'], st['dropped'],
+                st['merged'], st['latency_total'] / st['sent'] if st['sent'] else 0, st['latency_max'])
+
+
+class QueueNotificationService(NotificationService):
+    """Forward events of a shard worker to the notifier process
+    """
+    def __init__(self, events_queue, **params):
+        super().__init__(**params)
+        self.events_queue = events_queue
+
+    def _notify(self, events):
+        self.events_queue.put(events)
+
 class ConsolNotificationService(NotificationService):
     def _notify(self, events):
         print("Short message--> " + self.short_messages(events))
@@ -156,7 +1172,9 @@ class PushBulletNotificationService(NotificationService):
 
 pwd_saved = None
 class EmailNotificationService(NotificationService):
-    """Use smtp server with SSL connection to send email notifications
+    """Use smtp server with SSL connection to send email notifications. The authenticated 
+    connection is kept open (and reopened when closed by server). With params batch_every: 60 (sec), 
+    events notified within this window are sent together in one digest email.
     """
     message = \
 """Subject: {subject}
@@ -177,15 +1195,71 @@ class EmailNotificationService(NotificationService):
         self.to =  self.params['to']
         # secured SSL content
         self.context = ssl.create_default_context()
+        self.server = None
+        self.lock = threading.Lock()
+        self.batch_every = float(self.params.get('batch_every', 0))
+        self.pending = list()
+        self.timer = None
 
     def _notify(self, events):
+        if not self.batch_every:
+            self.send(events)
+            return
+        with self.lock:
+            self.pending.extend(events)
+            if not self.timer:
+                self.timer = threading.Timer(self.batch_every, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Send pending events as one digest email
+        """
+        with self.lock:
+            events, self.pending = self.pending, list()
+            self.timer = None
+        if events:
+            try:
+                self.send(events)
+            except Exception as e:
+                print("{} failed to send digest of {} events due to error:\n{}".format(self.__class__.__name__, len(events), e))
+
+    def send(self, events):
         # adding "Tracker:" to mark as important on gmail side
         complete_msg = self.message.format(subject="Tracker: "+self.short_messages(events), message=self.long_messages(events))
         # print("Notify email with msg:\n{}".format(complete_msg))
-        with smtplib.SMTP_SSL(self.smtp, self.port, context=self.context) as server:
-             server.login(self.login, self.pwd)
-             # encode() added because sendmail tries to convert str to ascii and fail with special up/down arrow  
-             server.sendmail(self.login, self.to, complete_msg.encode('utf-8'))
+        with self.lock:
+            try:
+                self.sendmail(complete_msg)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError):
+                # connection closed by server (ex. idle timeout), retry once with a new one
+                self.disconnect()
+                self.sendmail(complete_msg)
+
+    def sendmail(self, complete_msg):
+        if not self.server:
+            self.server = smtplib.SMTP_SSL(self.smtp, self.port, context=self.context)
+            self.server.login(self.login, self.pwd)
+        # encode() added because sendmail tries to convert str to ascii and fail with special up/down arrow  
+        self.server.sendmail(self.login, self.to, complete_msg.encode('utf-8'))
+
+    def disconnect(self):
+        if self.server:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+    def close(self):
+        # nothing to close when inactive or not setup (ex. Bot of an invalid config being discarded)
+        if not hasattr(self, 'lock'):
+            return
+        if self.timer:
+            self.timer.cancel()
+        self.flush()
+        with self.lock:
+            self.disconnect()
 
 
 class DataFeedService(object):
@@ -195,32 +1269,336 @@ class DataFeedService(object):
         self.params = params
 
     def setup(self):
-        pass
+        """Open the long-lived (keep-alive) connection pool of the service, configurable in yaml 
+        with pool_size: 10, timeout: 10 (sec), retries: 3, backoff: 0.5 (sec) and compression: Y/N
+        """
+        self.pool_size = int(getattr(self, 'pool_size', 10))
+        self.timeout = float(getattr(self, 'timeout', 10))
+        self.retries = int(getattr(self, 'retries', 3))
+        self.backoff = float(getattr(self, 'backoff', 0.5))
+        self.compression = getattr(self, 'compression', 'Y') != 'N'
+        self.session = self.create_session()
+
+        # responses cached during cache_ttl sec (0: no cache), and identical in-flight requests merged
+        self.cache_ttl = float(getattr(self, 'cache_ttl', 0))
+        self.coalesce = getattr(self, 'coalesce', 'Y') != 'N'
+        self.cache = dict()
+        self.inflight = dict()
+        self.cache_lock = threading.Lock()
+        self.cache_stats = dict(hits=0, misses=0, merges=0)
+        # json responses decoded with orjson/ujson when installed (decoder: std to use json module), 
+        # optionally keeping only some fields (ex. fields: [last, open, timestamp])
+        self.decoder = getattr(self, 'decoder', 'fast')
+        self.json_loads = fast_json.loads if self.decoder == 'fast' and fast_json else json.loads
+        self.fields = set(getattr(self, 'fields', None) or ()) or None
+        self.metric_name = urlsplit(getattr(self, 'url', None) or '').hostname or self.__class__.__name__
+        # optional limit of requests/sec to the service host, shared by all services of the host in a Bot 
+        # (ex. rate_limit: 1.0, rate_burst: 5)
+        self.rate_limit = float(getattr(self, 'rate_limit', 0))
+        self.rate_burst = int(getattr(self, 'rate_burst', 1))
+        self.limiter = None
+        if self.rate_limit and getattr(self, 'url', None):
+            self.limiter = TokenBucket(self.rate_limit, self.rate_burst)
+        # adapter of responses into Ticker, by default found from url (ex. adapter: my_adapters.coinbase_adapter)
+        self.ticker_adapter = resolve_adapter(getattr(self, 'adapter', None), getattr(self, 'url', None))
+
+    def create_session(self):
+        session = requests.Session()
+        # retry on connection errors and throttled/unavailable responses, sleeping backoff*2^(n-1) sec
+        retry = Retry(total=self.retries, backoff_factor=self.backoff, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate' if self.compression else 'identity'
+        return session
+
+    def close(self):
+        if getattr(self, 'session', None):
+            self.session.close()
+
+    def decode(self, content):
+        """Decode json response body (bytes, no charset detection as done by requests)
+        """
+        start = time.perf_counter()
+        response = self.json_loads(content)
+        if self.fields:
+            response = project_fields(response, self.fields)
+        metrics.observe('tracker_decode_seconds', time.perf_counter() - start, datafeed=self.metric_name)
+        return response
 
     def request(self, request_params=None):
         """Send a request and return response as dict. It is called by `Bot` which 
         may also provide a request_params when specified by the EventTracker. 
         Return Exception in case of error. 
+        Response is served from cache or from an identical in-flight request when possible.
         """
+        key = self.request_key(request_params)
+        owner = False
+        with self.cache_lock:
+            cached = self.cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.cache_stats['hits'] += 1
+                return cached[1]
+            pending = self.inflight.get(key) if self.coalesce else None
+            if pending:
+                self.cache_stats['merges'] += 1
+            else:
+                self.cache_stats['misses'] += 1
+                pending = Future()
+                if self.coalesce:
+                    self.inflight[key] = pending
+                owner = True
+        if not owner:
+            return pending.result()
+
+        try:
+            if self.limiter:
+                self.limiter.acquire()
+            start = time.perf_counter()
+            response = self._request(request_params)
+            metrics.observe('tracker_fetch_seconds', time.perf_counter() - start, datafeed=self.metric_name)
+        except Exception as e:
+            metrics.inc('tracker_fetch_errors_total', datafeed=self.metric_name)
+            with self.cache_lock:
+                self.end_inflight(key, pending)
+            pending.set_exception(e)
+            raise
+        with self.cache_lock:
+            self.end_inflight(key, pending)
+            if self.cache_ttl > 0:
+                now = time.monotonic()
+                for k in [k for k, c in self.cache.items() if c[0] <= now]:
+                    del self.cache[k]
+                self.cache[key] = (now + self.cache_ttl, response)
+        pending.set_result(response)
+        return response
+
+    def end_inflight(self, key, pending):
+        # a later identical request may be in-flight (registered by another owner)
+        if self.inflight.get(key) is pending:
+            del self.inflight[key]
+
+    def _request(self, request_params):
         pass
 
+    def request_key(self, request_params):
+        """Key identifying identical requests (for cache and merging)
+        """
+        return repr(sorted(request_params.items())) if request_params else None
+
+    def cache_report(self):
+        c = self.cache_stats
+        return "{}: {} requests sent, {} cache hits, {} merged in-flight (saved {} exchange calls)".format(
+                getattr(self, 'url', self.__class__.__name__), c['misses'], c['hits'], c['merges'], c['hits'] + c['merges'])
+
     def __str__(self):
         atts = ", ".join(['{}:{}'.format(k,v) for k,v in self.__dict__.items()])
         return "'{}' with attributes {}".format(self.__class__.__name__, atts) 
 
+class TokenBucket(object):
+    """Rate limiter allowing `rate` requests/sec on average, with bursts of `burst` requests
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.waited = 0.0
+
+    def acquire(self):
+        """Take a token, sleeping until it is available (tokens are reserved in order of 
+        calls, so concurrent callers are spaced by 1/rate sec), and return sec waited
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.acquired += 1
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+def host_limiters(datafeed_services):
+    """Return dict of url host -> token bucket shared by the rate limited services of the host, 
+    its rate and burst being the lowest configured
+    """
+    limiters = dict()
+    for s in datafeed_services:
+        if getattr(s, 'limiter', None) is None:
+            continue
+        host = urlsplit(s.url).hostname
+        limiter = limiters.get(host)
+        if limiter is None:
+            limiters[host] = TokenBucket(s.rate_limit, s.rate_burst)
+        else:
+            limiter.rate = min(limiter.rate, s.rate_limit)
+            limiter.burst = limiter.tokens = min(limiter.burst, float(s.rate_burst))
+    return limiters
+
+
 class SimpleTickerDataFeed(DataFeedService):
-    def request(self, request_params):
+    def request_key(self, request_params):
+        return self.url.format(**request_params)
+
+    def _request(self, request_params):
         complete_url = self.url.format(**request_params)
 
-        r = requests.get(complete_url)
+        r = self.session.get(complete_url, timeout=self.timeout)
         if r.status_code != requests.codes.ok:
             raise Exception("Request {} response not 200-OK: {}".format(complete_url, r))
-        response = r.json()
+        response = self.decode(r.content)
 
         # or mock-up for test..
         # response = mockup_response(self.url)
         return response
 
+class StreamingTickerDataFeed(DataFeedService):
+    """Push-based datafeed keeping one persistent WebSocket (ex. url: wss://ws.kraken.com) 
+    subscribed to the symbols of all its trackers, which are signaled on every update 
+    without being scheduled. Optional yaml values:
+        - throttle: 1.0 (min sec between two signals of a same symbol, latest update wins)
+        - timeout: 10 (sec without any message before reconnecting)
+        - reconnect_delay: 1 (sec, doubled after each failed attempt up to max_reconnect_delay: 60)
+    """
+    def setup(self):
+        super().setup()
+        self.throttle = float(getattr(self, 'throttle', 0))
+        self.reconnect_delay = float(getattr(self, 'reconnect_delay', 1))
+        self.max_reconnect_delay = float(getattr(self, 'max_reconnect_delay', 60))
+        # stream symbol -> [(tracker, callback)], keyed by normalized symbol (ex. 'XTZ/USD' -> 'XTZUSD')
+        self.symbols = dict()
+        self.subscriptions = dict()
+        self.last_signaled = dict()
+        self.pending = dict()
+        self.connections = 0
+        self.ws = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def unsubscribe_all(self):
+        self.symbols = dict()
+        self.subscriptions = dict()
+
+    def reconnect(self):
+        """Force reconnection (and so subscription of current symbols)
+        """
+        if self.ws:
+            self.ws.abort()
+
+    def subscribe(self, tracker, callback):
+        """Register `callback(tracker, ticker)` for the tracker symbol (its request_params 'pair' if any)
+        """
+        request_p = getattr(tracker, 'request_params', None) or dict()
+        symbol = request_p.get('pair', tracker.symbol)
+        self.symbols[stream_symbol_key(symbol)] = symbol
+        self.subscriptions.setdefault(stream_symbol_key(symbol), list()).append((tracker, callback))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='stream-' + self.url, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.ws:
+            self.ws.abort()
+        if self.thread:
+            self.thread.join()
+        super().close()
+
+    def run(self):
+        delay = self.reconnect_delay
+        while not self.stopped.is_set():
+            try:
+                self.ws = websocket.create_connection(self.url, timeout=self.timeout)
+                self.connections += 1
+                # (re)subscribe all symbols on every connection
+                for m in stream_subscribe_messages(list(self.symbols.values()), self.url):
+                    self.ws.send(json.dumps(m))
+                delay = self.reconnect_delay
+                while not self.stopped.is_set():
+                    self.on_message(self.ws.recv())
+            except Exception as e:
+                if self.stopped.is_set():
+                    break
+                print("{} connection lost ({}), reconnecting in {} sec".format(self.url, e, delay))
+                self.stopped.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            finally:
+                if self.ws:
+                    self.ws.close()
+
+    def on_message(self, message):
+        now = time.monotonic()
+        update = stream_message_adapter(json.loads(message), self.url) if message else None
+        if update and stream_symbol_key(update[0]) in self.subscriptions:
+            self.pending[stream_symbol_key(update[0])] = update[1]
+        # signal updates of symbols outside their throttle window
+        for symbol in [s for s in self.pending if now - self.last_signaled.get(s, float('-inf')) >= self.throttle]:
+            values = self.pending.pop(symbol)
+            self.last_signaled[symbol] = now
+            for tracker, callback in self.subscriptions[symbol]:
+                try:
+                    callback(tracker, Ticker(tracker.symbol, values))
+                except Exception as e:
+                    print("Failed to signal stream update of {} due to error:\n{}".format(symbol, e))
+
+    def _request(self, request_params):
+        raise Exception("{} is push-based and cannot be requested".format(self.url))
+
+
+def stream_symbol_key(symbol):
+    return symbol.upper().replace('/', '')
+
+def stream_subscribe_messages(symbols, service_url):
+    """Subscribe messages sent after each (re)connection
+        Kraken: {"event":"subscribe","pair":["XBT/USD","XTZ/USD"],"subscription":{"name":"ticker"}}
+        Bitstamp: {"event":"bts:subscribe","data":{"channel":"live_trades_xtzusd"}} (one per symbol)
+    """
+    if service_url.lower().find('kraken') > -1:
+        return [dict(event='subscribe', pair=symbols, subscription=dict(name='ticker'))]
+    elif service_url.lower().find('bitstamp') > -1:
+        return [dict(event='bts:subscribe', data=dict(channel='live_trades_' + s.lower())) for s in symbols]
+    else:
+        raise Exception("Stream does not support this service '{}'".format(service_url))
+
+def stream_message_adapter(message, service_url):
+    """Return (symbol, values) from a ticker update message, or None for other messages (heartbeat, status..)
+        Kraken: [340, {"a":["1.9634",1,"1.0"],"b":[..],"c":["1.9534","169.08"],"v":[..],"p":[..],"t":[..],"l":[..],"h":[..],"o":["1.9740","1.9611"]}, "ticker", "XTZ/USD"]
+        Bitstamp: {"event":"trade","channel":"live_trades_xtzusd","data":{"price":1.9534,"timestamp":"1589302800",..}}
+    """
+    if service_url.lower().find('kraken') > -1:
+        if not isinstance(message, list) or message[-2] != 'ticker':
+            return None
+        result = dict(message[1])
+        # ticker channel gives today's and last 24h opening prices
+        result['o'] = result['o'][0]
+        return message[-1], kraken_values(result)
+    elif service_url.lower().find('bitstamp') > -1:
+        if message.get('event') == 'bts:request_reconnect':
+            raise Exception("Server requested to reconnect")
+        if message.get('event') != 'trade':
+            return None
+        symbol = message['channel'][len('live_trades_'):]
+        return symbol, dict(current=message['data']['price'], timestamp=message['data']['timestamp'])
+    else:
+        raise Exception("Stream does not support this service '{}'".format(service_url))
+
+
+def project_fields(value, fields):
+    """Keep only dict items whose key is in fields, nested dicts being kept and projected as well 
+    (ex. Kraken tickers within 'result')
+    """
+    if isinstance(value, dict):
+        return {k: project_fields(v, fields) if isinstance(v, dict) else v
+                for k, v in value.items() if k in fields or isinstance(v, dict)}
+    return value
+
+
 def mockup_response(url):
     import random
     p = str(random.uniform(3.5, 4.5))
@@ -272,6 +1650,8 @@ class EventTracker(object):
     def setup(self):
         # use ´wait_time´ sec before signaling SAME type of event
         self.wait_time = self.params.get('wait_time',0)
+        # verbose: N to not print every ticker without event (ex. during replay)
+        self.verbose = self.params.get('verbose', 'Y') != 'N'
         self._setup()
 
     def signal_events(self, response):
@@ -296,31 +1676,168 @@ class TickerEventTracker(EventTracker):
             - ranges: [1.25-1.50, 2.0-2.2] (track entering/exiting range-zones)
             - max_day: 5.0 (track daily change exceeding +/- 5.0%)
             - max_lag: [2.0, -3] (track change exceeding +/- 2.0% between current and lag-3 ticker)
+            - ma_cross: [5, 20] (track moving average over 5 ticks crossing the one over 20 ticks)
+            - zscore: [20, 3.0] (track price deviating more than 3.0 std from the previous 20 ticks)
+            - bollinger: [20, 2.0] (track price breaking out of 20 ticks average +/- 2.0 std)
+            - vwap_dev: 2.0 (track price deviating more than +/- 2.0% from the vwap)
+        Optional history_depth: 100 (number of previous tickers kept)
         """
         self.symbol = self.params['symbol']
         self.ranges = list()
         for r in self.params.get('ranges',[]):
             lo, hi = r.split('-')
             self.ranges.append(dict(lo=float(lo), hi=float(hi)))
+        self.range_index = RangeIndex([(r['lo'], r['hi']) for r in self.ranges])
         self.max_day = float(self.params['max_day']) if self.params.get('max_day') else None
         self.max_lag = float(self.params['max_lag'][0]) if self.params.get('max_lag') else None
         if self.max_lag:
             self.lag = int(self.params['max_lag'][1])
 
-        # keeps track of previous 100 ticker 
-        self.tickers = deque(maxlen=100)
+        # keeps track of previous tickers
+        self.tickers = TickerHistory(self.symbol, depth=int(self.params.get('history_depth', 100)))
+        self.current_ticker = None
 
         # last time specific events took place
         self.lastime_rangevents = dict(enter_up=0, enter_down=0, exit_up=0, exit_down=0, cross_up=0, cross_down=0)
         self.lastime_changeday = 0
         self.lastime_changelag = 0
+        self.setup_indicators()
+
+    def setup_indicators(self):
+        p = self.params
+        self.ma_cross = [int(n) for n in p['ma_cross']] if p.get('ma_cross') else None
+        self.zscore = (int(p['zscore'][0]), float(p['zscore'][1])) if p.get('zscore') else None
+        self.bollinger = (int(p['bollinger'][0]), float(p['bollinger'][1])) if p.get('bollinger') else None
+        self.vwap_dev = float(p['vwap_dev']) if p.get('vwap_dev') else None
+
+        # rolling windows of prices (one per size) and of returns for volatility
+        sizes = set(self.ma_cross or [])
+        sizes.update(w[0] for w in (self.zscore, self.bollinger) if w)
+        self.windows = {n: RollingWindow(n) for n in sizes}
+        self.returns = RollingWindow(self.zscore[0] if self.zscore else 20)
+        # sign of fast-slow averages, and position vs Bollinger band (-1 below, 0 inside, 1 above)
+        self.ma_state = 0
+        self.band_state = 0
+        self.lastime_indicators = dict()
+
+    @property
+    def volatility(self):
+        """Std of tick returns (%) over the returns window
+        """
+        return self.returns.std() if self.returns.count > 1 else 0
 
-    def range_event(self, lo, hi):
+    def poll_factor(self, edge=1.0, volatile=1.0, quiet=0.1, min_factor=0.25, max_factor=4.0):
+        """Factor of the polling interval: min_factor when price is within `edge` % of a range bound 
+        or volatility above `volatile` %, max_factor when volatility is below `quiet` %, 1 otherwise
+        """
+        t = self.current_ticker
+        if t is None or self.returns.count < 2:
+            return 1.0
+        volatility = self.volatility
+        if self.range_index.distance(t.current) / t.current * 100.0 < edge or volatility > volatile:
+            return min_factor
+        return max_factor if volatility < quiet else 1.0
+
+    def indicator_events(self):
+        """Update rolling windows with current price in O(1) and return indicator events
+        """
+        evts = list()
+        t = self.current_ticker
+        if self.previous_ticker:
+            self.returns.push(t.change(self.previous_ticker))
+
+        # z-score compares the price against the previous ticks (excluding current)
+        if self.zscore:
+            w = self.windows[self.zscore[0]]
+            if w.full and w.std() > 0:
+                z = (t.current - w.mean()) / w.std()
+                if abs(z) > self.zscore[1]:
+                    evts.append(Event("{symbol} at {price:.3f} has z-score {z:.2f} over {window} ticks (volatility {vol:.2f}%)",
+                                      kind='zscore', symbol=t.symbol, price=t.current, z=z, window=w.size, vol=self.volatility))
+        for w in self.windows.values():
+            w.push(t.current)
+
+        if self.ma_cross:
+            fast, slow = self.windows[self.ma_cross[0]], self.windows[self.ma_cross[1]]
+            if fast.full and slow.full:
+                state = (fast.mean() > slow.mean()) - (fast.mean() < slow.mean())
+                if state and self.ma_state and state != self.ma_state:
+                    evts.append(Event("{symbol} at {price:.3f} MA{fast} crosses{dir} MA{slow} ({fast_ma:.3f}/{slow_ma:.3f})",
+                                      kind='ma_cross', symbol=t.symbol, price=t.current, fast=fast.size, slow=slow.size,
+                                      dir=self.dir_symbol['up' if state > 0 else 'down'], fast_ma=fast.mean(), slow_ma=slow.mean()))
+                self.ma_state = state or self.ma_state
+
+        if self.bollinger:
+            w = self.windows[self.bollinger[0]]
+            if w.full:
+                lo, hi = w.mean() - self.bollinger[1] * w.std(), w.mean() + self.bollinger[1] * w.std()
+                state = (t.current > hi) - (t.current < lo)
+                if state and state != self.band_state:
+                    evts.append(Event("{symbol} at {price:.3f} breaks{dir} Bollinger band [{lo:.3f}-{hi:.3f}]",
+                                      kind='bollinger', symbol=t.symbol, price=t.current,
+                                      dir=self.dir_symbol['up' if state > 0 else 'down'], lo=lo, hi=hi))
+                self.band_state = state
+
+        if self.vwap_dev and t.vwap > 0:
+            dev = (t.current - t.vwap) / t.vwap * 100.0
+            if not (-self.vwap_dev < dev < self.vwap_dev):
+                evts.append(Event("{symbol} at {price:.3f} deviates {dev:.2f}% from vwap {vwap:.3f}",
+                                  kind='vwap_dev', symbol=t.symbol, price=t.current, dev=dev, vwap=t.vwap))
+        return evts
+
+    def state_version(self):
+        """Number of tickers signaled, as state only changes with new tickers
+        """
+        return self.tickers.appended
+
+    def get_state(self, since=None):
+        """State to persist across restarts (history, last time of events and indicators) as tuple(meta, changes): 
+        meta small tuple of scalars, changes list of (offset, bytes) in data of the history rows followed by 
+        rolling windows values (see `set_state`). When `since` (previous `state_version`) is given, only 
+        rows of the tickers appended since then are changed in history
+        """
+        history, changes = self.tickers.get_state(since)
+        offset, windows = 8 * self.tickers.width * self.tickers.depth, list()
+        for w in [self.returns] + [self.windows[n] for n in sorted(self.windows)]:
+            w_meta, values = w.get_state()
+            windows.append(w_meta)
+            changes.append((offset, values))
+            offset += len(values)
+        # range events keys are fixed (see `_setup`): only their values
+        meta = (history, tuple(self.lastime_rangevents.values()), self.lastime_changeday, self.lastime_changelag,
+                tuple(self.lastime_indicators.items()), self.ma_state, self.band_state, tuple(windows))
+        return meta, changes
+
+    def set_state(self, meta, data):
+        history, rangevents, self.lastime_changeday, self.lastime_changelag, indicators, \
+            self.ma_state, self.band_state, windows = meta
+        data = memoryview(data)
+        pos = 8 * self.tickers.width * history[0]
+        self.tickers.set_state(history, data[:pos])
+        self.current_ticker = self.tickers[-1] if len(self.tickers) else None
+        self.lastime_rangevents.update(zip(list(self.lastime_rangevents), rangevents))
+        self.lastime_indicators.update(indicators)
+        # returns window first, then price windows by size (state only valid for same sizes)
+        for i, w_meta in enumerate(windows):
+            w = self.returns if i == 0 else self.windows.get(w_meta[0])
+            if w is not None:
+                w.set_state(w_meta, data[pos:pos + 8 * w_meta[0]])
+            pos += 8 * w_meta[0]
+
+    def bulk_indicators(self):
+        """Indicators computed over the whole ticker history (see `rolling_indicators`)
+        """
+        return rolling_indicators(self.tickers.column('current'), vwaps=self.tickers.column('vwap'),
+                                  ma_cross=self.ma_cross, zscore=self.zscore, bollinger=self.bollinger)
+
+    def range_event(self, lo, hi, action=None):
         #msg_l = "Pair {t.symbol} at {t.current:.3f} (prev={prev.current:.3f}) {a} ({dir}) the range [{r[0]:.3f}-{r[1]:.3f}]"
         # msg_s = "{t.symbol} {t.current:.3f} (prev={prev.current:.3f}) {a}{dir} [{r[0]:.3f}-{r[1]:.3f}]"
-        action = self.current_ticker.range_action(previous_ticker=self.previous_ticker, hi=hi, lo=lo)
+        if action is None:
+            action = self.current_ticker.range_action(previous_ticker=self.previous_ticker, hi=hi, lo=lo)
         if action:
             return Event("{symbol} at {price:.3f} (prev={prev_price:.3f}) {action}{dir} [{range[0]:.3f}-{range[1]:.3f}]",
+                          kind='range_' + action,
                           symbol=self.current_ticker.symbol,
                           price=self.current_ticker.current,
                           prev_price=self.previous_ticker.current,
@@ -336,6 +1853,7 @@ class TickerEventTracker(EventTracker):
 
         if not (-self.max_day < self.current_ticker.open_change < self.max_day):
             return Event("{symbol} at {price:.3f} changes {open_change:.2f}% from open {open}",
+                         kind='changeday',
                          symbol=self.current_ticker.symbol,
                          price=self.current_ticker.current,
                          open_change=self.current_ticker.open_change,
@@ -351,10 +1869,11 @@ class TickerEventTracker(EventTracker):
             if len(self.tickers) <= self.lag * -1:
                 return None
 
-            lag_value = self.tickers[self.lag-1].current
+            lag_value = self.tickers.value('current', self.lag-1)
             change = (self.current_ticker.current - lag_value) / lag_value * 100.0
             if not (-1 * self.max_lag < change < self.max_lag):
                 return  Event("{symbol} at {price:.3f} changes {change:.2f}% from lag{lag}({lag_value:.3f})",
+                              kind='changelag',
                               symbol=self.current_ticker.symbol,
                               price=self.current_ticker.current,
                               change=change,
@@ -364,27 +1883,41 @@ class TickerEventTracker(EventTracker):
     def signal_events(self, response):
         evts = list()
         try:
-            ticker_ad = ticker_response_adapter(response, self.symbol, self.datafeed_service.url)
+            # adapter bound at setup of the datafeed service (if any)
+            start = time.perf_counter()
+            adapter = getattr(self.datafeed_service, 'ticker_adapter', None)
+            if adapter:
+                ticker_ad = adapter(response, self.symbol)
+            else:
+                ticker_ad = ticker_response_adapter(response, self.symbol, self.datafeed_service.url)
+            metrics.observe('tracker_adapter_seconds', time.perf_counter() - start,
+                            datafeed=getattr(self.datafeed_service, 'metric_name', None))
         except Exception as e:
             e_s = Event("Cannot signal event, error raised during response adapter: {}".format(e))
             print(e_s.text)
             evts.append(e_s)
             return evts
+        return self.signal_ticker(ticker_ad)
 
+    def signal_ticker(self, ticker_ad):
+        """Signal events from an already adapted `Ticker` (ex. split from a batched response)
+        """
+        start = time.perf_counter() if metrics.enabled else None
+        evts = list()
+        self.previous_ticker = self.current_ticker if len(self.tickers) > 0 else None
         self.tickers.append(ticker_ad)
-        self.current_ticker = self.tickers[-1]
-        self.previous_ticker = self.tickers[-2] if len(self.tickers) > 1 else None
+        self.current_ticker = ticker_ad
 
 
-        for r in self.ranges:
-            range_evt = self.range_event(lo=r['lo'], hi=r['hi'])
-            if range_evt:
-                rkey = range_evt.action + "_" + self.current_ticker.direction(self.previous_ticker)
-                last_rtime = self.lastime_rangevents[rkey]
-                if self.current_ticker.timestamp - last_rtime > self.wait_time:
-                    evts.append(range_evt)
+        if self.previous_ticker:
+            # all (possibly overlapping) ranges entered/exited/crossed, dedup on times before this ticker
+            lastimes = dict(self.lastime_rangevents)
+            moves = self.range_index.moves(self.previous_ticker.current, self.current_ticker.current)
+            for action, lo, hi in moves:
+                rkey = action + "_" + self.current_ticker.direction(self.previous_ticker)
+                if self.current_ticker.timestamp - lastimes[rkey] > self.wait_time:
+                    evts.append(self.range_event(lo=lo, hi=hi, action=action))
                     self.lastime_rangevents[rkey] = self.current_ticker.timestamp
-                break
 
         changeday_evt = self.changeday_event()
         if changeday_evt:
@@ -398,8 +1931,17 @@ class TickerEventTracker(EventTracker):
                 evts.append(changelag_evt)
                 self.lastime_changelag = self.current_ticker.timestamp
 
-        if len(evts) == 0:
+        for indicator_evt in self.indicator_events():
+            if self.current_ticker.timestamp - self.lastime_indicators.get(indicator_evt.kind, 0) > self.wait_time:
+                evts.append(indicator_evt)
+                self.lastime_indicators[indicator_evt.kind] = self.current_ticker.timestamp
+
+        if len(evts) == 0 and self.verbose:
             print("No event signaled for {}".format(self.current_ticker))
+        if start is not None:
+            metrics.observe('tracker_signal_seconds', time.perf_counter() - start)
+            for e in evts:
+                metrics.inc('tracker_events_total', kind=getattr(e, 'kind', 'other'))
         return evts
 
     def __str__(self):
@@ -410,6 +1952,200 @@ class TickerEventTracker(EventTracker):
         return p_s + r_s + m_s + l_s
 
 
+class RangeIndex(object):
+    """Sorted index of (possibly overlapping) price ranges, returning all ranges entered, exited 
+    or crossed by a price move in O(log n + k) with bisect over:
+        - ranges sorted by lo
+        - sorted range bounds, with ranges strictly covering each bound and each segment between bounds
+    """
+    def __init__(self, ranges):
+        self.ranges = sorted(set(ranges))
+        self.los = [r[0] for r in self.ranges]
+        self.bounds = sorted({b for r in self.ranges for b in r})
+        # covering[2*i]: ranges containing bounds[i], covering[2*i+1]: ranges containing ]bounds[i], bounds[i+1][
+        self.covering = [list() for _ in range(2 * len(self.bounds))]
+        for idx, (lo, hi) in enumerate(self.ranges):
+            i = bisect.bisect_left(self.bounds, lo)
+            j = bisect.bisect_left(self.bounds, hi)
+            for slot in range(2 * i + 1, 2 * j):
+                self.covering[slot].append(idx)
+
+    def stab(self, price):
+        """Index of ranges strictly containing price
+        """
+        i = bisect.bisect_left(self.bounds, price)
+        if i < len(self.bounds) and self.bounds[i] == price:
+            return self.covering[2 * i]
+        return self.covering[2 * i - 1] if i > 0 else []
+
+    def distance(self, price):
+        """Distance from price to the nearest range bound (inf when no range)
+        """
+        i = bisect.bisect_left(self.bounds, price)
+        return min((abs(self.bounds[j] - price) for j in (i - 1, i) if 0 <= j < len(self.bounds)), default=math.inf)
+
+    def moves(self, previous, current):
+        """Return list of (action, lo, hi) for ranges entered, exited or crossed (same rules 
+        as `Ticker.range_action`) when price moves from previous to current
+        """
+        if previous == current:
+            return []
+        low, high = min(previous, current), max(previous, current)
+        # affected ranges either contain low (so lo < low), or have lo within [low, high[
+        candidates = self.stab(low) + list(range(bisect.bisect_left(self.los, low), bisect.bisect_left(self.los, high)))
+        result = list()
+        for idx in sorted(candidates):
+            lo, hi = self.ranges[idx]
+            was_inside, is_inside = lo < previous < hi, lo < current < hi
+            if is_inside and not was_inside:
+                result.append(('enter', lo, hi))
+            elif was_inside and not is_inside:
+                result.append(('exit', lo, hi))
+            elif not was_inside and not is_inside and low <= lo and high >= hi:
+                result.append(('cross', lo, hi))
+        return result
+
+    def __len__(self):
+        return len(self.ranges)
+
+
+class RollingWindow(object):
+    """Sum and sum of squares of the last `size` values, updated in O(1) per value 
+    (recomputed once per full rotation to avoid accumulating rounding errors)
+    """
+    __slots__ = ('size', 'values', 'count', 'pos', 'sum', 'sumsq')
+
+    def __init__(self, size):
+        self.size = size
+        self.values = array('d', bytes(8 * size))
+        self.count = 0
+        self.pos = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+
+    def push(self, value):
+        if self.count == self.size:
+            old = self.values[self.pos]
+            self.sum -= old
+            self.sumsq -= old * old
+        else:
+            self.count += 1
+        self.values[self.pos] = value
+        self.sum += value
+        self.sumsq += value * value
+        self.pos = (self.pos + 1) % self.size
+        if self.pos == 0:
+            self.sum = math.fsum(self.values)
+            self.sumsq = math.fsum(v * v for v in self.values)
+
+    def extend(self, values):
+        """Push array of values at once, sums being recomputed
+        """
+        skip = max(len(values) - self.size, 0)
+        pos = (self.pos + skip) % self.size
+        n = len(values) - skip
+        first = min(n, self.size - pos)
+        self.values[pos:pos + first] = values[skip:skip + first]
+        self.values[:n - first] = values[skip + first:]
+        self.pos = (pos + n) % self.size
+        self.count = min(self.count + len(values), self.size)
+        kept = self.values if self.count == self.size else self.values[:self.count]
+        self.sum = math.fsum(kept)
+        self.sumsq = math.fsum(v * v for v in kept)
+
+    @property
+    def full(self):
+        return self.count == self.size
+
+    def get_state(self):
+        return (self.size, self.count, self.pos, self.sum, self.sumsq), self.values.tobytes()
+
+    def set_state(self, meta, values):
+        if meta[0] == self.size:
+            _, self.count, self.pos, self.sum, self.sumsq = meta
+            self.values = array('d')
+            self.values.frombytes(values)
+
+    def mean(self):
+        return self.sum / self.count
+
+    def std(self):
+        m = self.sum / self.count
+        return math.sqrt(max(self.sumsq / self.count - m * m, 0.0))
+
+
+def rolling_stats(values, k, lag=0):
+    """Rolling mean and std of the `k` values ending `lag` positions before each position 
+    (nan when undefined), from prefix sums so in O(n) whatever `k`
+    """
+    n = len(values)
+    if np is not None:
+        v = np.asarray(values, dtype='d')
+        s = np.concatenate(([0.0], np.cumsum(v)))
+        s2 = np.concatenate(([0.0], np.cumsum(v * v)))
+        mean, std = np.full(n, NAN), np.full(n, NAN)
+        end = np.arange(k, n + 1 - lag)
+        if len(end):
+            m = (s[end] - s[end - k]) / k
+            mean[k + lag - 1:] = m
+            std[k + lag - 1:] = np.sqrt(np.maximum((s2[end] - s2[end - k]) / k - m * m, 0.0))
+        return mean, std
+
+    s, s2 = [0.0], [0.0]
+    for v in values:
+        s.append(s[-1] + v)
+        s2.append(s2[-1] + v * v)
+    mean, std = [NAN] * n, [NAN] * n
+    for i in range(k + lag - 1, n):
+        end = i + 1 - lag
+        m = (s[end] - s[end - k]) / k
+        mean[i] = m
+        std[i] = math.sqrt(max((s2[end] - s2[end - k]) / k - m * m, 0.0))
+    return mean, std
+
+
+def rolling_indicators(prices, vwaps=None, ma_cross=None, zscore=None, bollinger=None):
+    """Bulk mode of `TickerEventTracker` indicators over a whole prices history, vectorized 
+    when numpy is installed. Returns dict of series aligned on prices (nan when undefined): 
+    ma_fast, ma_slow, zscore, bb_lo, bb_hi, vwap_dev and volatility (std of returns % over zscore window)
+    """
+    if np is not None:
+        p = np.asarray(prices, dtype='d')
+        vwaps = np.asarray(vwaps, dtype='d') if vwaps is not None else None
+        returns = np.diff(p) / p[:-1] * 100.0
+        div = lambda a, b: np.divide(a, b, out=np.full(np.shape(a), NAN), where=b > 0)
+        combine = lambda f, *series: f(*series)
+    else:
+        p = prices
+        returns = [(p[i] - p[i-1]) / p[i-1] * 100.0 for i in range(1, len(p))]
+        div = lambda a, b: a / b if b > 0 else NAN
+        combine = lambda f, *series: [f(*values) for values in zip(*series)]
+
+    result = dict()
+    if ma_cross:
+        result['ma_fast'] = rolling_stats(p, ma_cross[0])[0]
+        result['ma_slow'] = rolling_stats(p, ma_cross[1])[0]
+    if zscore:
+        # price compared against the previous ticks (excluding current)
+        mean, std = rolling_stats(p, zscore[0], lag=1)
+        result['zscore'] = combine(lambda v, m, d: div(v - m, d), p, mean, std)
+    if bollinger:
+        mean, std = rolling_stats(p, bollinger[0])
+        result['bb_lo'] = combine(lambda m, d: m - bollinger[1] * d, mean, std)
+        result['bb_hi'] = combine(lambda m, d: m + bollinger[1] * d, mean, std)
+    if vwaps is not None:
+        # vwap of -1 when not provided by datafeed
+        result['vwap_dev'] = combine(lambda v, w: div((v - w) * 100.0, w), p, vwaps)
+
+    # first price has no return
+    volatility = rolling_stats(returns, zscore[0] if zscore else 20)[1]
+    if np is not None:
+        result['volatility'] = np.concatenate(([NAN], volatility))
+    else:
+        result['volatility'] = [NAN] + volatility
+    return result
+
+
 def ticker_response_adapter(response, symbol, service_url):
     """ Bitstamp: high->Last24h high, low->Last24h low, last->Last price, open->First of day, bid->Highest buy order, ask->Lowest sell order, volume-> Last24h vol, vwap->Last-24h vol weighted avg price, timestamp->Unix t
                     {"high","last", "timestamp", "bid", "vwap", "volume", "low", "ask", "open"}
@@ -421,46 +2157,105 @@ def ticker_response_adapter(response, symbol, service_url):
             {"error":[],"result":{"XXBTZUSD":{"a":["","",""],"b":["6.7","3","3.0"],"c":["6.3","0.087"],"v":["6.5","96."],"p":["7.8","71.7"],"t":[1,2],"l":["6.1","6.1"],"h":["7.5","7.0"],"o":"7.1"}}}
             {"error":[],"result":{"XTZUSD":{"a":["1.963400","1135","1135.000"],"b":["1.960200","829","829.000"],"c":["1.953400","169.08065753"],"v":["162651.08050865","733026.03677556"],"p":["1.929881","1.904369"],"t":[397,1553],"l":["1.896800","1.894300"],"h":["1.993500","2.007000"],"o":"1.974000"}}}
     """
-    # Adapt custom responses
-    values = None
-    if service_url.lower().find('bitstamp') > -1:
-        values = dict(current=  response['last'],
-                      open=     response['open'],
-                      timestamp=response['timestamp'],
-                      high=     response.get('high',-1),
-                      low=      response.get('low',-1),
-                      volume=   response.get('volume',-1),
-                      bid=      response.get('bid',-1),
-                      ask=      response.get('ask',-1),
-                      vwap=     response.get('vwap',-1))
-    elif service_url.lower().find('kraken') > -1:
-        if len(response['result'].keys()) != 1:
-            raise Exception("Adapter received Unexpected response '{}' from {}".format(response['result'], service_url))
-        else:
-            symbol_key = list(response['result'].keys())[0]
-            values = dict(current=  response['result'][symbol_key]['c'][0],
-                      open=     response['result'][symbol_key]['o'],
-                      high=     response['result'][symbol_key]['h'][0],
-                      low=      response['result'][symbol_key]['l'][0],
-                      volume=   response['result'][symbol_key]['p'][0],
-                      bid=      response['result'][symbol_key]['b'][0],
-                      ask=      response['result'][symbol_key]['a'][0],
-                      vwap=     response['result'][symbol_key]['p'][1])
-    elif service_url.lower().find('bitfinex') > -1:
-        values = dict(current=  response['last_price'],
-                      open=     response.get('open'),
-                      timestamp=response['timestamp'],
-                      high=     response.get('high',-1),
-                      low=      response.get('low',-1),
-                      volume=   response.get('volume',-1),
-                      bid=      response.get('bid',-1),
-                      ask=      response.get('ask',-1))
-    else:
+    adapter = resolve_adapter(service_url=service_url)
+    if adapter is None:
         raise Exception("Adapter does not support this service '{}'".format(service_url))
-    return Ticker(symbol, values)
-    
+    return adapter(response, symbol)
+
+def tick_time(timestamp):
+    return float(timestamp) if timestamp else datetime.utcnow().timestamp()
+
+def bitstamp_adapter(response, symbol):
+    get = response.get
+    return Ticker.from_row(symbol, (float(response['last']), tick_time(response['timestamp']),
+                                    float(response['open']) if response['open'] else NAN,
+                                    float(get('high', -1)), float(get('low', -1)), float(get('volume', -1)),
+                                    float(get('bid', -1)), float(get('ask', -1)), float(get('vwap', -1)), -1.0))
+
+def kraken_adapter(response, symbol):
+    if len(response['result']) != 1:
+        raise Exception("Adapter received Unexpected response '{}'".format(response['result']))
+    for result in response['result'].values():
+        return kraken_ticker(symbol, result)
+
+def kraken_ticker(symbol, result):
+    return Ticker.from_row(symbol, (float(result['c'][0]), tick_time(None), float(result['o']) if result['o'] else NAN,
+                                    float(result['h'][0]), float(result['l'][0]), float(result['p'][0]),
+                                    float(result['b'][0]), float(result['a'][0]), float(result['p'][1]), -1.0))
+
+def bitfinex_adapter(response, symbol):
+    get = response.get
+    return Ticker.from_row(symbol, (float(response['last_price']), tick_time(response['timestamp']),
+                                    float(get('open')) if get('open') else NAN,
+                                    float(get('high', -1)), float(get('low', -1)), float(get('volume', -1)),
+                                    float(get('bid', -1)), float(get('ask', -1)), -1.0, -1.0))
+
+# adapter(response, symbol) -> Ticker of supported services, found by name in service url
+TICKER_ADAPTERS = dict(bitstamp=bitstamp_adapter, kraken=kraken_adapter, bitfinex=bitfinex_adapter)
+
+def resolve_adapter(name=None, service_url=None):
+    """Return the adapter named in yaml (ex. adapter: kraken), which is either registered or 
+    the dotted path of a custom function (ex. adapter: my_adapters.coinbase_adapter), 
+    otherwise the registered adapter found in service url (None when not found)
+    """
+    if name:
+        if name in TICKER_ADAPTERS:
+            return TICKER_ADAPTERS[name]
+        module_name, _, func_name = name.rpartition('.')
+        if not module_name:
+            raise Exception("Unknown adapter '{}'".format(name))
+        return getattr(importlib.import_module(module_name), func_name)
+    url = (service_url or '').lower()
+    for n, adapter in TICKER_ADAPTERS.items():
+        if url.find(n) > -1:
+            return adapter
+    return None
+
+def ticker_response_multi_adapter(response, symbols, service_url):
+    """Split a multi-symbol response into `Ticker`s returned as dict keyed by requested symbol,  
+    where `symbols` maps each requested symbol (ex. pair) to its Ticker symbol.
+        Kraken: {"error":[],"result":{"XXBTZUSD":{...},"XTZUSD":{...}}} (for pair=XBTUSD,XTZUSD)
+    """
+    if service_url.lower().find('kraken') == -1:
+        raise Exception("Adapter does not support multi-symbol response from service '{}'".format(service_url))
+    if response.get('error'):
+        raise Exception("Adapter received errors '{}' from {}".format(response['error'], service_url))
+
+    requested = {kraken_pair_key(r): r for r in symbols}
+    tickers = dict()
+    for symbol_key, result in response['result'].items():
+        r = requested.get(kraken_pair_key(symbol_key))
+        if r is None:
+            raise Exception("Adapter received unrequested symbol '{}' from {}".format(symbol_key, service_url))
+        tickers[r] = kraken_ticker(symbols[r], result)
+    missing = [r for r in symbols if r not in tickers]
+    if missing:
+        raise Exception("Adapter received no result for {} from {}".format(missing, service_url))
+    return tickers
+
+def kraken_values(result):
+    return dict(current=  result['c'][0],
+                open=     result['o'],
+                high=     result['h'][0],
+                low=      result['l'][0],
+                volume=   result['p'][0],
+                bid=      result['b'][0],
+                ask=      result['a'][0],
+                vwap=     result['p'][1])
+
+def kraken_pair_key(pair):
+    """Normalize Kraken pair names, ex. 'XXBTZUSD', 'XBTUSD', 'XBT/USD' and 'BTCUSD' all give 'XBTUSD'
+    """
+    p = pair.upper().replace('/', '')
+    # legacy names prefix assets with X (crypto) or Z (fiat)
+    if len(p) == 8 and p[0] in 'XZ' and p[4] in 'XZ':
+        p = p[1:4] + p[5:]
+    return p.replace('BTC', 'XBT')
+
 
 class Ticker(object):
+    __slots__ = ('symbol', 'current', 'timestamp', 'open', 'high', 'low', 'volume', 'bid', 'ask', 'vwap', 'mid')
+
     def __init__(self, symbol, values):
         self.symbol = symbol
         if type(values) != dict:
@@ -476,6 +2271,24 @@ class Ticker(object):
         # OHLC values and other possible values
         self.set_float_values(values, ('high','low','volume','bid','ask','vwap','mid'))
 
+    @classmethod
+    def from_row(cls, symbol, row):
+        """Build from float values ordered as `TICK_FIELDS` (nan for missing open)
+        """
+        t = cls.__new__(cls)
+        t.symbol = symbol
+        t.current, t.timestamp, t.open, t.high, t.low, t.volume, t.bid, t.ask, t.vwap, t.mid = row
+        t.timestamp = round(t.timestamp)
+        if t.open != t.open:
+            t.open = None
+        return t
+
+    def row(self):
+        """Values ordered as `TICK_FIELDS` (nan for missing open)
+        """
+        return (self.current, self.timestamp, NAN if self.open is None else self.open, self.high, self.low,
+                self.volume, self.bid, self.ask, self.vwap, self.mid)
+
     def set_float_values(self, values, keys):
         for k in keys:
             setattr(self, k, float(values.get(k,-1)))
@@ -527,6 +2340,497 @@ class Ticker(object):
         return t_s.format(t=self, now=n)
 
 
+NAN = math.nan
+# values of a tick, as stored in TickerHistory and tick files
+TICK_FIELDS = ('current', 'timestamp', 'open', 'high', 'low', 'volume', 'bid', 'ask', 'vwap', 'mid')
+
+class TickerHistory(object):
+    """Ring buffer of the last `depth` tickers of a symbol, stored as rows of `fields` values 
+    contiguous in a typed array (8 bytes per value) instead of a deque of `Ticker` objects. 
+    Like a deque, it supports append(), len() and indexing (ex. [-1] for last), returning 
+    a `Ticker` built from the row.
+    """
+    fields = TICK_FIELDS
+    width = len(TICK_FIELDS)
+    offsets = {f: i for i, f in enumerate(TICK_FIELDS)}
+
+    def __init__(self, symbol, depth=100):
+        self.symbol = symbol
+        self.depth = depth
+        self.rows = array('d', bytes(8 * self.width * depth))
+        # position of oldest ticker and number of tickers kept
+        self.start = 0
+        self.size = 0
+        # number of tickers ever appended
+        self.appended = 0
+
+    def append(self, ticker):
+        i = (self.start + self.size) % self.depth
+        if self.size == self.depth:
+            self.start = (self.start + 1) % self.depth
+        else:
+            self.size += 1
+        self.appended += 1
+        values = [getattr(ticker, f) for f in self.fields]
+        self.rows[i * self.width:(i + 1) * self.width] = array('d', [NAN if v is None else v for v in values])
+
+    def position(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("TickerHistory index out of range")
+        return (self.start + index) % self.depth
+
+    def value(self, field, index):
+        return self.rows[self.position(index) * self.width + self.offsets[field]]
+
+    def column(self, field):
+        """Values of field from oldest to last ticker
+        """
+        col = self.rows[self.offsets[field]::self.width]
+        end = self.start + self.size
+        if end <= self.depth:
+            return col[self.start:end]
+        return col[self.start:] + col[:end - self.depth]
+
+    def ordered_rows(self, last=None):
+        """Rows (concatenated) of the `last` tickers (all by default) from oldest to last
+        """
+        n = self.size if last is None else min(last, self.size)
+        first, w = (self.start + self.size - n) % self.depth, self.width
+        if first + n <= self.depth:
+            return self.rows[first * w:(first + n) * w]
+        return self.rows[first * w:] + self.rows[:(first + n - self.depth) * w]
+
+    def __getitem__(self, index):
+        i = self.position(index) * self.width
+        return Ticker.from_row(self.symbol, self.rows[i:i + self.width])
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (self[i] for i in range(self.size))
+
+    def get_state(self, since=None):
+        """Ring buffer as tuple((depth, start, size, appended), changes) with changes list of (offset, bytes) 
+        in rows: all rows, or only the rows of tickers appended after `since` (previous `appended`) when still kept
+        """
+        meta = (self.depth, self.start, self.size, self.appended)
+        n = self.size if since is None else self.appended - since
+        if n >= self.size:
+            return meta, [(0, self.rows.tobytes())]
+        w, first = self.width, (self.start + self.size - n) % self.depth
+        end = min(first + n, self.depth)
+        changes = [(8 * w * first, self.rows[first * w:end * w].tobytes())]
+        if first + n > self.depth:
+            changes.append((0, self.rows[:(first + n - self.depth) * w].tobytes()))
+        return meta, changes
+
+    def set_state(self, meta, rows):
+        depth, start, size, self.appended = meta
+        self.rows = array('d')
+        self.rows.frombytes(rows)
+        if depth != self.depth:
+            # history_depth changed since snapshot: keep its last tickers
+            saved = TickerHistory(self.symbol, depth)
+            saved.rows, saved.start, saved.size = self.rows, start, size
+            self.rows = saved.ordered_rows(self.depth)
+            start, size = 0, len(self.rows) // self.width
+            self.rows.frombytes(bytes(8 * self.width * (self.depth - size)))
+        self.start, self.size = start, size
+
+    def __repr__(self):
+        return "TickerHistory({}, {}/{} tickers)".format(self.symbol, self.size, self.depth)
+
+
+class StateSnapshot(object):
+    """State of trackers (see `TickerEventTracker.get_state`) saved in a file with the data bytes of 
+    all trackers stored contiguously in a fixed slot per tracker, followed by a journal of frames, 
+    each with the small metas of all trackers and the bytes changed in slots since previous frame. 
+    A frame is appended and synced before its changes are written in place to the slots (mapped 
+    in memory), so that a restart reads the file at once and reapplies the changes of last complete 
+    frame (ignoring a partially written one). Frames are written by a background thread, 
+    which compacts the file (slots and last frame only) when the journal exceeds the slots.
+    """
+    # magic, keys and slot sizes length, slots length
+    header = struct.Struct('<4sIQ')
+    # magic, metas length, changed bytes length, crc32
+    frame_header = struct.Struct('<4sIQI')
+    magic = b'SNP3'
+    frame_magic = b'SNF3'
+    # header only, with crc32 of the frame which changes were written to the slots
+    applied_magic = b'SNA3'
+
+    def __init__(self, path):
+        self.path = path
+        # frames queued (0: next must be full, with state of all trackers)
+        self.frames = 0
+        self.queue = queue.Queue()
+        self.thread = None
+        self.file = self.image = None
+
+    def full_due(self):
+        return self.frames == 0
+
+    def write(self, frame, full=False):
+        """Queue a frame (time, keys, metas, changes) to write: full frame (changes of each state 
+        covering all its data) creating a new file, or changes of states applied to current file
+        """
+        self.frames = 1 if full else self.frames + 1
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='state-snapshot', daemon=True)
+            self.thread.start()
+        self.queue.put((frame, full))
+
+    def run(self):
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is None:
+                    return
+                try:
+                    self.write_frame(*frame)
+                except Exception as ex:
+                    # next changes would not apply to the slots
+                    self.frames = 0
+                    print("Failed to write state snapshot: {}".format(ex))
+        finally:
+            self.close_file()
+
+    def write_frame(self, frame, full):
+        saved_time, keys, metas, changes = frame
+        if full:
+            datas = [b''.join(d for _, d in changed) for changed in changes]
+            layout = pickle.dumps((keys, [len(d) for d in datas]), protocol=pickle.HIGHEST_PROTOCOL)
+            self.metas, self.times = metas, [saved_time] * len(keys)
+            self.new_file(saved_time, layout, b''.join(datas))
+            return
+        if not keys:
+            return
+        self.map_file()
+        changed = list()
+        for k, meta, state_changes in zip(keys, metas, changes):
+            i, offset = self.slots[k]
+            self.metas[i], self.times[i] = meta, saved_time
+            changed.extend((offset + o, d) for o, d in state_changes)
+        frame = self.frame(saved_time, changed)
+        self.append(frame)
+        for o, d in changed:
+            self.image[o:o + len(d)] = d
+        self.image.flush()
+        self.append(self.frame_header.pack(self.applied_magic, 0, 0, self.frame_header.unpack_from(frame)[3]))
+        if self.end - self.slots_end > self.slots_end - self.slots_start:
+            self.new_file(saved_time, self.layout, self.image[self.slots_start:self.slots_end])
+
+    def append(self, frame):
+        with open(self.path, 'ab') as f:
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+            self.end = f.tell()
+
+    def frame(self, saved_time, changed):
+        metas = pickle.dumps((saved_time, self.metas, self.times, [(o, len(d)) for o, d in changed]),
+                             protocol=pickle.HIGHEST_PROTOCOL)
+        data = b''.join(d for _, d in changed)
+        return b''.join([self.frame_header.pack(self.frame_magic, len(metas), len(data),
+                                                zlib.crc32(data, zlib.crc32(metas))), metas, data])
+
+    def new_file(self, saved_time, layout, slots):
+        """Replace the file by one with slots and a frame of current metas, mapped in memory for next frames
+        """
+        self.close_file()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.header.pack(self.magic, len(layout), len(slots)))
+            f.write(layout)
+            f.write(slots)
+            f.write(self.frame(saved_time, []))
+            f.flush()
+            os.fsync(f.fileno())
+            self.end = f.tell()
+        os.replace(tmp, self.path)
+        self.layout = layout
+        self.slots_start = self.header.size + len(layout)
+        self.slots_end = self.slots_start + len(slots)
+        self.slots, offset = dict(), self.slots_start
+        for i, (k, size) in enumerate(zip(*pickle.loads(layout))):
+            self.slots[k] = (i, offset)
+            offset += size
+        self.map_file()
+
+    def map_file(self):
+        if self.image is None and self.slots_end > self.slots_start:
+            self.file = open(self.path, 'r+b')
+            self.image = mmap.mmap(self.file.fileno(), self.slots_end)
+
+    def close_file(self):
+        if self.image is not None:
+            self.image.close()
+            self.file.close()
+            self.file = self.image = None
+
+    def close(self):
+        """Write queued frames and stop the writer thread
+        """
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def read(self):
+        """Return saved states as list of (key, time, meta, data as memoryview of its slot), mapping the file 
+        in memory (copy on write) and applying the changes of last complete frame to the slots when 
+        not written there (interrupted)
+        """
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        view = memoryview(data)
+        if len(data) < self.header.size or self.header.unpack_from(data)[0] != self.magic:
+            return []
+        _, layout_length, slots_length = self.header.unpack_from(data)
+        slots_start = self.header.size + layout_length
+        pos, frames, applied = slots_start + slots_length, list(), None
+        while pos + self.frame_header.size <= len(data):
+            magic, metas_length, data_length, crc = self.frame_header.unpack_from(data, pos)
+            start, pos = pos + self.frame_header.size, pos + self.frame_header.size + metas_length + data_length
+            if magic == self.applied_magic:
+                applied = crc
+            elif magic == self.frame_magic and pos <= len(data):
+                frames.append((start, metas_length, pos, crc))
+            else:
+                break
+        for start, metas_length, end, crc in reversed(frames):
+            if zlib.crc32(view[start:end]) == crc:
+                break
+        else:
+            return []
+        keys, sizes = pickle.loads(view[self.header.size:slots_start])
+        _, metas, times, changed = pickle.loads(view[start:start + metas_length])
+        if crc != applied:
+            pos = start + metas_length
+            for o, n in changed:
+                data[o:o + n] = view[pos:pos + n]
+                pos += n
+        offsets = itertools.accumulate(sizes, initial=slots_start)
+        return [(k, t, m, view[o:o + n]) for k, t, m, o, n in zip(keys, times, metas, offsets, sizes)]
+
+
+class TickFile(object):
+    """Compact binary tick file: magic header followed by fixed-width records of 
+    little-endian float64 values ordered as `TICK_FIELDS` (nan when missing)
+    """
+    magic = b'TICKS001'
+    record_size = 8 * len(TICK_FIELDS)
+
+    @classmethod
+    def write(cls, path, rows, append=False):
+        """Write rows (sequences of float ordered as TICK_FIELDS) and return the number written
+        """
+        values = array('d')
+        for row in rows:
+            values.extend(row)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        new_file = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, 'ab' if append else 'wb') as f:
+            if new_file:
+                f.write(cls.magic)
+            values.tofile(f)
+        return len(values) // len(TICK_FIELDS)
+
+    @classmethod
+    def read(cls, path, chunk=65536):
+        """Yield rows as tuples of float ordered as TICK_FIELDS, reading `chunk` records at a time
+        """
+        n = len(TICK_FIELDS)
+        with open(path, 'rb') as f:
+            if f.read(len(cls.magic)) != cls.magic:
+                raise Exception("Unsupported tick file '{}'".format(path))
+            while True:
+                values = array('d')
+                values.frombytes(f.read(chunk * cls.record_size))
+                if not values:
+                    break
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                yield from zip(*(values[i::n] for i in range(n)))
+
+    @classmethod
+    def columns(cls, path):
+        """Map the file in memory and return dict of field -> memoryview (strided over 
+        the records, no copy nor parsing), ex. columns(path)['current'][-100:]
+        """
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(cls.magic)] != cls.magic:
+            raise Exception("Unsupported tick file '{}'".format(path))
+        n = len(TICK_FIELDS)
+        end = len(cls.magic) + (len(mapped) - len(cls.magic)) // cls.record_size * cls.record_size
+        values = memoryview(mapped)[len(cls.magic):end]
+        if sys.byteorder == 'big':
+            swapped = array('d', values)
+            swapped.byteswap()
+            values = memoryview(swapped)
+        values = values.cast('d')
+        return {f: values[i::n] for i, f in enumerate(TICK_FIELDS)}
+
+
+class TickRecorder(object):
+    """Record tickers in TickFile's rotated per datafeed host, symbol and day 
+    (directory/HOST/SYMBOL/YYYYMMDD<suffix>.ticks, UTC day of ticker timestamp), skipping 
+    a ticker identical to the last recorded (same ticker of trackers sharing a pair). 
+    Tickers are buffered in memory and appended to files every `flush_every` sec by a 
+    background thread, so recording doesn't slow down trackers.
+    """
+    def __init__(self, directory, flush_every=5.0, suffix=''):
+        self.directory = directory
+        self.flush_every = flush_every
+        self.suffix = suffix
+        self.pending = dict()
+        self.last = dict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.recorded = 0
+
+    def path(self, host, symbol, timestamp):
+        day = datetime.utcfromtimestamp(timestamp).strftime('%Y%m%d')
+        return os.path.join(self.directory, host, symbol, day + self.suffix + '.ticks')
+
+    def files(self, host, symbol):
+        """Recorded files of host and symbol in chronological order
+        """
+        d = os.path.join(self.directory, host, symbol)
+        if not os.path.isdir(d):
+            return []
+        return [os.path.join(d, f) for f in sorted(os.listdir(d)) if f.endswith('.ticks')]
+
+    def record(self, host, ticker):
+        day = ticker.timestamp // 86400
+        with self.lock:
+            row = array('d', ticker.row())
+            # compared as bytes, as nan (missing value) != nan
+            if self.last.get((host, ticker.symbol)) == row.tobytes():
+                return
+            self.last[(host, ticker.symbol)] = row.tobytes()
+            values = self.pending.get((host, ticker.symbol, day))
+            if values is None:
+                values = self.pending[(host, ticker.symbol, day)] = array('d')
+            values.extend(row)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, dict()
+        for (host, symbol, day), values in pending.items():
+            path = self.path(host, symbol, day * 86400)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.recorded += TickFile.write(path, (values,), append=True)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.flush_every):
+            try:
+                self.flush()
+            except Exception as ex:
+                print("Failed to record ticks: {}".format(ex))
+
+    def close(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+
+
+def read_csv_ticks(path):
+    """Yield rows ordered as TICK_FIELDS from csv with header containing at least timestamp 
+    and current price (also named 'last' or 'price'), other values being optional
+    """
+    aliases = dict(last='current', price='current')
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = [aliases.get(h.strip().lower(), h.strip().lower()) for h in next(reader)]
+        positions = [header.index(fld) if fld in header else None for fld in TICK_FIELDS]
+        defaults = dict(open=NAN)
+        for line in reader:
+            if line:
+                yield tuple(float(line[p]) if p is not None and line[p] != '' else defaults.get(fld, -1.0)
+                            for fld, p in zip(TICK_FIELDS, positions))
+
+def read_ticks(path):
+    """Rows from a csv or tick file, or from all tick files of a directory (ex. recorded for a symbol), 
+    files of a same day recorded by several shards being merged on timestamp
+    """
+    if os.path.isdir(path):
+        files = sorted(f for f in os.listdir(path) if f.endswith('.ticks'))
+        return (row for _, day_files in itertools.groupby(files, key=lambda f: f[:8])
+                for row in heapq.merge(*(TickFile.read(os.path.join(path, f)) for f in day_files),
+                                       key=lambda row: row[1]))
+    if path.lower().endswith('.csv'):
+        return read_csv_ticks(path)
+    return TickFile.read(path)
+
+
+def replay_ticks(trackers, tick_file):
+    """Stream a recorded tick file through the trackers, using tick timestamps as clock (for wait_time).
+    Return (timeline of (timestamp, event), counts per event kind, number of ticks)
+    """
+    timeline = list()
+    counts = Counter()
+    nb = 0
+    for t in trackers:
+        t.verbose = False
+    for row in read_ticks(tick_file):
+        nb += 1
+        for t in trackers:
+            for e in t.signal_ticker(Ticker.from_row(t.symbol, row)):
+                timeline.append((t.current_ticker.timestamp, e))
+                counts[getattr(e, 'kind', 'other')] += 1
+    return timeline, counts, nb
+
+def replay_symbol(tick_file, symbols):
+    """Symbol among `symbols` of a tick file recorded in a symbol directory (record_dir/.../SYMBOL), 
+    as tick files have no symbol column
+    """
+    d = tick_file if os.path.isdir(tick_file) else os.path.dirname(os.path.abspath(tick_file))
+    name = os.path.basename(os.path.normpath(d)).lower()
+    for s in symbols:
+        if str(s).lower() == name:
+            return s
+    raise Exception("Trackers of several symbols ({}) in config, give the symbol of tick file {}".format(
+                    ", ".join(sorted(map(str, symbols))), tick_file))
+
+def run_replay(yaml_content, tick_file, symbol=None):
+    """Replay entry point: trackers of the YAML config (only those of `symbol` when given) 
+    are setup (without any service) and fed from the tick file, events are printed. 
+    With trackers of several symbols, `symbol` defaults to the directory name of recorded tick file.
+    """
+    bot = load_bot(yaml_content)
+    symbols = set(t.params.get('symbol') for t in bot.event_trackers)
+    if symbol is None and len(symbols) > 1:
+        symbol = replay_symbol(tick_file, symbols)
+    trackers = [t for t in bot.event_trackers if symbol is None or t.params.get('symbol') == symbol]
+    for t in trackers:
+        t.setup()
+    start = time.perf_counter()
+    timeline, counts, nb = replay_ticks(trackers, tick_file)
+    elapsed = time.perf_counter() - start
+
+    for ts, e in timeline:
+        print("{} {}".format(datetime.fromtimestamp(ts), e.text))
+    print("\nReplayed {} ticks on {} tracker(s) in {:.2f} sec ({:.0f} ticks/sec)".format(
+          nb, len(trackers), elapsed, nb / elapsed if elapsed else 0))
+    for kind, c in sorted(counts.items()):
+        print("\t- {}: {}".format(kind, c))
+    return timeline, counts
+
+
 # gdrive = None
 # def setup_gdrive():
 #     global gdrive
@@ -572,6 +2876,30 @@ def setup_bot(yaml_content):
     """Main entry to configure and return a Bot based on YAML config file.
     It registers yaml classes, load YAML file and setup bot.
     """
+    bot = load_bot(yaml_content)
+    bot.setup()
+    #print("Finished setting up Bot--> {}".format(bot))
+    return bot
+
+def reload_bot(bot, yaml_content):
+    """Return new Bot of yaml_content reusing unchanged services and trackers of the running bot, 
+    or the running bot when the new config is invalid or fails to setup (ex. yaml read while written)
+    """
+    try:
+        new_bot = load_bot(yaml_content)
+    except Exception as e:
+        print("Invalid yaml config, keeping the running Bot: {!r}".format(e))
+        return bot
+    try:
+        new_bot.setup(previous=bot)
+    except Exception as e:
+        print("Failed to setup reloaded Bot, restarting the running Bot: {!r}".format(e))
+        # take back what was reused by (or rebuild what was shutdown for) the new Bot
+        bot.setup(previous=new_bot)
+        return bot
+    return new_bot
+
+def load_bot(yaml_content):
     def register_classes(classes):
         for c in classes:
             yaml.register_class(c)
@@ -579,39 +2907,135 @@ def setup_bot(yaml_content):
     yaml = ruamel.yaml.YAML()
     register_classes((Bot, NotificationService, 
                     ConsolNotificationService, EmailNotificationService, AndroidPushNotificationService,
-                    PushBulletNotificationService, DataFeedService, SimpleTickerDataFeed, 
+                    PushBulletNotificationService, DataFeedService, SimpleTickerDataFeed, StreamingTickerDataFeed,
                     EventTracker, TickerEventTracker))
     bot = yaml.load(yaml_content)
-    bot.setup()
-    #print("Finished setting up Bot--> {}".format(bot))
+    # keep definitions (as loaded, before setup) to find what changed on reload
+    for o in bot.notification_services + bot.datafeed_services + bot.event_trackers:
+        o._yaml_def = yaml_definition(o)
     return bot
+
+def yaml_definition(value):
+    """Comparable representation of a value loaded from yaml (including nested objects)
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return repr(value)
+    elif isinstance(value, dict):
+        return repr(sorted((str(k), yaml_definition(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return repr([yaml_definition(v) for v in value])
+    elif hasattr(value, '__dict__'):
+        atts = {k: v for k, v in vars(value).items() if not k.startswith('_')}
+        return value.__class__.__name__ + yaml_definition(atts)
+    return repr(value)
+
+
+class ConfigWatcher(object):
+    """Signal modifications of the yaml config: through inotify for local yaml on Linux (watching 
+    its directory, as editors often replace the file), otherwise by polling its modified date
+    """
+    # not IN_CREATE: a file just created is still empty (it is signaled once written and closed)
+    IN_CLOSE_WRITE, IN_MOVED_TO = 0x8, 0x80
+
+    def __init__(self, args):
+        self.args = args
+        self.fd = None
+        if args.local_yaml and sys.platform.startswith('linux'):
+            try:
+                self.fd = self.inotify_watch(os.path.dirname(os.path.abspath(args.local_yaml)))
+            except Exception as e:
+                print("Cannot use inotify ({}), polling yaml modified date".format(e))
+        if self.fd is None:
+            self.last_modified = get_yaml_modified_date(args)
+
+    def inotify_watch(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0 or libc.inotify_add_watch(fd, directory.encode(), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return fd
+
+    def wait(self, timeout):
+        """Wait up to timeout sec and return True when yaml config was modified
+        """
+        if self.fd is None:
+            time.sleep(timeout)
+            m_date = get_yaml_modified_date(self.args)
+            modified, self.last_modified = m_date != self.last_modified, m_date
+            return modified
+
+        name = os.path.basename(self.args.local_yaml).encode()
+        modified = False
+        deadline = time.monotonic() + timeout
+        while not modified:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                break
+            data = os.read(self.fd, 4096)
+            # struct inotify_event: int wd, uint32 mask, cookie, len, followed by name (padded with \0)
+            pos = 0
+            while pos < len(data):
+                _, _, _, length = struct.unpack_from('iIII', data, pos)
+                if data[pos+16:pos+16+length].rstrip(b'\0') == name:
+                    modified = True
+                pos += 16 + length
+        return modified
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
     
+def run_sharded(args, yaml_content):
+    sharded = ShardedBot(yaml_content, args.shards, args.shard_by)
+    sharded.start()
+    sharded.check_active()
+    watcher = ConfigWatcher(args)
+    print("Running schedules in {} shards, press Ctrl-C to stop!".format(args.shards))
+    try:
+        while True:
+            sharded.dispatch(timeout=scheduler.idle_seconds(limit=1))
+            scheduler.run_pending()
+            if watcher.wait(0):
+                print("Yaml config file was modified, rebalancing the shards!")
+                sharded.reload(get_yaml_content(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        sharded.stop()
+
 def get_args():
     parser = argparse.ArgumentParser(description="Bot to launch EventTracker(s) (defined in yaml config)")
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("-l", "--local_yaml", nargs="?", const="./yaml_conf/tracker_conf.yaml", help="Local Yaml filepath")
     group.add_argument("-g", "--gdrive_yaml", nargs="?", const="1Ac8hQrAkM5OdozdQ_JiS8IXIx7mwb1Dr", help="Google drive Yaml file-Id")
+    parser.add_argument("-r", "--replay", help="Replay a tick file (.csv or binary), or directory of recorded tick files, through the trackers instead of running them")
+    parser.add_argument("-s", "--symbol", help="Only replay trackers of this symbol (default: directory name of recorded tick file)")
+    parser.add_argument("--shards", type=int, help="Run trackers in this number of worker processes")
+    parser.add_argument("--shard_by", choices=('symbol', 'datafeed'), default='datafeed', help="Partition trackers by symbol or datafeed")
     return parser.parse_args()
               
 if __name__ == '__main__':
     args = get_args()
     yaml_content = get_yaml_content(args)
+    if args.replay:
+        run_replay(yaml_content, args.replay, args.symbol)
+        sys.exit()
+    if args.shards:
+        run_sharded(args, yaml_content)
+        sys.exit()
     bot = setup_bot(yaml_content)
     bot.check_active()
-    last_yaml_update = get_yaml_modified_date(args)
+    watcher = ConfigWatcher(args)
     print("Running schedules, press Ctrl-C to stop!")
     try:
         while True:
-            m_date = get_yaml_modified_date(args)
-            if last_yaml_update == m_date:
-                schedule.run_pending()
-            else:
-                del(bot)
-                print("Yaml config file was modified, relaunching the Bot!")
-                yaml_content = get_yaml_content(args)
-                bot = setup_bot(yaml_content)
-                last_yaml_update = m_date
-            time.sleep(1)
+            scheduler.run_pending()
+            # sleep until next due timer, or until config is modified
+            if watcher.wait(scheduler.idle_seconds(limit=60 if watcher.fd is not None else 1)):
+                print("Yaml config file was modified, reloading the Bot!")
+                bot = reload_bot(bot, get_yaml_content(args))
     except KeyboardInterrupt:
         pass
     except:
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of tracker components, ex.:
+    python tracker_bench.py pooling -n 2000
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import argparse
+import time
+import json
+import tracemalloc
+import tempfile
+import random
+import os
+from collections import deque
+import requests
+from tracker import *
+
+
+BITSTAMP_RESPONSE = {"high": "1.9935", "last": "1.9534", "timestamp": "1589302800", "bid": "1.9502", "vwap": "1.9298",
+                     "volume": "162651.08050865", "low": "1.8968", "ask": "1.9634", "open": "1.9740"}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 to allow keep-alive connections
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, avoid Nagle/delayed-ack stalls on kept-alive connections
+    disable_nagle_algorithm = True
+    body = json.dumps(BITSTAMP_RESPONSE).encode('utf-8')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handler=StubHandler):
+    """Start a local stub HTTP server in a daemon thread and return (server, base_url)
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def timed_requests(get, url, n):
+    latencies = list()
+    start = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        get(url)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    return n / elapsed, percentile(latencies, 50), percentile(latencies, 99)
+
+
+def bench_pooling(args):
+    server, base_url = start_stub_server()
+    url = base_url + "/bitstamp/ticker/{pair}"
+
+    unpooled = SimpleTickerDataFeed()
+    unpooled.url = url
+    unpooled.setup()
+    pooled = SimpleTickerDataFeed()
+    pooled.url = url
+    pooled.setup()
+    # previous behaviour: module-level requests.get opens a new connection each call
+    unpooled.session = requests
+
+    for name, feed in (('requests.get (no pool)', unpooled), ('pooled session', pooled)):
+        rps, p50, p99 = timed_requests(lambda u: feed.request(dict(pair='xtzusd')), url, args.n)
+        print("{:<24} {:>8.0f} req/s   p50={:.3f} ms   p99={:.3f} ms".format(name, rps, p50 * 1000, p99 * 1000))
+    pooled.close()
+    server.shutdown()
+
+
+class DictTicker(object):
+    """Previous `Ticker` layout: values kept in a per-instance __dict__
+    """
+    def __init__(self, symbol, values):
+        self.symbol = symbol
+        for k, v in values.items():
+            setattr(self, k, float(v))
+
+
+def measure_memory(build, n):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(i) for i in range(n)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def bench_memory(args):
+    """Measure `sample` symbols fully filled with `ticks` tickers and extrapolate to `symbols`
+    (memory per symbol is constant once its history is full)
+    """
+    # as received from datafeeds, so that each ticker gets its own float objects
+    values = {k: str(v) for k, v in BITSTAMP_RESPONSE.items()}
+    values.update(current=values.pop('last'), mid='-1')
+
+    def deque_history(i):
+        d = deque(maxlen=args.ticks)
+        for _ in range(args.ticks):
+            d.append(DictTicker('S{}'.format(i), values))
+        return d
+
+    def columnar_history(i):
+        h = TickerHistory('S{}'.format(i), depth=args.ticks)
+        t = Ticker('S{}'.format(i), values)
+        for _ in range(args.ticks):
+            h.append(t)
+        return h
+
+    print("{} symbols x {} ticks (measured on {} symbols)".format(args.symbols, args.ticks, args.sample))
+    for name, build in (('deque of Ticker', deque_history), ('TickerHistory', columnar_history)):
+        size = measure_memory(build, args.sample)
+        total = size * args.symbols / args.sample
+        print("{:<18} {:>8.1f} bytes/tick   total {:>10.1f} MB".format(name, size / (args.sample * args.ticks), total / 2**20))
+
+
+def random_walk_ticks(n, start=1.0, seed=1):
+    rnd = random.Random(seed)
+    price = start
+    for i in range(n):
+        price *= 1 + rnd.gauss(0, 0.002)
+        yield (price, 1589302800 + i, start, price, price, 1000.0, price, price, price, -1.0)
+
+
+def bench_replay(args):
+    path = os.path.join(tempfile.mkdtemp(), 'XTZUSD.ticks')
+    TickFile.write(path, random_walk_ticks(args.n))
+    tracker = TickerEventTracker(SimpleTickerDataFeed(), symbol='XTZUSD', wait_time=60, max_day=5.0, max_lag=[1.0, -5],
+                                 ranges=['{:.2f}-{:.2f}'.format(lo / 100, lo / 100 + 0.02) for lo in range(50, 200, 3)],
+                                 **({'ma_cross': [10, 50], 'zscore': [50, 4.0]} if args.indicators else {}))
+    tracker.setup()
+    start = time.perf_counter()
+    timeline, counts, nb = replay_ticks([tracker], path)
+    elapsed = time.perf_counter() - start
+    print("{} ticks replayed in {:.2f} sec: {:.0f} ticks/sec, {:.1f}M ticks/min, {} events".format(
+          nb, elapsed, nb / elapsed, nb / elapsed * 60 / 1e6, len(timeline)))
+    os.remove(path)
+
+
+def bench_snapshot(args):
+    path = os.path.join(tempfile.mkdtemp(), 'state.snap')
+    trackers, rows = list(), list()
+    for i in range(args.n):
+        t = TickerEventTracker(SimpleTickerDataFeed(), symbol='S{}'.format(i), wait_time=60, max_day=5.0,
+                               max_lag=[1.0, -5], ma_cross=[10, 50], zscore=[50, 4.0], history_depth=args.ticks)
+        t.setup()
+        rows.append(list(random_walk_ticks(args.ticks + args.deltas, seed=i)))
+        for row in rows[-1][:args.ticks]:
+            t.tickers.append(Ticker.from_row(t.symbol, row))
+        trackers.append(t)
+    bot = Bot([], [], trackers)
+    bot.snapshot_file = path
+    bot.snapshots = StateSnapshot(path)
+    bot.snapshot_versions = dict()
+    bot.snapshot_trackers = bot.tracker_states()
+
+    def timed_snapshot():
+        start = time.perf_counter()
+        bot.snapshot()
+        queued = time.perf_counter() - start
+        bot.snapshots.close()
+        return queued, time.perf_counter() - start
+    queued, written = timed_snapshot()
+    print("{} trackers x {} ticks, full snapshot: {:.1f} ms on caller thread, {:.1f} ms written, {:.1f} MB".format(
+          args.n, args.ticks, queued * 1000, written * 1000, os.path.getsize(path) / 2**20))
+    # one new ticker per tracker between snapshots
+    deltas = list()
+    for d in range(args.deltas):
+        for i, t in enumerate(trackers):
+            t.tickers.append(Ticker.from_row(t.symbol, rows[i][args.ticks + d]))
+        deltas.append(timed_snapshot())
+    if deltas:
+        print("delta snapshots (1 new ticker/tracker): {:.1f} ms on caller thread, {:.1f} ms written "
+              "(max {:.1f} ms), {:.1f} MB after {}".format(
+              sum(q for q, _ in deltas) / len(deltas) * 1000, sum(w for _, w in deltas) / len(deltas) * 1000,
+              max(w for _, w in deltas) * 1000, os.path.getsize(path) / 2**20, args.deltas))
+    last = [(t.tickers[-1].current, t.returns.sum) for t in trackers]
+    for t in trackers:
+        t.setup()
+    # file mapped at once and one slice per tracker (changes of last frame already written to the slots)
+    start = time.perf_counter()
+    bot.restore()
+    restored = time.perf_counter() - start
+    assert [(t.tickers[-1].current, t.returns.sum) for t in trackers] == last
+    print("restore (after {} delta frames): {:.1f} ms".format(args.deltas, restored * 1000))
+    os.remove(path)
+
+
+def bench_recorder(args):
+    directory = tempfile.mkdtemp()
+    recorder = TickRecorder(directory)
+    tickers = [Ticker.from_row('XTZUSD', row) for row in random_walk_ticks(args.n)]
+    start = time.perf_counter()
+    for t in tickers:
+        recorder.record('api.kraken.com', t)
+    recorded = time.perf_counter() - start
+    start = time.perf_counter()
+    recorder.flush()
+    flushed = time.perf_counter() - start
+    print("record: {:.2f} us/tick, flush of {} ticks: {:.1f} ms".format(recorded / args.n * 1e6, args.n, flushed * 1000))
+
+    path = recorder.files('api.kraken.com', 'XTZUSD')[0]
+    start = time.perf_counter()
+    total = sum(row[0] for row in TickFile.read(path))
+    parsed = time.perf_counter() - start
+    start = time.perf_counter()
+    mapped = sum(TickFile.columns(path)['current'])
+    scanned = time.perf_counter() - start
+    assert total == mapped
+    print("sum of {} prices (1 day file): read rows {:.1f} ms, mmap column {:.1f} ms".format(
+          len(TickFile.columns(path)['current']), parsed * 1000, scanned * 1000))
+    if np is not None:
+        start = time.perf_counter()
+        np.asarray(TickFile.columns(path)['current']).sum()
+        print("sum of prices: mmap column with numpy {:.1f} ms".format((time.perf_counter() - start) * 1000))
+
+
+KRAKEN_RESPONSE = {"error": [], "result": {"XTZUSD": {
+    "a": ["1.963400", "1135", "1135.000"], "b": ["1.960200", "829", "829.000"], "c": ["1.953400", "169.08065753"],
+    "v": ["162651.08050865", "733026.03677556"], "p": ["1.929881", "1.904369"], "t": [397, 1553],
+    "l": ["1.896800", "1.894300"], "h": ["1.993500", "2.007000"], "o": "1.974000"}}}
+BITFINEX_RESPONSE = {"mid": "1.9568", "bid": "1.9502", "ask": "1.9634", "last_price": "1.9534", "low": "1.8968",
+                     "high": "1.9935", "volume": "162651.08050865", "timestamp": "1589302800.0"}
+
+
+def dict_ticker(response, symbol, url):
+    """Previous adaptation: dict of values (strings) converted by `Ticker.__init__`
+    """
+    if url.find('kraken') > -1:
+        return Ticker(symbol, kraken_values(list(response['result'].values())[0]))
+    r = response
+    return Ticker(symbol, dict(current=r.get('last', r.get('last_price')), open=r.get('open'), timestamp=r['timestamp'],
+                               high=r['high'], low=r['low'], volume=r['volume'], bid=r['bid'], ask=r['ask'],
+                               vwap=r.get('vwap', -1)))
+
+
+def bench_adapters(args):
+    for name, url, response in (('bitstamp', "https://www.bitstamp.net/api/v2/ticker/{pair}", BITSTAMP_RESPONSE),
+                                ('kraken', "https://api.kraken.com/0/public/Ticker?pair={pair}", KRAKEN_RESPONSE),
+                                ('bitfinex', "https://api.bitfinex.com/v1/pubticker/{pair}", BITFINEX_RESPONSE)):
+        adapter = resolve_adapter(service_url=url)
+        results = list()
+        for adapt in (lambda: dict_ticker(response, 'XTZUSD', url),
+                      lambda: ticker_response_adapter(response, 'XTZUSD', url),
+                      lambda: adapter(response, 'XTZUSD')):
+            start = time.perf_counter()
+            for _ in range(args.n):
+                adapt()
+            results.append(args.n / (time.perf_counter() - start))
+        print("{:<9} dict+Ticker {:>9.0f}/s   url lookup {:>9.0f}/s   bound adapter {:>9.0f}/s".format(name, *results))
+
+
+def bench_decode(args):
+    result = KRAKEN_RESPONSE['result']['XTZUSD']
+    fields = ('c', 'o', 'h', 'l', 'p', 'b', 'a')
+    decoders = [('r.json()', lambda content: response_of(content).json()),
+                ('json.loads', json.loads),
+                ('json.loads+fields', lambda content: project_fields(json.loads(content), fields))]
+    if fast_json is not None:
+        decoders += [(fast_json.__name__, fast_json.loads),
+                     (fast_json.__name__ + '+fields', lambda content: project_fields(fast_json.loads(content), fields))]
+    print("{:>6} {:>8}  ".format('pairs', 'bytes') + "".join("{:>20}".format(name) for name, _ in decoders))
+    for pairs in (1, 10, 100, 1000):
+        content = json.dumps(dict(error=[], result={"PAIR{}".format(i): result for i in range(pairs)})).encode('utf-8')
+        n = max(10, args.n // pairs)
+        timings = list()
+        for name, decode in decoders:
+            start = time.perf_counter()
+            for _ in range(n):
+                decode(content)
+            timings.append((time.perf_counter() - start) / n * 1e6)
+        print("{:>6} {:>8}  ".format(pairs, len(content)) + "".join("{:>17.1f} us".format(t) for t in timings))
+
+
+def response_of(content):
+    r = requests.Response()
+    r._content = content
+    r.status_code = 200
+    return r
+
+
+def bench_scheduler(args):
+    timers = TimerScheduler()
+    for i in range(args.timers):
+        timers.every(args.interval * (1 + i % 10 / 10.0), lambda: None, name='T{}'.format(i))
+    wakeups = 0
+    start = time.monotonic()
+    while time.monotonic() - start < args.duration:
+        timers.run_pending()
+        wakeups += 1
+        time.sleep(timers.idle_seconds())
+    runs = sum(t.runs for t in timers.jobs)
+    lateness = sorted(v for t in timers.jobs for v in t.lateness.values[:t.lateness.count])
+    jitter = [v for t in timers.jobs for v in t.jitter.values[:t.jitter.count]]
+    print("{} timers every {}-{} sec during {} sec: {} runs, {} wakeups".format(
+          args.timers, args.interval, args.interval * 1.9, args.duration, runs, wakeups))
+    print("lateness p50={:.3f} ms p99={:.3f} ms, jitter avg={:.3f} ms".format(
+          percentile(lateness, 50) * 1000, percentile(lateness, 99) * 1000, sum(jitter) / len(jitter) * 1000))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Tracker micro-benchmarks")
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('pooling', help="requests/sec and latency with and without connection pooling")
+    p.add_argument('-n', type=int, default=2000, help="Number of requests")
+    p.set_defaults(func=bench_pooling)
+    p = sub.add_parser('memory', help="memory of ticker history, deque of Ticker vs columnar TickerHistory")
+    p.add_argument('-s', '--symbols', type=int, default=10000, help="Number of symbols")
+    p.add_argument('-t', '--ticks', type=int, default=10000, help="History depth (ticks per symbol)")
+    p.add_argument('--sample', type=int, default=10, help="Number of symbols actually built")
+    p.set_defaults(func=bench_memory)
+    p = sub.add_parser('replay', help="ticks/sec replayed from a binary tick file through one tracker")
+    p.add_argument('-n', type=int, default=1000000, help="Number of ticks")
+    p.add_argument('--indicators', action='store_true', help="Also track rolling indicators")
+    p.set_defaults(func=bench_replay)
+    p = sub.add_parser('snapshot', help="time to snapshot and restore trackers state")
+    p.add_argument('-n', type=int, default=5000, help="Number of trackers")
+    p.add_argument('-t', '--ticks', type=int, default=100, help="History depth (ticks per tracker)")
+    p.add_argument('-d', '--deltas', type=int, default=19, help="Delta snapshots after the full one")
+    p.set_defaults(func=bench_snapshot)
+    p = sub.add_parser('recorder', help="cost of recording ticks and of scanning recorded files")
+    p.add_argument('-n', type=int, default=1000000, help="Number of ticks")
+    p.set_defaults(func=bench_recorder)
+    p = sub.add_parser('adapters', help="tickers/sec adapted from a response, per exchange")
+    p.add_argument('-n', type=int, default=200000, help="Number of responses adapted")
+    p.set_defaults(func=bench_adapters)
+    p = sub.add_parser('decode', help="decode time of json responses per size (Kraken pairs)")
+    p.add_argument('-n', type=int, default=20000, help="Number of single-pair responses decoded")
+    p.set_defaults(func=bench_decode)
+    p = sub.add_parser('scheduler', help="lateness and jitter of timers run by the TimerScheduler")
+    p.add_argument('-t', '--timers', type=int, default=100, help="Number of timers")
+    p.add_argument('-i', '--interval', type=float, default=0.1, help="Base interval (sec)")
+    p.add_argument('-d', '--duration', type=float, default=3, help="Duration (sec)")
+    p.set_defaults(func=bench_scheduler)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    args.func(args)
@@ -1,5 +1,15 @@
 import pytest
-from datetime import datetime 
+from datetime import datetime, timedelta
+import time
+import socket
+import threading
+import queue
+import struct
+import base64
+import hashlib
+import json
+import re
+import smtplib
 from tracker import *
 
 
@@ -58,3 +68,1062 @@ def test_tickerEventTracker():
     assert msgs[2].text == 'XTZUSD at 1.500 changes 87.50% from lag-1(0.800)'
     assert len(msgs) == 3
 
+
+
+class SlowTickerDataFeed(DataFeedService):
+    """Mock datafeed returning bitstamp-like responses after `delay` sec
+    """
+    def __init__(self, delay, prices, **params):
+        super().__init__(**params)
+        self.url = "bitstamp"
+        self.delay = delay
+        self.prices = prices
+        self.calls = 0
+
+    def request(self, request_params=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        return dict(last=self.prices[request_params['pair']], open=1.0, timestamp=datetime.now().timestamp())
+
+
+def test_asyncio_engine():
+    prices = dict(AAA=1.0, BBB=2.0, CCC=3.0)
+    feed = SlowTickerDataFeed(0.2, prices)
+    feed.max_inflight = 3
+    trackers = [TickerEventTracker(feed, request_params=dict(pair=p), symbol=p) for p in prices]
+    bot = Bot([], [feed], trackers)
+    bot.engine = 'asyncio'
+    bot.setup()
+    try:
+        start = time.time()
+        futures = [bot.executor.submit((t,)) for t in trackers]
+        # same tracker submitted twice runs after its first run
+        futures.append(bot.executor.submit((trackers[0],)))
+        for f in futures:
+            f.result(timeout=5)
+        elapsed = time.time() - start
+    finally:
+        bot.shutdown()
+    # 3 trackers run concurrently, the 2nd run of trackers[0] waits for its 1st run
+    assert elapsed < 0.2 * 3
+    assert feed.calls == 4
+    assert len(trackers[0].tickers) == 2
+    assert bot.executor is None
+
+
+def test_pooled_datafeed():
+    from tracker_bench import StubHandler, start_stub_server
+
+    class CountingHandler(StubHandler):
+        connections = 0
+        def setup(self):
+            CountingHandler.connections += 1
+            super().setup()
+
+    server, base_url = start_stub_server(CountingHandler)
+    feed = SimpleTickerDataFeed()
+    feed.url = base_url + "/bitstamp/{pair}"
+    feed.pool_size = 2
+    feed.compression = 'N'
+    feed.setup()
+    try:
+        for _ in range(5):
+            response = feed.request(dict(pair='xtzusd'))
+    finally:
+        feed.close()
+        server.shutdown()
+    assert response['last'] == "1.9534"
+    assert feed.session.headers['Accept-Encoding'] == 'identity'
+    # keep-alive connection reused across requests
+    assert CountingHandler.connections == 1
+
+
+class KrakenMockDataFeed(DataFeedService):
+    """Mock Kraken datafeed answering a comma-separated list of pairs
+    """
+    url = "https://api.kraken.com/0/public/Ticker?pair={pair}"
+    batch_param = 'pair'
+    result_keys = dict(XBTUSD='XXBTZUSD', XTZUSD='XTZUSD', ETHUSD='XETHZUSD')
+
+    def request(self, request_params=None):
+        self.requested.append(request_params['pair'])
+        result = dict()
+        for pair in request_params["pair"].split(","):
+            p = str(self.prices[pair])
+            result[self.result_keys[pair]] = {"a":[p,"1","1.0"],"b":[p,"1","1.0"],"c":[p,"1.0"],"v":["1","1"],
+                                              "p":[p,p],"t":[1,1],"l":[p,p],"h":[p,p],"o":"1.0"}
+        return {"error": [], "result": result}
+
+
+def test_batched_trackers():
+    feed = KrakenMockDataFeed()
+    feed.prices = dict(XBTUSD=1.5, XTZUSD=0.5, ETHUSD=1.0)
+    feed.requested = list()
+    trackers = [TickerEventTracker(feed, request_params=dict(pair=p), symbol=p, max_day=10.0) for p in feed.prices]
+    other = TickerEventTracker(feed, request_params=dict(pair='XBTUSD'), symbol='XBTUSD')
+    bot = Bot([], [feed], trackers + [other])
+    bot.run_schedules = [dict(tracker=t, interval='10 seconds') for t in trackers] + [dict(tracker=other, interval='1 minutes')]
+    bot.setup()
+
+    jobs = [j.args[0] for j in scheduler.jobs]
+    assert tuple(trackers) in jobs and (other,) in jobs
+    events = bot.signal_events(tuple(trackers), bot.fetch(tuple(trackers)))
+    assert feed.requested == ['XBTUSD,XTZUSD,ETHUSD']
+    assert [e.text for e in events] == ['XBTUSD at 1.500 changes 50.00% from open 1.0', 'XTZUSD at 0.500 changes -50.00% from open 1.0']
+    assert trackers[2].tickers[-1].current == 1.0
+    scheduler.clear()
+
+
+def test_kraken_multi_adapter():
+    response = {"error": [], "result": {"XXBTZUSD": {"a":["2"],"b":["2"],"c":["2","1"],"p":["2","2"],"l":["2"],"h":["2"],"o":"2"}}}
+    with pytest.raises(Exception, match="no result"):
+        ticker_response_multi_adapter(response, dict(XBTUSD='BTC', XTZUSD='XTZ'), 'kraken')
+    tickers = ticker_response_multi_adapter(response, {'XBT/USD': 'BTC'}, 'kraken')
+    assert tickers['XBT/USD'].symbol == 'BTC' and tickers['XBT/USD'].current == 2.0
+
+
+def test_datafeed_cache_and_merge():
+    class CountingDataFeed(SimpleTickerDataFeed):
+        calls = 0
+        def _request(self, request_params):
+            CountingDataFeed.calls += 1
+            time.sleep(0.1)
+            return dict(last=1.0, open=1.0)
+
+    feed = CountingDataFeed()
+    feed.url = "bitstamp/{pair}"
+    feed.cache_ttl = 60
+    feed.setup()
+    # identical concurrent requests merged into one call
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(lambda i: feed.request(dict(pair='xtzusd')), range(4)))
+    assert CountingDataFeed.calls == 1
+    assert all(r is responses[0] for r in responses)
+    # then served from cache, except for different url
+    feed.request(dict(pair='xtzusd'))
+    feed.request(dict(pair='btcusd'))
+    assert CountingDataFeed.calls == 2
+    assert feed.cache_stats == dict(hits=1, misses=2, merges=3)
+    assert feed.cache_report().endswith("(saved 4 exchange calls)")
+    # without coalescing, concurrent identical requests are all sent
+    CountingDataFeed.calls = 0
+    feed = CountingDataFeed()
+    feed.url = "bitstamp/{pair}"
+    feed.coalesce = 'N'
+    feed.setup()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        responses = list(pool.map(lambda i: feed.request(dict(pair='xtzusd')), range(2)))
+    assert CountingDataFeed.calls == 2 and responses[0] == responses[1]
+    assert feed.inflight == dict()
+
+
+class WebSocketStandIn(object):
+    """Minimal local WebSocket server (text frames only) recording received messages 
+    and pushing messages queued by tests on every open connection
+    """
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.url = "ws://127.0.0.1:{}/kraken".format(self.sock.getsockname()[1])
+        self.received = queue.Queue()
+        self.conns = list()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            request = b""
+            while not request.endswith(b"\r\n\r\n"):
+                request += conn.recv(1)
+            key = re.search(rb"Sec-WebSocket-Key: (\S+)", request).group(1).decode()
+            accept = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+            conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          "Sec-WebSocket-Accept: {}\r\n\r\n".format(accept)).encode())
+            self.conns.append(conn)
+            threading.Thread(target=self.read, args=(conn,), daemon=True).start()
+
+    def read(self, conn):
+        try:
+            while True:
+                b0, b1 = conn.recv(2)
+                length = b1 & 0x7f
+                if length == 126:
+                    length = struct.unpack(">H", conn.recv(2))[0]
+                mask = conn.recv(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(conn.recv(length)))
+                if b0 & 0x0f == 1:
+                    self.received.put(json.loads(payload))
+        except (OSError, ValueError):
+            pass
+
+    def push(self, message):
+        data = json.dumps(message).encode()
+        header = bytes([0x81, len(data)]) if len(data) < 126 else bytes([0x81, 126]) + struct.pack(">H", len(data))
+        self.conns[-1].sendall(header + data)
+
+    def drop_connections(self):
+        while self.conns:
+            c = self.conns.pop()
+            c.shutdown(socket.SHUT_RDWR)
+            c.close()
+
+    def close(self):
+        self.drop_connections()
+        self.sock.close()
+
+
+def kraken_ws_ticker(pair, price):
+    p = str(price)
+    return [42, {"a":[p,1,"1.0"],"b":[p,1,"1.0"],"c":[p,"1.0"],"v":["1","1"],"p":[p,p],"t":[1,1],
+                 "l":[p,p],"h":[p,p],"o":["1.0","1.1"]}, "ticker", pair]
+
+
+def start_stream(server, throttle=0):
+    feed = StreamingTickerDataFeed()
+    feed.url = server.url
+    feed.throttle = throttle
+    feed.reconnect_delay = 0.05
+    updates = queue.Queue()
+    trackers = [TickerEventTracker(feed, request_params=dict(pair=p), symbol=p.replace('/', ''), max_day=10.0)
+                for p in ('XTZ/USD', 'XBT/USD')]
+    bot = Bot([], [feed], trackers)
+    bot.stream_events = lambda tracker, ticker: updates.put((tracker.symbol, tracker.signal_ticker(ticker)))
+    bot.setup()
+    return bot, feed, updates
+
+
+def test_streaming_datafeed():
+    server = WebSocketStandIn()
+    bot, feed, updates = start_stream(server)
+    try:
+        subscribe = server.received.get(timeout=5)
+        assert subscribe == dict(event='subscribe', pair=['XTZ/USD', 'XBT/USD'], subscription=dict(name='ticker'))
+        server.push(dict(event='heartbeat'))
+        server.push(kraken_ws_ticker('XBT/USD', 1.5))
+        symbol, events = updates.get(timeout=5)
+        assert symbol == 'XBTUSD'
+        assert events[0].text == 'XBTUSD at 1.500 changes 50.00% from open 1.0'
+        assert scheduler.jobs == []
+
+        # reconnects and resubscribes after losing connection
+        server.drop_connections()
+        assert server.received.get(timeout=5)['event'] == 'subscribe'
+        server.push(kraken_ws_ticker('XTZ/USD', 1.05))
+        assert updates.get(timeout=5)[0] == 'XTZUSD'
+        assert feed.connections == 2
+    finally:
+        bot.shutdown()
+        server.close()
+
+
+def test_streaming_throttle():
+    server = WebSocketStandIn()
+    bot, feed, updates = start_stream(server, throttle=60)
+    try:
+        server.received.get(timeout=5)
+        for price in (1.0, 1.1, 1.2):
+            server.push(kraken_ws_ticker('XTZ/USD', price))
+        server.push(kraken_ws_ticker('XBT/USD', 2.0))
+        assert updates.get(timeout=5)[0] == 'XTZUSD'
+        # XTZ/USD updates within throttle window are held, other symbols not
+        assert updates.get(timeout=5)[0] == 'XBTUSD'
+        assert updates.empty()
+        assert feed.pending['XTZUSD']['current'] == "1.2"
+    finally:
+        bot.shutdown()
+        server.close()
+
+
+def test_ticker_history():
+    history = TickerHistory('XTZUSD', depth=3)
+    for i in range(5):
+        history.append(Ticker('XTZUSD', dict(current=i, open=None if i == 4 else 1.0, timestamp=100 + i)))
+    assert len(history) == 3
+    assert list(history.column('current')) == [2.0, 3.0, 4.0]
+    assert [t.current for t in history] == [2.0, 3.0, 4.0]
+    assert history[-1].open is None and history[-1].timestamp == 104
+    assert history[0].open == 1.0 and history[-3].current == 2.0
+    with pytest.raises(IndexError):
+        history[-4]
+    with pytest.raises(AttributeError):
+        history[0].other = 1
+
+
+def make_indicator_tracker(**params):
+    feed = SimpleTickerDataFeed()
+    feed.url = "bitstamp"
+    tracker = TickerEventTracker(feed, symbol='XTZUSD', **params)
+    tracker.setup()
+    return tracker
+
+
+def test_indicator_events():
+    tracker = make_indicator_tracker(ma_cross=[2, 4], zscore=[4, 3.0], bollinger=[4, 1.0], vwap_dev=5.0)
+    texts = list()
+    prices = [1.0, 1.01, 0.99, 1.0, 1.01, 0.99, 0.9, 0.89, 0.9, 1.2]
+    for i, p in enumerate(prices):
+        texts.append([e.text for e in tracker.signal_events(dict(last=p, open=None, vwap=0.95, timestamp=1000 + i))])
+    assert texts[2] == [] and texts[5] == []
+    assert texts[4] == ['XTZUSD at 1.010 MA2 crosses↑ MA4 (1.005/1.002)', 'XTZUSD at 1.010 deviates 6.32% from vwap 0.950']
+    # sudden drop: outlier vs previous 4 ticks, crosses averages, breaks lower band and deviates from vwap
+    assert texts[6] == ['XTZUSD at 0.900 has z-score -11.76 over 4 ticks (volatility 4.12%)',
+                        'XTZUSD at 0.900 MA2 crosses↓ MA4 (0.945/0.975)',
+                        'XTZUSD at 0.900 breaks↓ Bollinger band [0.931-1.019]',
+                        'XTZUSD at 0.900 deviates -5.26% from vwap 0.950']
+    # still below band: no new break
+    assert texts[7] == ['XTZUSD at 0.890 deviates -6.32% from vwap 0.950']
+    assert 'XTZUSD at 1.200 breaks↑ Bollinger band [0.841-1.104]' in texts[9]
+    assert 0 < tracker.volatility
+
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+def test_bulk_indicators(monkeypatch, with_numpy):
+    import tracker as tracker_module
+    if not with_numpy:
+        monkeypatch.setattr(tracker_module, 'np', None)
+    tracker = make_indicator_tracker(ma_cross=[3, 5], zscore=[5, 2.0], bollinger=[5, 2.0])
+    prices = [1.0 + ((i * 7) % 11) / 100.0 for i in range(30)]
+    for i, p in enumerate(prices):
+        tracker.signal_events(dict(last=p, open=1.0, vwap=1.05, timestamp=1000 + i))
+        if i == 28:
+            z_window = tracker.windows[5]
+            expected_z = (prices[29] - z_window.mean()) / z_window.std()
+
+    bulk = tracker.bulk_indicators()
+    assert len(bulk['zscore']) == 30
+    assert math.isnan(bulk['zscore'][4]) and math.isnan(bulk['ma_slow'][3])
+    assert bulk['zscore'][-1] == pytest.approx(expected_z)
+    assert bulk['ma_fast'][-1] == pytest.approx(sum(prices[-3:]) / 3)
+    assert bulk['ma_slow'][-1] == pytest.approx(tracker.windows[5].mean())
+    assert bulk['bb_hi'][-1] == pytest.approx(tracker.windows[5].mean() + 2.0 * tracker.windows[5].std())
+    assert bulk['vwap_dev'][-1] == pytest.approx((prices[-1] - 1.05) / 1.05 * 100.0)
+    assert bulk['volatility'][-1] == pytest.approx(tracker.volatility)
+
+
+def test_range_index():
+    import random
+    rnd = random.Random(7)
+    ranges = [(lo, lo + rnd.choice([0.5, 1, 2, 5])) for lo in (rnd.randint(0, 40) / 2.0 for _ in range(300))]
+    index = RangeIndex(ranges)
+    prev = Ticker('S', dict(current=0))
+    for _ in range(2000):
+        # on bounds and in-between
+        cur = Ticker('S', dict(current=rnd.randint(-4, 100) / 4.0))
+        expected = [(cur.range_action(prev, lo=lo, hi=hi), lo, hi) for lo, hi in sorted(set(ranges))]
+        assert index.moves(prev.current, cur.current) == [e for e in expected if e[0]]
+        prev = cur
+
+
+def test_overlapping_ranges():
+    tracker = TickerEventTracker(SimpleTickerDataFeed(), symbol='XTZUSD', ranges=['1.0-2.0', '1.5-3.0', '1.8-1.9'])
+    tracker.datafeed_service.url = "bitstamp"
+    tracker.setup()
+    tracker.signal_events(dict(last=1.2, open=1.2, timestamp=1000))
+    msgs = tracker.signal_events(dict(last=2.5, open=1.2, timestamp=1010))
+    assert [m.text for m in msgs] == ['XTZUSD at 2.500 (prev=1.200) exit{} [1.000-2.000]'.format(tracker.dir_symbol['up']),
+                                      'XTZUSD at 2.500 (prev=1.200) enter{} [1.500-3.000]'.format(tracker.dir_symbol['up']),
+                                      'XTZUSD at 2.500 (prev=1.200) cross{} [1.800-1.900]'.format(tracker.dir_symbol['up'])]
+
+
+REPLAY_YAML = """
+!Bot
+notification_services: []
+datafeed_services:
+  - &bitstamp !SimpleTickerDataFeed
+    url: "https://www.bitstamp.net/api/v2/ticker/{pair}"
+event_trackers:
+  - !TickerEventTracker
+    datafeed_service: *bitstamp
+    request_params: {pair: xtzusd}
+    params: {symbol: XTZUSD, ranges: ['1.1-1.2'], max_day: 10.0, wait_time: 60}
+  - !TickerEventTracker
+    datafeed_service: *bitstamp
+    request_params: {pair: btcusd}
+    params: {symbol: BTCUSD, max_day: 1.0}
+"""
+
+
+def test_replay(tmp_path, capsys):
+    rows = [(0.91, 1000, 1.0), (1.15, 1010, 1.0), (1.09, 1020, 1.0), (1.15, 1030, 1.0), (1.3, 1100, 1.0)]
+    csv_file = tmp_path / 'ticks.csv'
+    csv_file.write_text("timestamp,last,open\n" + "".join("{1},{0},{2}\n".format(*r) for r in rows))
+    bin_file = str(tmp_path / 'ticks.bin')
+    assert TickFile.write(bin_file, list(read_ticks(str(csv_file)))[:3]) == 3
+    assert TickFile.write(bin_file, list(read_ticks(str(csv_file)))[3:], append=True) == 2
+
+    for tick_file in (str(csv_file), bin_file):
+        timeline, counts = run_replay(REPLAY_YAML, tick_file, symbol='XTZUSD')
+        # events at 1030 are suppressed by wait_time, using tick timestamps as clock
+        assert [(ts, e.text) for ts, e in timeline] == [
+            (1010, 'XTZUSD at 1.150 (prev=0.910) enter{} [1.100-1.200]'.format(TickerEventTracker.dir_symbol['up'])),
+            (1010, 'XTZUSD at 1.150 changes 15.00% from open 1.0'),
+            (1020, 'XTZUSD at 1.090 (prev=1.150) exit{} [1.100-1.200]'.format(TickerEventTracker.dir_symbol['down'])),
+            (1100, 'XTZUSD at 1.300 (prev=1.150) exit{} [1.100-1.200]'.format(TickerEventTracker.dir_symbol['up'])),
+            (1100, 'XTZUSD at 1.300 changes 30.00% from open 1.0')]
+        assert counts == dict(range_enter=1, range_exit=2, changeday=2)
+    assert "Replayed 5 ticks on 1 tracker(s)" in capsys.readouterr().out
+    # tick files have no symbol column: symbol of recorded directory, or else required
+    with pytest.raises(Exception, match="several symbols"):
+        run_replay(REPLAY_YAML, bin_file)
+    (tmp_path / 'xtzusd').mkdir()
+    os.replace(bin_file, str(tmp_path / 'xtzusd' / '19700101.ticks'))
+    timeline, counts = run_replay(REPLAY_YAML, str(tmp_path / 'xtzusd'))
+    assert counts == dict(range_enter=1, range_exit=2, changeday=2)
+
+
+SHARDED_YAML = """
+!Bot
+dedup_window: 60
+notification_services: []
+datafeed_services:
+  - &stub1 !SimpleTickerDataFeed
+    url: "{url}/bitstamp/{{pair}}"
+  - &stub2 !SimpleTickerDataFeed
+    url: "{url}/bitstamp/v2/{{pair}}"
+event_trackers:
+  - &xtz !TickerEventTracker
+    datafeed_service: *stub1
+    request_params: {{pair: xtzusd}}
+    params: {{symbol: XTZUSD, max_day: 0.5, verbose: N}}
+  - &btc !TickerEventTracker
+    datafeed_service: *stub2
+    request_params: {{pair: btcusd}}
+    params: {{symbol: BTCUSD, max_day: 0.5, verbose: N}}
+  - &eth !TickerEventTracker
+    datafeed_service: *stub2
+    request_params: {{pair: ethusd}}
+    params: {{symbol: ETHUSD, max_day: 0.5, verbose: N}}
+run_schedules:
+  - {{tracker: *xtz, interval: 1 seconds}}
+  - {{tracker: *btc, interval: 1 seconds}}
+  - {{tracker: *eth, interval: 1 seconds}}
+"""
+
+
+def test_partition_trackers():
+    feeds = [SimpleTickerDataFeed(), SimpleTickerDataFeed()]
+    trackers = [TickerEventTracker(feeds[i % 2], symbol=s) for i, s in enumerate(['A', 'B', 'A', 'C', 'B'])]
+    assert partition_trackers(trackers, 2, 'datafeed') == [[0, 2, 4], [1, 3]]
+    assert partition_trackers(trackers, 3, 'symbol') == [[0, 2], [1, 4], [3]]
+    assert partition_trackers(trackers[:1], 2) == [[0], []]
+
+
+def test_sharded_bot():
+    from tracker_bench import start_stub_server
+    import urllib.request
+    server, base_url = start_stub_server()
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    yaml_content = SHARDED_YAML.format(url=base_url).replace("!Bot\n", "!Bot\nmetrics_port: {}\n".format(port))
+    sharded = ShardedBot(yaml_content, shards=2)
+    sharded.start()
+    try:
+        assert len(sharded.workers) == 2
+        texts = list()
+        deadline = time.time() + 10
+        while len(texts) < 3 and time.time() < deadline:
+            texts.extend(e.text for e in sharded.dispatch(timeout=0.5))
+        assert sorted(texts) == ['BTCUSD at 1.953 changes -1.04% from open 1.974',
+                                 'ETHUSD at 1.953 changes -1.04% from open 1.974',
+                                 'XTZUSD at 1.953 changes -1.04% from open 1.974']
+        # same events signaled again within dedup_window are dropped
+        time.sleep(1.5)
+        assert sharded.dispatch(timeout=0.5) == []
+        # each shard exports its metrics on its own port
+        assert all(w.is_alive() for w in sharded.workers)
+        for p in (port, port + 1):
+            assert 'tracker_events_total' in urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(p)).read().decode()
+    finally:
+        sharded.stop()
+        server.shutdown()
+
+
+def test_sharded_bot_stop(tmp_path):
+    from tracker_bench import start_stub_server
+    server, base_url = start_stub_server()
+    snapshot_file = str(tmp_path / 'state.snap')
+    options = "!Bot\nsnapshot_file: {}\nrecord_dir: {}\nrecord_every: 60\ndispatch: {{retries: 0}}\n".format(
+        snapshot_file, tmp_path / 'ticks')
+    yaml_content = SHARDED_YAML.format(url=base_url).replace("!Bot\n", options).replace(
+        "notification_services: []", "notification_services:\n  - !ConsolNotificationService {}")
+    sharded = ShardedBot(yaml_content, shards=2)
+    sharded.start()
+    try:
+        # notifications through dispatchers (dispatch option of Bot)
+        assert len(sharded.bot.dispatchers) == 1
+        texts = list()
+        deadline = time.time() + 10
+        while len(texts) < 3 and time.time() < deadline:
+            texts.extend(e.text for e in sharded.dispatch(timeout=0.5))
+        assert len(texts) == 3
+        # previous notification services closed on reload
+        previous = sharded.bot
+        sharded.reload(yaml_content)
+        assert not previous.dispatchers[0].thread.is_alive() and sharded.bot is not previous
+    finally:
+        sharded.stop()
+        server.shutdown()
+    # workers stopped cleanly: final state snapshot and buffered ticks written
+    assert not sharded.bot.dispatchers[0].thread.is_alive()
+    for i in range(2):
+        assert StateSnapshot('{}.shard{}'.format(snapshot_file, i)).read()
+    ticks = [row for d in (tmp_path / 'ticks').iterdir() for s in d.iterdir() for row in read_ticks(str(s))]
+    assert len(ticks) >= 3
+
+
+def test_sharded_bot_failing_notification():
+    sharded = ShardedBot(SHARDED_YAML, shards=1)
+    failing, other = RecordingNotificationService(failures=1), RecordingNotificationService()
+    sharded.bot = Bot([failing, other], [], [])
+    sharded.bot.setup_notifications()
+    # a failing service does not stop the notifier, nor the other services
+    sharded.notify([Event("e1")])
+    assert other.received == [['e1']]
+
+
+class FakeSMTP(object):
+    instances = list()
+
+    def __init__(self, host, port, context=None):
+        self.sent = list()
+        self.logins = 0
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def login(self, login, pwd):
+        self.logins += 1
+
+    def sendmail(self, sender, to, msg):
+        if self.closed:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent.append(msg.decode('utf-8'))
+
+    def quit(self):
+        self.closed = True
+
+
+def make_email_service(monkeypatch, **params):
+    import tracker as tracker_module
+    FakeSMTP.instances = list()
+    monkeypatch.setattr(smtplib, 'SMTP_SSL', FakeSMTP)
+    monkeypatch.setattr(tracker_module, 'pwd_saved', 'secret')
+    service = EmailNotificationService(smtp='smtp.test', login='me@test', to='you@test', **params)
+    service.setup()
+    return service
+
+
+def test_email_persistent_connection(monkeypatch):
+    service = make_email_service(monkeypatch)
+    service.notify([Event("first")])
+    service.notify([Event("second")])
+    assert len(FakeSMTP.instances) == 1 and FakeSMTP.instances[0].logins == 1
+    # reconnects when server closed the connection
+    FakeSMTP.instances[0].closed = True
+    service.notify([Event("third")])
+    assert len(FakeSMTP.instances) == 2 and "Subject: Tracker: third" in FakeSMTP.instances[1].sent[0]
+    service.close()
+    assert FakeSMTP.instances[1].closed
+    # services of a discarded config (not setup) or inactive have nothing to close
+    EmailNotificationService(smtp='smtp.test', login='me@test', to='you@test').close()
+    inactive = EmailNotificationService(smtp='smtp.test', login='me@test', to='you@test')
+    inactive.active = 'N'
+    inactive.setup()
+    inactive.close()
+
+
+def test_email_digest(monkeypatch):
+    service = make_email_service(monkeypatch, batch_every=0.2)
+    service.notify([Event("XTZ event")])
+    service.notify([Event("BTC event"), Event("ETH event")])
+    assert FakeSMTP.instances == []
+    time.sleep(0.4)
+    assert len(FakeSMTP.instances) == 1
+    digest = FakeSMTP.instances[0].sent
+    assert len(digest) == 1 and "Subject: Tracker: XTZ event || BTC event || ETH event" in digest[0]
+    # pending events are sent on close
+    service.notify([Event("last event")])
+    service.close()
+    assert "last event" in FakeSMTP.instances[0].sent[1]
+
+
+class RecordingNotificationService(NotificationService):
+    def _setup(self):
+        self.received = list()
+        self.failures = self.params.get('failures', 0)
+        self.delay = self.params.get('delay', 0)
+
+    def _notify(self, events):
+        time.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise Exception("service unavailable")
+        self.received.append([e.text for e in events])
+
+
+def test_notification_dispatch(tmp_path, capsys):
+    dead_letter = str(tmp_path / 'dead.jsonl')
+    slow = RecordingNotificationService(delay=0.3)
+    failing = RecordingNotificationService(failures=10)
+    flaky = RecordingNotificationService(failures=1)
+    bot = Bot([slow, failing, flaky], [], [])
+    bot.dispatch = dict(retries=2, backoff=0.01, dead_letter=dead_letter)
+    bot.setup()
+    start = time.time()
+    bot.notify_all([Event("e1")])
+    bot.notify_all([Event("e2")])
+    # notify_all does not wait for services
+    assert time.time() - start < 0.1
+    deadline = time.time() + 5
+    while bot.dispatchers[1].stats['dead'] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    bot.shutdown()
+    assert slow.received == [['e1'], ['e2']]
+    assert flaky.received == [['e1'], ['e2']]
+    assert failing.received == []
+    slow_d, failing_d, flaky_d = bot.dispatchers
+    assert flaky_d.stats['failures'] == 1 and flaky_d.stats['sent'] == 2
+    assert failing_d.stats['dead'] == 2 and failing_d.stats['failures'] == 6
+    dead = [json.loads(l) for l in open(dead_letter)]
+    assert [d['events'] for d in dead] == [['e1'], ['e2']] and dead[0]['error'] == "service unavailable"
+    assert slow_d.report().startswith("RecordingNotificationService: queue depth=0, sent=2, failures=0")
+
+
+@pytest.mark.parametrize('when_full, expected', [('merge', [['e0'], ['e1', 'e2', 'e3']]), ('drop', [['e0'], ['e3']])])
+def test_notification_dispatch_full(when_full, expected):
+    service = RecordingNotificationService(delay=0.2)
+    service.setup()
+    dispatcher = NotificationDispatcher(service, queue_size=1, when_full=when_full)
+    dispatcher.start()
+    dispatcher.put([Event("e0")])
+    time.sleep(0.05)
+    # e0 being sent, queue holds one batch
+    for i in (1, 2, 3):
+        dispatcher.put([Event("e{}".format(i))])
+    dispatcher.stop()
+    assert service.received == expected
+
+
+RELOAD_YAML = """
+!Bot
+notification_services:
+  - !ConsolNotificationService {{}}
+datafeed_services:
+  - &bitstamp !SimpleTickerDataFeed
+    url: "https://www.bitstamp.net/api/v2/ticker/{{pair}}"
+    timeout: {timeout}
+  - &kraken !SimpleTickerDataFeed
+    url: "https://api.kraken.com/0/public/Ticker?pair={{pair}}"
+event_trackers:
+  - &xtz !TickerEventTracker
+    datafeed_service: *bitstamp
+    request_params: {{pair: xtzusd}}
+    params: {{symbol: XTZUSD, max_day: 10.0}}
+  - &btc !TickerEventTracker
+    datafeed_service: *kraken
+    request_params: {{pair: XBTUSD}}
+    params: {{symbol: XBTUSD, max_day: {max_day}}}
+run_schedules:
+  - {{tracker: *xtz, interval: 10 seconds}}
+  - {{tracker: *btc, interval: 10 seconds}}
+"""
+
+
+def test_incremental_reload():
+    bot = setup_bot(RELOAD_YAML.format(timeout=10, max_day=5.0))
+    consol, bitstamp, kraken = bot.notification_services[0], bot.datafeed_services[0], bot.datafeed_services[1]
+    xtz, btc = bot.event_trackers
+    xtz.signal_ticker(Ticker('XTZUSD', dict(current=1.0, open=1.0, timestamp=1000)))
+
+    # same config: everything reused with its state
+    new_bot = load_bot(RELOAD_YAML.format(timeout=10, max_day=5.0))
+    new_bot.setup(previous=bot)
+    assert new_bot.notification_services == [consol] and new_bot.datafeed_services == [bitstamp, kraken]
+    assert new_bot.event_trackers == [xtz, btc] and len(xtz.tickers) == 1
+
+    # bitstamp changed: rebuilt with its tracker, kraken tracker changed: only tracker rebuilt
+    bot, new_bot = new_bot, load_bot(RELOAD_YAML.format(timeout=5, max_day=3.0))
+    new_bot.setup(previous=bot)
+    new_xtz, new_btc = new_bot.event_trackers
+    assert new_bot.datafeed_services[0] is not bitstamp and new_bot.datafeed_services[1] is kraken
+    assert new_xtz is not xtz and len(new_xtz.tickers) == 0 and new_xtz.datafeed_service is new_bot.datafeed_services[0]
+    assert new_btc is not btc and new_btc.max_day == 3.0 and new_btc.datafeed_service is kraken
+    assert new_bot.notification_services == [consol]
+    assert [j.args[0] for j in scheduler.jobs] == [(new_xtz,), (new_btc,)]
+
+    # invalid config (ex. read while being written) or failing setup: running Bot kept
+    assert reload_bot(new_bot, "") is new_bot
+    assert reload_bot(new_bot, RELOAD_YAML.format(timeout=5, max_day=3.0).replace("!Bot", "!Bot\nengine: bogus")) is new_bot
+    assert new_bot.datafeed_services[1] is kraken and new_bot.event_trackers == [new_xtz, new_btc]
+    assert [j.args[0] for j in scheduler.jobs] == [(new_xtz,), (new_btc,)]
+    new_bot.shutdown()
+    scheduler.clear()
+
+
+def test_config_watcher(tmp_path):
+    conf = tmp_path / 'tracker_conf.yaml'
+    conf.write_text("first")
+    watcher = ConfigWatcher(argparse.Namespace(local_yaml=str(conf), gdrive_yaml=None))
+    try:
+        assert watcher.fd is not None
+        assert not watcher.wait(0.05)
+        (tmp_path / 'other.yaml').write_text("other")
+        assert not watcher.wait(0.05)
+        # editors writing a new file then renaming it
+        (tmp_path / 'tmp.yaml').write_text("second")
+        os.replace(str(tmp_path / 'tmp.yaml'), str(conf))
+        assert watcher.wait(1)
+        conf.write_text("third")
+        assert watcher.wait(1)
+    finally:
+        watcher.close()
+
+
+def test_state_snapshot(tmp_path):
+    path = str(tmp_path / 'state.snap')
+    yaml_content = RELOAD_YAML.format(timeout=10, max_day=5.0).replace(
+        "!Bot\n", "!Bot\nsnapshot_file: {}\n".format(path))
+    bot = setup_bot(yaml_content)
+    xtz = bot.event_trackers[0]
+    xtz.setup_indicators()
+    xtz.signal_ticker(Ticker('XTZUSD', dict(current=1.0, open=1.0, timestamp=1000)))
+    bot.snapshot()
+    for i, p in enumerate([1.2, 1.1]):
+        xtz.signal_ticker(Ticker('XTZUSD', dict(current=p, open=1.0, timestamp=1060 + i * 60)))
+    xtz.lastime_rangevents['enter_up'] = 1060
+    bot.shutdown()
+    scheduler.clear()
+    # slot of each tracker with its last state
+    saved = {k: m for k, _, m, _ in StateSnapshot(path).read()}
+    assert len(saved) == 2 and [m[0][2:] for k, m in saved.items() if k.startswith('XTZUSD')] == [(3, 3)]
+
+    restored = setup_bot(yaml_content)
+    new_xtz, new_btc = restored.event_trackers
+    assert [t.current for t in new_xtz.tickers] == [1.0, 1.2, 1.1]
+    assert new_xtz.current_ticker.current == 1.1 and new_xtz.lastime_rangevents['enter_up'] == 1060
+    assert new_xtz.lastime_changeday == xtz.lastime_changeday and len(new_btc.tickers) == 0
+    new_xtz.signal_ticker(Ticker('XTZUSD', dict(current=1.3, open=1.0, timestamp=1200)))
+    restored.shutdown()
+    scheduler.clear()
+    # restarted Bot starts a new file with a full frame
+    states = StateSnapshot(path).read()
+    assert len(states) == 2
+
+    # a partially written last frame is ignored
+    with open(path, 'ab') as f:
+        f.write(StateSnapshot.frame_header.pack(StateSnapshot.frame_magic, 1000, 0, 0) + b'partial')
+    assert [(k, t, m, bytes(d)) for k, t, m, d in StateSnapshot(path).read()] == [
+        (k, t, m, bytes(d)) for k, t, m, d in states]
+
+    # from several files (shards), trackers restored from the file where saved last
+    shard = StateSnapshot(path + '.shard0')
+    xtz_state = [s for s in states if s[0].startswith('XTZUSD')]
+    shard.write((time.time() + 60, [s[0] for s in xtz_state], [s[2] for s in xtz_state],
+                 [[(0, bytes(s[3]))] for s in xtz_state]), full=True)
+    shard.write((time.time() + 120, [], [], []))
+    shard.close()
+    bot = load_bot(yaml_content)
+    bot.restore_files = [path + '.shard0', path + '.shard1', path]
+    bot.setup()
+    assert [t.current for t in bot.event_trackers[0].tickers] == [1.0, 1.2, 1.1, 1.3]
+    bot.shutdown()
+    scheduler.clear()
+
+
+def test_ticker_history_state():
+    history = TickerHistory('XTZUSD', depth=3)
+    for p in (1.0, 2.0, 3.0, 4.0):
+        history.append(Ticker('XTZUSD', dict(current=p, timestamp=p)))
+    meta, [(_, rows)] = history.get_state()
+    same, smaller = TickerHistory('XTZUSD', depth=3), TickerHistory('XTZUSD', depth=2)
+    same.set_state(meta, rows)
+    smaller.set_state(meta, rows)
+    assert [t.current for t in same] == [2.0, 3.0, 4.0] and [t.current for t in smaller] == [3.0, 4.0]
+    smaller.append(Ticker('XTZUSD', dict(current=5.0)))
+    assert [t.current for t in smaller] == [4.0, 5.0]
+    # only rows of tickers appended since a previous state (at end then start of the ring), or all when no longer kept
+    history.append(Ticker('XTZUSD', dict(current=5.0, timestamp=5.0)))
+    meta, [(_, rows)] = history.get_state()
+    since = history.appended
+    for p in (6.0, 7.0):
+        history.append(Ticker('XTZUSD', dict(current=p, timestamp=p)))
+    meta, changes = history.get_state(since)
+    assert [o // (8 * TickerHistory.width) for o, _ in changes] == [2, 0]
+    assert history.get_state(since - 2)[1] == [(0, history.rows.tobytes())]
+    rows = bytearray(rows)
+    for o, d in changes:
+        rows[o:o + len(d)] = d
+    same.set_state(meta, rows)
+    assert [t.current for t in same] == [5.0, 6.0, 7.0] and same[-1].timestamp == 7.0
+
+
+def test_state_snapshot_interrupted(tmp_path):
+    snapshot = StateSnapshot(str(tmp_path / 'state.snap'))
+    snapshot.write((1000, ['a', 'b'], ['meta a', 'meta b'], [[(0, b'a' * 4096)], [(0, b'b' * 4096)]]), full=True)
+    snapshot.write((1060, ['b'], ['meta b2'], [[(2, b'BB')]]))
+    snapshot.close()
+    saved = [('a', 1000, 'meta a', b'a' * 4096), ('b', 1060, 'meta b2', b'bbBB' + b'b' * 4092)]
+    assert [(k, t, m, bytes(d)) for k, t, m, d in StateSnapshot(snapshot.path).read()] == saved
+    # last frame without its changes written to the slots: written again on read
+    with open(snapshot.path, 'r+b') as f:
+        content = f.read()
+        f.seek(content.index(b'bbBB'))
+        f.write(b'bbbb')
+        f.truncate(len(content) - StateSnapshot.frame_header.size)
+    assert [(k, t, m, bytes(d)) for k, t, m, d in StateSnapshot(snapshot.path).read()] == saved
+
+
+def test_tick_recorder(tmp_path):
+    feed = KrakenMockDataFeed()
+    feed.prices = dict(XTZUSD=1.0)
+    feed.requested = list()
+    feed.setup()
+    trackers = [make_indicator_tracker(), make_indicator_tracker()]
+    for t in trackers:
+        t.datafeed_service = feed
+    bot = Bot([], [feed], trackers)
+    bot.recorder = recorder = TickRecorder(str(tmp_path), flush_every=60)
+    bot.notify_all = lambda events: None
+    host = feed.metric_name
+    assert host == 'api.kraken.com'
+    day = 1589241600
+    for i, p in enumerate([1.0, 1.1, 1.2, 1.3]):
+        ticker = Ticker('XTZUSD', dict(current=p, open=1.0, timestamp=day - 120 + i * 60))
+        # ticker of both trackers recorded once
+        for t in trackers:
+            bot.stream_events(t, ticker)
+    assert recorder.files(host, 'XTZUSD') == []
+    recorder.start()
+    recorder.close()
+    files = recorder.files(host, 'XTZUSD')
+    assert [os.path.basename(f) for f in files] == ['20200511.ticks', '20200512.ticks']
+    assert [row[0] for row in read_ticks(str(tmp_path / host / 'XTZUSD'))] == [1.0, 1.1, 1.2, 1.3]
+
+    columns = TickFile.columns(files[1])
+    assert list(columns['current']) == [1.2, 1.3] and list(columns['timestamp']) == [day, day + 60]
+    assert list(columns['open']) == [1.0, 1.0] and columns['mid'][-1] == -1.0
+
+    # files of another shard are merged on timestamp
+    shard = TickRecorder(str(tmp_path), suffix='.shard1')
+    shard.record(host, Ticker('XTZUSD', dict(current=1.25, timestamp=day + 30)))
+    shard.close()
+    assert os.path.basename(shard.files(host, 'XTZUSD')[1]) == '20200512.shard1.ticks'
+    assert [row[0] for row in read_ticks(str(tmp_path / host / 'XTZUSD'))] == [1.0, 1.1, 1.2, 1.25, 1.3]
+
+
+def doubled_adapter(response, symbol):
+    return Ticker(symbol, dict(current=response['price'] * 2, timestamp=response['time']))
+
+
+def test_ticker_adapters():
+    bitstamp = {"high": "1.9935", "last": "1.9534", "timestamp": "1589302800", "bid": "1.9502", "vwap": "1.9298",
+                "volume": "162651.08", "low": "1.8968", "ask": "1.9634", "open": "1.9740"}
+    expected = Ticker('XTZUSD', dict(current="1.9534", open="1.9740", timestamp="1589302800", high="1.9935",
+                                     low="1.8968", volume="162651.08", bid="1.9502", ask="1.9634", vwap="1.9298"))
+    assert bitstamp_adapter(bitstamp, 'XTZUSD').row() == expected.row()
+    kraken = {"error": [], "result": {"XTZUSD": {"a": ["1.9634", "1", "1.0"], "b": ["1.9602", "8", "8.0"],
+              "c": ["1.9534", "169.08"], "v": ["162651.08", "733026.03"], "p": ["1.9298", "1.9043"], "t": [397, 1553],
+              "l": ["1.8968", "1.8943"], "h": ["1.9935", "2.007"], "o": "1.9740"}}}
+    ticker = kraken_adapter(kraken, 'XTZUSD')
+    assert ticker.row()[2:] == (1.974, 1.9935, 1.8968, 1.9298, 1.9602, 1.9634, 1.9043, -1.0)
+    assert ticker.current == 1.9534 and abs(ticker.timestamp - time.time()) < 5
+
+    assert resolve_adapter(service_url="https://api.kraken.com/0/public/Ticker?pair={pair}") is kraken_adapter
+    assert resolve_adapter('bitstamp', "https://localhost/ticker") is bitstamp_adapter
+    assert resolve_adapter(service_url="https://localhost/ticker") is None
+    with pytest.raises(Exception):
+        resolve_adapter('coinbase')
+
+    # custom adapter bound from yaml, by dotted path
+    feed = SimpleTickerDataFeed()
+    feed.url, feed.adapter = "https://localhost/ticker", 'tracker_test.doubled_adapter'
+    feed.setup()
+    tracker = TickerEventTracker(feed, symbol='XTZUSD')
+    tracker.setup()
+    tracker.signal_events(dict(price=1.5, time=1589302800))
+    assert tracker.current_ticker.current == 3.0 and tracker.current_ticker.timestamp == 1589302800
+    feed.close()
+
+
+@pytest.mark.parametrize('decoder', ['fast', 'std'])
+def test_decode_response(decoder):
+    feed = SimpleTickerDataFeed()
+    feed.url, feed.decoder = "https://api.kraken.com/0/public/Ticker?pair={pair}", decoder
+    feed.setup()
+    assert feed.json_loads is (json.loads if decoder == 'std' or fast_json is None else fast_json.loads)
+    content = b'{"error":[],"result":{"XTZUSD":{"a":["1.9634","1","1.0"],"c":["1.9534","169.08"],"o":"1.9740"}}}'
+    assert feed.decode(content)['result']['XTZUSD']['c'] == ["1.9534", "169.08"]
+    feed.fields = {'c', 'o'}
+    assert feed.decode(content) == {"result": {"XTZUSD": {"c": ["1.9534", "169.08"], "o": "1.9740"}}}
+    feed.close()
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=20, burst=2)
+    start = time.monotonic()
+    waits = [bucket.acquire() for _ in range(5)]
+    assert waits[:2] == [0, 0] and waits[2] > 0
+    # 3 tokens after the burst at 20/sec
+    assert 0.13 < time.monotonic() - start < 0.3
+
+    bot = setup_bot(LIMITS_YAML.format(ohlc_limit=1.0))
+    a, b, c, d = [s.limiter for s in bot.datafeed_services]
+    assert a is b and a.rate == 1.0 and a.burst == 1
+    assert c is not a and c.rate == 1.0 and d is None
+    # limiters rebuilt from the new config on reload (not only lowered), also for reused services
+    new_bot = load_bot(LIMITS_YAML.format(ohlc_limit=4.0))
+    new_bot.setup(previous=bot)
+    ticker, ohlc = new_bot.datafeed_services[:2]
+    assert ticker is bot.datafeed_services[0] and ohlc is not bot.datafeed_services[1]
+    assert ticker.limiter is ohlc.limiter and ticker.limiter.rate == 2.0 and ticker.limiter.burst == 1
+    new_bot.shutdown()
+    scheduler.clear()
+
+
+LIMITS_YAML = """
+!Bot
+notification_services: []
+datafeed_services:
+  - !SimpleTickerDataFeed
+    url: "https://api.kraken.com/0/public/Ticker?pair={{pair}}"
+    rate_limit: 2.0
+    rate_burst: 5
+  - !SimpleTickerDataFeed
+    url: "https://api.kraken.com/0/public/OHLC?pair={{pair}}"
+    rate_limit: {ohlc_limit}
+  - !SimpleTickerDataFeed
+    url: "https://www.bitstamp.net/api/v2/ticker/{{pair}}"
+    rate_limit: 1.0
+  - !SimpleTickerDataFeed
+    url: "https://www.bitstamp.net/api/v2/ohlc/{{pair}}"
+event_trackers: []
+run_schedules: []
+"""
+
+
+ADAPTIVE_YAML = """
+!Bot
+adaptive: {edge: 1.0, volatile: 1.0, quiet: 0.1, min_factor: 0.25, max_factor: 4}
+notification_services:
+  - !ConsolNotificationService {}
+datafeed_services:
+  - &bitstamp !SimpleTickerDataFeed
+    url: "https://www.bitstamp.net/api/v2/ticker/{pair}"
+    rate_limit: 0.5
+event_trackers:
+  - &xtz !TickerEventTracker
+    datafeed_service: *bitstamp
+    request_params: {pair: xtzusd}
+    params: {symbol: XTZUSD, ranges: [2.0-2.5]}
+  - &btc !TickerEventTracker
+    datafeed_service: *bitstamp
+    request_params: {pair: btcusd}
+    params: {symbol: BTCUSD}
+run_schedules:
+  - {tracker: *xtz, interval: 8 seconds}
+  - {tracker: *btc, interval: 8 seconds}
+"""
+
+
+def test_adaptive_intervals():
+    bot = setup_bot(ADAPTIVE_YAML)
+    xtz, btc = bot.event_trackers
+    assert xtz.poll_factor() == 1.0
+    for i, p in enumerate([1.0, 1.001, 1.0, 1.98]):
+        xtz.signal_ticker(Ticker('XTZUSD', dict(current=p, timestamp=1000 + i)))
+    for i in range(3):
+        btc.signal_ticker(Ticker('BTCUSD', dict(current=9000.0, timestamp=1000 + i)))
+    assert xtz.poll_factor(**bot.adaptive) == 0.25 and btc.poll_factor(**bot.adaptive) == 4
+
+    xtz_job, btc_job = scheduler.jobs
+    bot.adapt_interval(btc_job, (btc,), 8)
+    assert btc_job.interval == 32
+    # xtz near range bound wants 2 sec, but with btc (1/32 req/sec) host is limited to 0.5 req/sec
+    bot.adapt_interval(xtz_job, (xtz,), 8)
+    assert xtz_job.interval == pytest.approx(2 * (1 / 2 + 1 / 32) / 0.5)
+    assert bot.poll_load[bot.datafeed_services[0].limiter] == pytest.approx(1 / 2 + 1 / 32)
+    bot.shutdown()
+    scheduler.clear()
+
+
+def test_timer_scheduler(monkeypatch):
+    timers = TimerScheduler()
+    runs = list()
+    fast = timers.every(0.05, runs.append, 'fast', name='fast')
+    timers.every(0.12, runs.append, 'slow')
+    start = time.monotonic()
+    while time.monotonic() - start < 0.5:
+        timers.run_pending()
+        time.sleep(timers.idle_seconds())
+    assert 9 <= runs.count('fast') <= 10 and 3 <= runs.count('slow') <= 4
+    # due times don't drift: always a multiple of the interval after the first one
+    assert fast.due == pytest.approx(start + 0.05 * (fast.runs + 1), abs=0.005)
+    assert fast.lateness.mean() < 0.01 and fast.max_lateness < 0.05 and fast.jitter.count == fast.runs - 1
+    assert timers.report().startswith("\nScheduling:\n\t- fast: ")
+
+    # late timer skips missed periods instead of running them all
+    fast.due = time.monotonic() - 0.26
+    assert fast.next_due(time.monotonic()) == pytest.approx(time.monotonic() + 0.04, abs=0.005)
+
+    daily = timers.daily('day', '10:30', runs.append, 'daily')
+    wait = daily.due - time.monotonic()
+    assert 0 < wait <= 86400
+    # run by the monotonic clock slightly before the wall-clock time: next run on the next day
+    import tracker as tracker_module
+    class EarlyDatetime(datetime):
+        @classmethod
+        def now(cls):
+            return datetime.combine(daily.scheduled.date(), daily.at) - timedelta(milliseconds=5)
+    monkeypatch.setattr(tracker_module, 'datetime', EarlyDatetime)
+    scheduled = daily.scheduled
+    assert daily.next_due(100.0) == pytest.approx(100.0 + 86400.005)
+    assert daily.scheduled == scheduled + timedelta(days=1)
+    timers.clear()
+    assert timers.jobs == [] and timers.idle_seconds(limit=1) == 1 and fast.due is None
+
+
+def test_schedule_ms_interval():
+    bot = setup_bot(RELOAD_YAML.format(timeout=10, max_day=5.0).replace('10 seconds', '500 ms'))
+    assert [(j.name, j.interval) for j in scheduler.jobs] == [('XTZUSD', 0.5), ('XBTUSD', 0.5)]
+    bot.shutdown()
+    scheduler.clear()
+
+
+def test_metrics_endpoint():
+    import urllib.request
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    bot = setup_bot(RELOAD_YAML.format(timeout=10, max_day=5.0).replace("!Bot\n", "!Bot\nmetrics_port: {}\n".format(port)))
+    try:
+        xtz = bot.event_trackers[0]
+        xtz.verbose = False
+        for i, p in enumerate([1.0, 1.2]):
+            xtz.signal_events(dict(last=p, open=1.0, timestamp=1000 + i))
+        metrics.observe('tracker_fetch_seconds', 0.003, datafeed='www.bitstamp.net')
+        assert metrics.enabled and bot.metrics_server.port == port
+
+        url = "http://127.0.0.1:{}".format(port)
+        text = urllib.request.urlopen(url + "/metrics").read().decode()
+        assert '# TYPE tracker_events_total counter\ntracker_events_total{kind="changeday"} 1\n' in text
+        assert 'tracker_adapter_seconds_count{datafeed="www.bitstamp.net"} 2\n' in text
+        assert 'tracker_fetch_seconds_bucket{datafeed="www.bitstamp.net",le="0.0025"} 0\n' in text
+        assert 'tracker_fetch_seconds_bucket{datafeed="www.bitstamp.net",le="0.005"} 1\n' in text
+        assert 'tracker_signal_seconds_count 2\n' in text
+        assert any(line.startswith('tracker_events_total{kind="changeday"}: 1') for line in metrics.summary())
+
+        assert urllib.request.urlopen(url + "/profile/start").read() == b"Profiling started\n"
+        time.sleep(0.05)
+        report = urllib.request.urlopen(url + "/profile/stop").read().decode()
+        assert report.splitlines()[1].split() == ['self%', 'total%', 'function']
+    finally:
+        bot.shutdown()
+        scheduler.clear()
+        metrics.enabled = False
+        metrics.clear()